@@ -0,0 +1,222 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+# record: magic, size of the payload and its crc32, then the compressed payload
+RECORD_HEADER = struct.Struct("<4sII")
+RECORD_MAGIC = b"TJE1"
+# payload: number of cells, edit time, length of the group id and the tool, then the texts and
+# the rows, cols, old values and new values columns
+ENTRY_HEADER = struct.Struct("<IdHH")
+
+JournalEntry = namedtuple("JournalEntry", ["rows", "cols", "old_values", "new_values", "group_id", "edit_date", "tool"])
+
+
+def encode_entry(rows, cols, old_values, new_values, group_id, edit_date, tool):
+    """Record of the journal for one edit group"""
+    group_id = b"" if group_id is None else str(group_id).encode("utf-8")
+    tool = (tool or "").encode("utf-8")
+    payload = b"".join(
+        (
+            ENTRY_HEADER.pack(len(rows), edit_date.timestamp(), len(group_id), len(tool)),
+            group_id,
+            tool,
+            np.asarray(rows, dtype="<i4").tobytes(),
+            np.asarray(cols, dtype="<i4").tobytes(),
+            np.asarray(old_values, dtype="<i8").tobytes(),
+            np.asarray(new_values, dtype="<i8").tobytes(),
+        )
+    )
+    payload = zlib.compress(payload, 1)
+    return RECORD_HEADER.pack(RECORD_MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_entry(payload):
+    payload = zlib.decompress(payload)
+    count, edit_time, group_id_size, tool_size = ENTRY_HEADER.unpack_from(payload)
+    offset = ENTRY_HEADER.size
+    group_id = payload[offset : offset + group_id_size].decode("utf-8") or None
+    offset += group_id_size
+    tool = payload[offset : offset + tool_size].decode("utf-8")
+    offset += tool_size
+    columns = []
+    for dtype in ("<i4", "<i4", "<i8", "<i8"):
+        columns.append(np.frombuffer(payload, dtype=dtype, count=count, offset=offset))
+        offset += count * np.dtype(dtype).itemsize
+    return JournalEntry(*columns, group_id, datetime.fromtimestamp(edit_time), tool)
+
+
+def read_journal(file_path):
+    """Entries of the journal file, up to the first incomplete or corrupted record (e.g. the
+    last one written when QGIS crashed)"""
+    entries = []
+    if not os.path.isfile(file_path):
+        return entries
+    with open(file_path, "rb") as journal_file:
+        data = journal_file.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        magic, size, crc = RECORD_HEADER.unpack_from(data, offset)
+        payload = data[offset + RECORD_HEADER.size : offset + RECORD_HEADER.size + size]
+        if magic != RECORD_MAGIC or len(payload) != size or zlib.crc32(payload) != crc:
+            break
+        try:
+            entries.append(decode_entry(payload))
+        except (zlib.error, struct.error, ValueError, UnicodeDecodeError):
+            break
+        offset += RECORD_HEADER.size + size
+    return entries
+
+
+def merge_entries(batch):
+    """Entries of the batch, with the consecutive entries of the same edit group and tool (e.g. the
+    pixels of an undo edited one by one) merged in one record with the date of the first one"""
+    groups = []
+    for command, entry in batch:
+        if command != "entry":
+            continue
+        if groups and entry[4] is not None and (groups[-1][0][4], groups[-1][0][6]) == (entry[4], entry[6]):
+            groups[-1].append(entry)
+        else:
+            groups.append([entry])
+    return [
+        tuple(np.concatenate(column) for column in zip(*(entry[:4] for entry in group), strict=True)) + group[0][4:]
+        for group in groups
+    ]
+
+
+class EditJournal:
+    """Append-only journal of the edit groups logged in the registry of the layer, next to the
+    thematic raster. The entries are queued by the edits and written in batches by a writer
+    thread, so the journal is replayed after a crash and a full save of the config compacts it
+    (the saved pixel logs already have them)"""
+
+    # seconds that the writer thread waits to gather the entries written in one batch
+    flush_interval = 0.5
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.queue = queue.Queue()
+        self.thread = None
+        # last error writing the journal (e.g. read-only directory or disk full), see take_error
+        self.error = None
+
+    @staticmethod
+    def journal_path(raster_path):
+        """Journal file next to the thematic raster"""
+        return os.path.splitext(raster_path)[0] + "_thrase_journal.bin"
+
+    def has_entries(self):
+        return os.path.isfile(self.file_path) and os.path.getsize(self.file_path) > 0
+
+    def read(self):
+        self.flush()
+        return read_journal(self.file_path)
+
+    def append(self, rows, cols, old_values, new_values, group_id, edit_date, tool):
+        """Queue the entry of an edit group, the arrays are copied"""
+        if not len(rows):
+            return
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="ThRasE edit journal", daemon=True)
+            self.thread.start()
+        entry = (
+            np.array(rows, dtype=np.int32),
+            np.array(cols, dtype=np.int32),
+            np.array(old_values, dtype=np.int64),
+            np.array(new_values, dtype=np.int64),
+            group_id,
+            edit_date,
+            tool,
+        )
+        self.queue.put(("entry", entry))
+
+    def run(self):
+        """Writer thread: append the entries queued in batches, then flush them to disk"""
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1][0] == "entry":
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            command, done = batch[-1]
+            try:
+                entries = [encode_entry(*entry) for entry in merge_entries(batch)]
+                if entries:
+                    with open(self.file_path, "ab") as journal_file:
+                        journal_file.write(b"".join(entries))
+                        journal_file.flush()
+                        os.fsync(journal_file.fileno())
+                if command == "truncate":
+                    with open(self.file_path, "wb"):
+                        pass
+            except OSError as err:
+                # the entries of the batch are lost, they are still in the registry in memory
+                self.error = err
+            finally:
+                if command != "entry":
+                    done.set()
+            if command == "stop":
+                return
+
+    def send(self, command):
+        """Send a command to the writer thread, after the entries queued, and wait for it"""
+        if self.thread is None or not self.thread.is_alive():
+            if command == "truncate" and os.path.isfile(self.file_path):
+                try:
+                    with open(self.file_path, "wb"):
+                        pass
+                except OSError as err:
+                    self.error = err
+            return
+        thread = self.thread
+        done = threading.Event()
+        self.queue.put((command, done))
+        # do not wait forever if the writer thread died
+        while not done.wait(1) and thread.is_alive():
+            pass
+
+    def take_error(self):
+        """Return the last error writing the journal, if any, and clear it"""
+        error, self.error = self.error, None
+        return error
+
+    def flush(self):
+        self.send("flush")
+
+    def compact(self):
+        """Empty the journal, after a full save of the pixel logs"""
+        self.send("truncate")
+
+    def close(self):
+        self.send("stop")
+        self.thread = None
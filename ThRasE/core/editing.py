@@ -18,40 +18,83 @@
  ***************************************************************************/
 """
 
+import contextlib
 import functools
+import itertools
 import math
 import os
+import tempfile
 import uuid
+import weakref
+import zlib
 from collections import OrderedDict
 from copy import deepcopy
 from datetime import datetime
-from shutil import move
 from typing import ClassVar
 
 import numpy as np
 import yaml
-from osgeo import gdal
 
 try:
     from yaml import CSafeDumper as SafeDumper
 except ImportError:
     from yaml import SafeDumper
 
-import itertools
-
-from qgis.core import Qgis, QgsGeometry, QgsPointXY, QgsRasterBlock
-from qgis.PyQt.QtCore import Qt
+from qgis.core import Qgis, QgsApplication, QgsGeometry, QgsPointXY, QgsRasterBlock, QgsRectangle, QgsTask
+from qgis.PyQt.QtWidgets import QPushButton
 
+from ThRasE.core.edit_journal import EditJournal
 from ThRasE.core.navigation import Navigation
+from ThRasE.core.pixel_log_store import PixelLogStore
 from ThRasE.core.registry import Registry
-from ThRasE.utils.others_utils import copy_band_metadata, copy_dataset_metadata, get_xml_style
+from ThRasE.core.snapshots import RasterSnapshots
+from ThRasE.utils.others_utils import get_xml_style
 from ThRasE.utils.qgis_utils import apply_symbology, get_source_from
-from ThRasE.utils.system_utils import block_signals_to, wait_process
+from ThRasE.utils.raster_utils import (
+    BLOCK_CACHE_TILE_SIZE,
+    DEFAULT_MEMORY_BUDGET,
+    QGIS_TO_NUMPY_DTYPE,
+    BlockCache,
+    ChangeSet,
+    RecodeCanceled,
+    array_to_block,
+    block_to_array,
+    cached_band_histogram,
+    check_recode_values,
+    forget_band_histogram,
+    get_band_histogram,
+    get_block_size,
+    get_file_signature,
+    group_cells_by_tile,
+    polyline_corridor_mask,
+    rasterize_geometry,
+    recode_array,
+    recode_raster_file,
+    rollback_raster_file,
+)
+from ThRasE.utils.system_utils import wait_process
+
+
+def check_no_global_edit_running():
+    """Check that no global edit is writing the file of the layer to edit in background"""
+    from ThRasE.thrase import ThRasE
+
+    if LayerToEdit.current.global_edit_task is not None:
+        ThRasE.dialog.MsgBar.pushMessage(
+            "A global edit is being applied to the thematic raster, wait until it finishes or cancel it",
+            level=Qgis.MessageLevel.Warning,
+            duration=10,
+        )
+        return False
+    return True
 
 
 def check_before_editing():
     from ThRasE.thrase import ThRasE
 
+    # check if a global edit is running in background over the file
+    if not check_no_global_edit_running():
+        return False
     # check if the recode pixel table is empty
     if not LayerToEdit.current.old_new_value:
         ThRasE.dialog.MsgBar.pushMessage(
@@ -60,6 +103,12 @@ def check_before_editing():
             duration=10,
         )
         return False
+    # check if the new values fit in the data type of the thematic raster
+    try:
+        check_recode_values(LayerToEdit.current.old_new_value, LayerToEdit.current.dtype)
+    except ValueError as err:
+        ThRasE.dialog.MsgBar.pushMessage(str(err), level=Qgis.MessageLevel.Warning, duration=10)
+        return False
     return True
 
 
@@ -90,6 +139,11 @@ def edit_layer(func):
 class LayerToEdit:
     instances: ClassVar[dict] = {}
     current = None
+    # memory budget (bytes) of the block windows processed at once in the global edits
+    memory_budget = DEFAULT_MEMORY_BUDGET
+    # number of worker processes for the global edits and the histogram, 1 to work in the QGIS
+    # process (default), set with the "ThRasE/workers" QGIS setting to opt in
+    workers = 1
 
     def __init__(self, layer, band):
         self.qgs_layer = layer
@@ -97,6 +151,18 @@ class LayerToEdit:
         self.file_path = get_source_from(layer)
         self.band = band
         self.bounds = layer.extent().toRectF().getCoords()  # (xmin , ymin, xmax, ymax)
+        self.width = self.data_provider.xSize()  # num columns
+        self.height = self.data_provider.ySize()  # num rows
+        # grid of the pixels, to convert between map coordinates and (row, col) indices
+        self.grid = PixelGrid(
+            self.bounds[0], self.bounds[3], layer.rasterUnitsPerPixelX(), layer.rasterUnitsPerPixelY()
+        )
+        self.dtype = np.dtype(QGIS_TO_NUMPY_DTYPE[self.data_provider.dataType(band)])  # native data type
+        # cache of the band values in tiles for the pixel value lookups, the edits write through it
+        block_size = get_block_size(self.file_path, band)
+        self.block_cache = BlockCache(self.read_window, self.width, self.height, block_size)
+        # copy-on-write snapshots of the band by native blocks, the edits save the blocks before writing them
+        self.snapshots = RasterSnapshots(self.file_path, band, self.width, self.height, block_size, self.dtype)
         # navigation
         self.navigation = Navigation(self)
         self.navigation_dialog = None  # Created only when navigation is explicitly enabled
@@ -109,30 +175,65 @@ class LayerToEdit:
         self.symbology = None
         # dictionary for quick search the new value based on the old value in the recode table
         self.old_new_value = {}
-        # setup decimal-place tolerance for comparing pixels, derived from pixel size
-        pixel_size = min(self.qgs_layer.rasterUnitsPerPixelX(), self.qgs_layer.rasterUnitsPerPixelY())
-        self.pixel_tolerance = 1 - math.floor(math.log10(abs(pixel_size))) + (1 if abs(pixel_size) >= 1 else 0)
-        # store the PixelLog store specific to this layer instance
-        self.pixel_log_store = {}
+        # class value -> row in the recode table, and the value highlighted from the mouse pointer
+        self.pixel_value_rows = {}
+        self.highlighted_value = None
+        # registry of the pixels edited specific to this layer instance
+        self.pixel_log_store = PixelLogStore(self.width)
         # registry of edits
         self.registry = Registry(self)
+        # journal of the edit groups logged in the registry, for the crash recovery
+        self.journal = EditJournal(EditJournal.journal_path(self.file_path))
         # nodata handling: "unset", "hide", or None (not yet decided)
         self.nodata_action = None
         # save config file
         self.config_file = None
+        # global edit (entire raster or within a mask) running in background
+        self.global_edit_task = None
+        # change sets of the global edits applied in the session, rolled back the last one first
+        self.change_sets = []
+        # live pixel count of each value in the band {value: count}, updated with the edits
+        self.histogram = None
+        # histogram read in background, and the number of edits to know if it missed some
+        self.histogram_task = None
+        self.edits_count = 0
 
         LayerToEdit.instances[(layer.id(), band)] = self
 
     def extent(self):
         return self.qgs_layer.extent()
 
+    def get_pixel_position(self, x, y):
+        """Column and row of the pixel at the map coordinates"""
+        return self.grid.position(x, y)
+
+    def is_nodata(self, value):
+        provider = self.data_provider
+        if not (provider.sourceHasNoDataValue(self.band) and provider.useSourceNoDataValue(self.band)):
+            return False
+        nodata = provider.sourceNoDataValue(self.band)
+        return value == nodata or (math.isnan(nodata) and math.isnan(value))
+
     def get_pixel_value_from_xy(self, x, y):
-        return self.data_provider.identify(QgsPointXY(x, y), Qgis.RasterIdentifyFormat.Value).results()[
-            self.band
-        ]
+        """Value of the pixel at the map coordinates from the block cache, None if it is nodata
+        or it is outside the raster"""
+        value = self.block_cache.get_value(*self.get_pixel_position(x, y))
+        return None if value is None or self.is_nodata(value) else value
 
     def get_pixel_value_from_pnt(self, point):
-        return self.data_provider.identify(point, Qgis.RasterIdentifyFormat.Value).results()[self.band]
+        return self.get_pixel_value_from_xy(point.x(), point.y())
+
+    def get_pixel_value(self, pixel):
+        """Value of the pixel from the block cache, None if it is nodata or it is outside the raster"""
+        value = self.block_cache.get_value(pixel.col, pixel.row)
+        return None if value is None or self.is_nodata(value) else value
+
+    def get_pixel_values(self, pixels):
+        """Values of the pixels, reading each tile of the block cache once"""
+        if not pixels:
+            return []
+        values = self.block_cache.get_values([pixel.col for pixel in pixels], [pixel.row for pixel in pixels])
+        return [None if self.is_nodata(value) else value for value in values.tolist()]
 
     def setup_pixel_table(self, force_update=False, nodata=None):
         if self.pixels is None or force_update is True:
@@ -187,67 +288,272 @@ class LayerToEdit:
 
         apply_symbology(self.qgs_layer, self.band, self.symbology)
 
+    @wait_process
+    def get_pixel_counts(self):
+        """Return the live pixel count of each value in the band {value: count}, the histogram
+        is read once (cached per file and band) and then updated with the edits"""
+        if self.histogram is None:
+            self.histogram = dict(
+                get_band_histogram(self.file_path, self.band, LayerToEdit.memory_budget, LayerToEdit.workers)
+            )
+        return self.histogram
+
+    def load_pixel_counts(self, on_loaded, background=True):
+        """Return the live pixel counts if they are known (or cached for the file), otherwise
+        read them in background and call on_loaded() when the histogram is set
+
+        Returns:
+            dict or None: {value: count}, None while the histogram is being read
+        """
+        if self.histogram is None:
+            histogram = cached_band_histogram(self.file_path, self.band)
+            if histogram is not None:
+                self.histogram = dict(histogram)
+        if self.histogram is not None or self.histogram_task is not None:
+            return self.histogram
+
+        task = HistogramTask(self, on_loaded)
+        if not background:
+            task.finished(task.run())
+            return self.histogram
+        self.histogram_task = task
+        QgsApplication.taskManager().addTask(task)
+        return None
+
+    def update_pixel_counts(self, old_values, new_values):
+        """Update the live histogram with the pixels changed from the old to the new values
+
+        Args:
+            old_values, new_values: values before and after the edit of each pixel changed
+        """
+        if self.histogram is None or not len(old_values):
+            # counted once here or in update_pixel_counts_by_change, see HistogramTask
+            self.edits_count += 1
+            return
+        try:
+            pairs = np.stack([np.asarray(old_values, self.dtype), np.asarray(new_values, self.dtype)], axis=1)
+        except (ValueError, TypeError):
+            # unknown old value (e.g. nodata read as None), the histogram is read again when needed
+            self.edits_count += 1
+            self.histogram = None
+            return
+        pairs, counts = np.unique(pairs, axis=0, return_counts=True)
+        value_changes = {tuple(pair): count for pair, count in zip(pairs.tolist(), counts.tolist(), strict=True)}
+        self.update_pixel_counts_by_change(value_changes)
+
+    def update_pixel_counts_by_change(self, value_changes):
+        """Update the live histogram with the pixel count changed per recode
+        {(old_value, new_value): count}, and refresh the counts shown"""
+        from ThRasE.thrase import ThRasE
+
+        self.edits_count += 1
+        if self.histogram is None:
+            return
+        for (old_value, new_value), count in value_changes.items():
+            self.histogram[old_value] = self.histogram.get(old_value, 0) - count
+            self.histogram[new_value] = self.histogram.get(new_value, 0) + count
+            if self.histogram[old_value] <= 0:
+                del self.histogram[old_value]
+        if self is LayerToEdit.current:
+            ThRasE.dialog.update_pixel_counts()
+
     def get_old_and_new_pixel_values(self, pixel):
-        old_value = self.get_pixel_value_from_pnt(pixel.qgs_point)
+        old_value = self.get_pixel_value(pixel)
         return old_value, self.old_new_value[old_value] if old_value in self.old_new_value and self.old_new_value[
             old_value
         ] != old_value else None
 
+    def index_pixel_rows(self):
+        """Map each class value to its row in the recode pixel table, for quick highlighting"""
+        self.pixel_value_rows = {pixel["value"]: row_idx for row_idx, pixel in enumerate(self.pixels or [])}
+        # the table was reset, there is nothing highlighted
+        self.highlighted_value = None
+
     def highlight_value_in_recode_pixel_table(self, value_to_select):
         """Highlight the current pixel value from mouse pointer on canvas"""
         from ThRasE.thrase import ThRasE
 
-        if self.pixels is None:
-            return
-        if value_to_select is None:
-            ThRasE.dialog.recodePixelTable.clearSelection()
-            with block_signals_to(ThRasE.dialog.recodePixelTable):
-                [
-                    ThRasE.dialog.recodePixelTable.item(idx, 2).setBackground(Qt.GlobalColor.white)
-                    for idx in range(len(self.pixels))
-                ]
+        if self.pixels is None or value_to_select == self.highlighted_value:
             return
+        self.highlighted_value = value_to_select
 
-        row_idx = next((idx for idx, i in enumerate(self.pixels) if i["value"] == value_to_select), None)
-        if row_idx is not None:
-            # select
-            ThRasE.dialog.recodePixelTable.setCurrentCell(row_idx, 2)
-            # set background
-            with block_signals_to(ThRasE.dialog.recodePixelTable):
-                [
-                    ThRasE.dialog.recodePixelTable.item(idx, 2).setBackground(Qt.GlobalColor.white)
-                    for idx in range(len(self.pixels))
-                ]
-                ThRasE.dialog.recodePixelTable.item(row_idx, 2).setBackground(Qt.GlobalColor.yellow)
-        else:
-            ThRasE.dialog.recodePixelTable.clearSelection()
-            with block_signals_to(ThRasE.dialog.recodePixelTable):
-                [
-                    ThRasE.dialog.recodePixelTable.item(idx, 2).setBackground(Qt.GlobalColor.white)
-                    for idx in range(len(self.pixels))
-                ]
+        # only the previously and the newly highlighted rows are refreshed
+        row_idx = self.pixel_value_rows.get(value_to_select)
+        table_model = ThRasE.dialog.recode_pixel_table_model
+        table_model.set_highlighted_row(row_idx)
+        if table_model.highlighted_row is not None:
+            ThRasE.dialog.recodePixelTable.scrollTo(table_model.index(table_model.highlighted_row, 2))
 
     def check_point_inside_layer(self, pixel):
         # check if the pixel is within active raster bounds
         return bool(self.bounds[0] <= pixel.x() <= self.bounds[2] and self.bounds[1] <= pixel.y() <= self.bounds[3])
 
-    def edit_pixel(self, pixel, new_value=None, group_id=None, store=None):
+    def window_from_extent(self, extent):
+        """Return the pixel window (xoff, yoff, cols, rows) of the pixels that intersect the
+        extent, clipped to the raster, or None if the extent is outside the raster"""
+        ps_x = self.qgs_layer.rasterUnitsPerPixelX()
+        ps_y = self.qgs_layer.rasterUnitsPerPixelY()
+        col_min = max(int((extent.xMinimum() - self.bounds[0]) / ps_x), 0)
+        col_max = min(int((extent.xMaximum() - self.bounds[0]) / ps_x), self.width - 1)
+        row_min = max(int((self.bounds[3] - extent.yMaximum()) / ps_y), 0)
+        row_max = min(int((self.bounds[3] - extent.yMinimum()) / ps_y), self.height - 1)
+        if col_min > col_max or row_min > row_max:
+            return None
+        return col_min, row_min, col_max - col_min + 1, row_max - row_min + 1
+
+    def window_geo_transform(self, xoff, yoff):
+        """GDAL geotransform of a pixel window starting at (xoff, yoff)"""
+        ps_x = self.qgs_layer.rasterUnitsPerPixelX()
+        ps_y = self.qgs_layer.rasterUnitsPerPixelY()
+        return self.bounds[0] + xoff * ps_x, ps_x, 0, self.bounds[3] - yoff * ps_y, 0, -ps_y
+
+    def read_window(self, xoff, yoff, cols, rows):
+        """Read a pixel window of the band to edit as numpy array (native data type)"""
+        ps_x = self.qgs_layer.rasterUnitsPerPixelX()
+        ps_y = self.qgs_layer.rasterUnitsPerPixelY()
+        extent = QgsRectangle(
+            self.bounds[0] + xoff * ps_x,
+            self.bounds[3] - (yoff + rows) * ps_y,
+            self.bounds[0] + (xoff + cols) * ps_x,
+            self.bounds[3] - yoff * ps_y,
+        )
+        return block_to_array(self.data_provider.block(self.band, extent, cols, rows))
+
+    def write_window(self, array, xoff, yoff, changed=None):
+        """Write the numpy array as one block in the band to edit at (xoff, yoff), the
+        data provider must be in editable mode. The native blocks with changed pixels (all the
+        blocks of the window if the changed mask is not given) are saved in the last snapshot"""
+        rows, cols = array.shape
+        self.snapshots.preserve(self.read_window, xoff, yoff, cols, rows, changed)
+        block = array_to_block(array, self.data_provider.dataType(self.band))
+        return self.data_provider.writeBlock(block, self.band, xoff, yoff)
+
+    def log_edits(self, rows, cols, old_values, new_values, group_id, edit_date, tool):
+        """Log the pixels edited in the registry and in the journal"""
+        self.pixel_log_store.add_many(rows, cols, old_values, new_values, group_id, edit_date)
+        self.journal.append(rows, cols, old_values, new_values, group_id, edit_date, tool)
+        self.report_journal_error()
+
+    def report_journal_error(self):
+        """Warn the user if the journal could not be written since the last check"""
+        from ThRasE.thrase import ThRasE
+
+        error = self.journal.take_error()
+        if error is not None and ThRasE.dialog is not None:
+            ThRasE.dialog.MsgBar.pushMessage(
+                f"Unable to write the edit journal ({error}), the edits will not be recovered after a "
+                "crash until the ThRasE config is saved",
+                level=Qgis.MessageLevel.Warning,
+                duration=20,
+            )
+
+    def replay_journal(self):
+        """Log in the registry the edit groups of the journal not saved in a config file
+
+        Returns:
+            int: number of edit groups recovered
+        """
+        entries = self.journal.read()
+        for entry in entries:
+            self.pixel_log_store.add_many(
+                entry.rows, entry.cols, entry.old_values, entry.new_values, entry.group_id, entry.edit_date
+            )
+        return len(entries)
+
+    def edit_window(self, xoff, yoff, edit_mask, group_id, tool=None):
+        """Recode with the recode pixel table the pixels selected by the mask inside the
+        pixel window, with one read and one block write
+
+        Args:
+            xoff, yoff (int): offset of the window in the raster
+            edit_mask (np.ndarray): boolean mask (rows x cols) of the pixels to edit in the window
+            group_id (UUID): group id of the edit in the registry
+            tool (str): editing tool, for the journal
+
+        Returns:
+            EditDiff: changes of the pixels edited, None if no pixel was edited
+        """
+        rows, cols = edit_mask.shape
+        data = self.read_window(xoff, yoff, cols, rows)
+        new_data, changed = recode_array(data, self.old_new_value)
+        changed &= edit_mask
+        edited_data = np.where(changed, new_data, data)
+        if not changed.any() or not self.write_window(edited_data, xoff, yoff, changed):
+            return None
+        self.block_cache.update(edited_data, xoff, yoff)
+        self.update_pixel_counts(data[changed], new_data[changed])
+
+        row_indices, col_indices = np.nonzero(changed)
+        old_values, new_values = data[row_indices, col_indices], new_data[row_indices, col_indices]
+        row_indices += yoff
+        col_indices += xoff
+        edit_date = datetime.now()
+        if self.registry.enabled:
+            self.log_edits(row_indices, col_indices, old_values, new_values, group_id, edit_date, tool)
+        return EditDiff(row_indices, col_indices, old_values, new_values, self.width)
+
+    def apply_diff(self, diff, undo, tool=None):
+        """Write back the old values (undo) or the new values (redo) of the diff, grouped by the
+        tiles of the block cache with one read and one block write for each tile
+
+        Returns:
+            int: number of pixels written
+        """
+        rows, cols, old_values, new_values = diff.cells()
+        rows, cols, order, _, starts, ends = group_cells_by_tile(rows, cols, self.width, BLOCK_CACHE_TILE_SIZE)
+        values = (old_values if undo else new_values)[order]
+
+        changes = []
+        for start, end in zip(starts.tolist(), ends.tolist(), strict=True):
+            tile_rows, tile_cols, tile_values = rows[start:end], cols[start:end], values[start:end]
+            xoff, yoff = int(tile_cols.min()), int(tile_rows.min())
+            data = self.read_window(xoff, yoff, int(tile_cols.max()) - xoff + 1, int(tile_rows.max()) - yoff + 1)
+            current = data[tile_rows - yoff, tile_cols - xoff]
+            changed = current != tile_values
+            if not changed.any():
+                continue
+            edited = np.zeros(data.shape, dtype=bool)
+            edited[tile_rows[changed] - yoff, tile_cols[changed] - xoff] = True
+            data[tile_rows[changed] - yoff, tile_cols[changed] - xoff] = tile_values[changed]
+            if not self.write_window(data, xoff, yoff, edited):
+                continue
+            self.block_cache.update(data, xoff, yoff)
+            self.update_pixel_counts(current[changed], tile_values[changed])
+            changes.append((tile_rows[changed], tile_cols[changed], current[changed], tile_values[changed]))
+
+        if changes and self.registry.enabled:
+            self.log_edits(
+                *(np.concatenate(column) for column in zip(*changes, strict=True)), uuid.uuid4(), datetime.now(), tool
+            )
+        return sum(len(change[0]) for change in changes)
+
+    def edit_pixel(self, pixel, new_value=None, group_id=None, store=None, tool="pixel"):
         if new_value is None:
             old_value, new_value = self.get_old_and_new_pixel_values(pixel)
             if new_value is None:
                 return
         else:
-            old_value = self.get_pixel_value_from_pnt(pixel.qgs_point)
+            # the value read, a nodata pixel is logged with the nodata value of the band
+            old_value = self.block_cache.get_value(pixel.col, pixel.row)
+            if old_value is None:  # outside the raster
+                return
 
-        px = int((pixel.x() - self.bounds[0]) / self.qgs_layer.rasterUnitsPerPixelX())  # num column position in x
-        py = int((self.bounds[3] - pixel.y()) / self.qgs_layer.rasterUnitsPerPixelY())  # num row position in y
+        px, py = pixel.col, pixel.row
 
+        self.snapshots.preserve(self.read_window, px, py, 1, 1)
         rblock = QgsRasterBlock(self.data_provider.dataType(self.band), 1, 1)
         rblock.setValue(0, 0, new_value)
         if self.data_provider.writeBlock(rblock, self.band, px, py):  # write and check if writing status is ok
-            return PixelLog(
-                pixel, old_value, new_value, group_id, store=self.registry.enabled if store is None else store
-            )
+            self.block_cache.update(np.array([[new_value]], dtype=self.dtype), px, py)
+            self.update_pixel_counts([old_value], [new_value])
+            pixel_log = PixelLog(pixel, old_value, new_value, group_id)
+            if self.registry.enabled if store is None else store:
+                self.pixel_log_store.add(pixel.row, pixel.col, old_value, new_value, group_id, pixel_log.edit_date)
+                self.journal.append(
+                    [pixel.row], [pixel.col], [old_value], [new_value], group_id, pixel_log.edit_date, tool
+                )
+                self.report_journal_error()
+            return pixel_log
 
     @edit_layer
     def edit_from_pixel_picker(self, pixel):
@@ -264,9 +570,8 @@ class LayerToEdit:
             self.qgs_layer.reload()
             self.qgs_layer.triggerRepaint()
             ThRasE.dialog.registry_widget.update_registry()
-            # pixel value edited to send to the history
-            pixel_value = pixel_log.old_value
-            return pixel_value
+            # pixel edited to send to the history
+            return EditDiff([pixel.row], [pixel.col], [pixel_log.old_value], [pixel_log.new_value], self.width)
 
     @wait_process
     @edit_layer
@@ -274,239 +579,147 @@ class LayerToEdit:
         if line_feature is None:
             return
 
+        polyline = [(point.x(), point.y()) for point in line_feature.geometry().asPolyline()]
+        # pixel window of the line with its buffer
         ps_x = self.qgs_layer.rasterUnitsPerPixelX()  # pixel size in x
         ps_y = self.qgs_layer.rasterUnitsPerPixelY()  # pixel size in y
-        ps_avg = (ps_x + ps_y) / 2  # average of the pixel size, when the pixel is not square
-
-        # function for check if the pixel must be edited
-        def check_pixel_to_edit_in(x, y):
-            pc_x = self.bounds[0] + int((x - self.bounds[0]) / ps_x) * ps_x + ps_x / 2  # locate the pixel centroid in x
-            pc_y = self.bounds[3] - int((self.bounds[3] - y) / ps_y) * ps_y - ps_y / 2  # locate the pixel centroid in y
-
-            point = QgsPointXY(pc_x, pc_y)
-            if line_feature.geometry().distance(QgsGeometry.fromPointXY(point)) <= ps_avg * line_buffer:
-                # return the pixel-point to edit
-                return point
-
-        # analysis all pixel if is inside in the segments of box of pair pixel consecutive
-        polyline = line_feature.geometry().asPolyline()
-        points_to_process = [
-            [
-                check_pixel_to_edit_in(x, y)
-                for y in np.arange(
-                    min(p1.y(), p2.y()) - ps_y * line_buffer, max(p1.y(), p2.y()) + ps_y * line_buffer, ps_y
-                )
-                for x in np.arange(
-                    min(p1.x(), p2.x()) - ps_x * line_buffer, max(p1.x(), p2.x()) + ps_x * line_buffer, ps_x
-                )
-            ]
-            for p1, p2 in itertools.pairwise(polyline)
-        ]
-        # flat the list, clean None and duplicates
-        pixels_to_process = [
-            Pixel(point=point) for point in {item for sublist in points_to_process for item in sublist if item}
-        ]
+        box = line_feature.geometry().boundingBox()
+        box.grow(max(ps_x, ps_y) * (line_buffer + 1))
+        window = self.window_from_extent(box)
 
-        # edit and return all the pixel and value before edit it, for save in history class
-        group_id = uuid.uuid4()
-        pixel_logs = [self.edit_pixel(pixel, group_id=group_id) for pixel in pixels_to_process]
-        pixel_logs = [item for item in pixel_logs if item]  # clean None, unedited pixels
+        edit_diff = None
+        if window is not None and len(polyline) > 1:
+            xoff, yoff, cols, rows = window
+            # all pixels whose centroid is inside the buffered corridor of the line
+            edit_mask = polyline_corridor_mask(polyline, self.window_geo_transform(xoff, yoff), cols, rows, line_buffer)
+            edit_diff = self.edit_window(xoff, yoff, edit_mask, group_id=uuid.uuid4(), tool="line")
 
         from ThRasE.thrase import ThRasE
 
-        ThRasE.dialog.editing_status.setText(f"{len(pixel_logs)} pixels edited!")
+        ThRasE.dialog.editing_status.setText(f"{len(edit_diff) if edit_diff else 0} pixels edited!")
 
-        if pixel_logs:
+        if edit_diff:
             if hasattr(self.qgs_layer, "setCacheImage"):
                 self.qgs_layer.setCacheImage(None)
             self.qgs_layer.reload()
             self.qgs_layer.triggerRepaint()
             ThRasE.dialog.registry_widget.update_registry()
-            # pixels and values edited to send to the history
-            pixels_and_values = [(pixel_log.pixel, pixel_log.old_value) for pixel_log in pixel_logs]
-            return pixels_and_values
+            # changes of the pixels edited to send to the history
+            return edit_diff
 
     @wait_process
     @edit_layer
     def edit_from_polygon_picker(self, polygon_feature):
         if polygon_feature is None:
             return
-
-        box = polygon_feature.geometry().boundingBox()
-        ps_x = self.qgs_layer.rasterUnitsPerPixelX()  # pixel size in x
-        ps_y = self.qgs_layer.rasterUnitsPerPixelY()  # pixel size in y
-
-        # locate the pixel centroid in x and y for the pixel in min/max in the extent
-        y_min = self.bounds[3] - int((self.bounds[3] - box.yMinimum()) / ps_y) * ps_y - ps_y / 2
-        y_max = self.bounds[3] - int((self.bounds[3] - box.yMaximum()) / ps_y) * ps_y - ps_y / 2
-        x_min = self.bounds[0] + int((box.xMinimum() - self.bounds[0]) / ps_x) * ps_x + ps_x / 2
-        x_max = self.bounds[0] + int((box.xMaximum() - self.bounds[0]) / ps_x) * ps_x + ps_x / 2
-
-        # create geometry engine for optimized contains operations
-        geom_engine = QgsGeometry.createGeometryEngine(polygon_feature.geometry().constGet())
-        geom_engine.prepareGeometry()
-        points = [
-            QgsGeometry.fromPointXY(QgsPointXY(x, y))
-            for y in np.arange(y_min, y_max + ps_y, ps_y)
-            for x in np.arange(x_min, x_max + ps_x, ps_x)
-        ]
-        points_inside_polygon = [p.asPoint() for p in points if geom_engine.contains(p.constGet())]
-
-        group_id = uuid.uuid4()
-        pixel_logs = [self.edit_pixel(Pixel(point=point), group_id=group_id) for point in points_inside_polygon]
-        pixel_logs = [item for item in pixel_logs if item]  # clean None, unedited pixels
-
-        from ThRasE.thrase import ThRasE
-
-        ThRasE.dialog.editing_status.setText(f"{len(pixel_logs)} pixels edited!")
-
-        if pixel_logs:
-            if hasattr(self.qgs_layer, "setCacheImage"):
-                self.qgs_layer.setCacheImage(None)
-            self.qgs_layer.reload()
-            self.qgs_layer.triggerRepaint()
-            ThRasE.dialog.registry_widget.update_registry()
-            # pixels and values edited to send to the history
-            pixels_and_values = [(pixel_log.pixel, pixel_log.old_value) for pixel_log in pixel_logs]
-            return pixels_and_values
+        return self.edit_from_polygon_geometry(polygon_feature.geometry(), tool="polygon")
 
     @wait_process
     @edit_layer
     def edit_from_freehand_picker(self, freehand_feature):
         if freehand_feature is None:
             return
+        return self.edit_from_polygon_geometry(freehand_feature.geometry(), tool="freehand")
 
-        box = freehand_feature.geometry().boundingBox()
-        ps_x = self.qgs_layer.rasterUnitsPerPixelX()  # pixel size in x
-        ps_y = self.qgs_layer.rasterUnitsPerPixelY()  # pixel size in y
+    def edit_from_polygon_geometry(self, geometry, tool="polygon"):
+        """Edit all pixels whose centroid is inside the polygon geometry, the polygon is
+        rasterized over its pixel window and the window is recoded and written at once"""
+        window = self.window_from_extent(geometry.boundingBox())
 
-        # locate the pixel centroid in x and y for the pixel in min/max in the extent
-        y_min = self.bounds[3] - int((self.bounds[3] - box.yMinimum()) / ps_y) * ps_y - ps_y / 2
-        y_max = self.bounds[3] - int((self.bounds[3] - box.yMaximum()) / ps_y) * ps_y - ps_y / 2
-        x_min = self.bounds[0] + int((box.xMinimum() - self.bounds[0]) / ps_x) * ps_x + ps_x / 2
-        x_max = self.bounds[0] + int((box.xMaximum() - self.bounds[0]) / ps_x) * ps_x + ps_x / 2
-
-        # create geometry engine for optimized contains operations
-        geom_engine = QgsGeometry.createGeometryEngine(freehand_feature.geometry().constGet())
-        geom_engine.prepareGeometry()
-        points = [
-            QgsGeometry.fromPointXY(QgsPointXY(x, y))
-            for y in np.arange(y_min, y_max + ps_y, ps_y)
-            for x in np.arange(x_min, x_max + ps_x, ps_x)
-        ]
-        points_inside_freehand = [p.asPoint() for p in points if geom_engine.contains(p.constGet())]
-
-        group_id = uuid.uuid4()
-        pixel_logs = [self.edit_pixel(Pixel(point=point), group_id=group_id) for point in points_inside_freehand]
-        pixel_logs = [item for item in pixel_logs if item]  # clean None, unedited pixels
+        edit_diff = None
+        if window is not None:
+            xoff, yoff, cols, rows = window
+            edit_mask = rasterize_geometry(bytes(geometry.asWkb()), self.window_geo_transform(xoff, yoff), cols, rows)
+            edit_diff = self.edit_window(xoff, yoff, edit_mask, group_id=uuid.uuid4(), tool=tool)
 
         from ThRasE.thrase import ThRasE
 
-        ThRasE.dialog.editing_status.setText(f"{len(pixel_logs)} pixels edited!")
+        ThRasE.dialog.editing_status.setText(f"{len(edit_diff) if edit_diff else 0} pixels edited!")
 
-        if pixel_logs:
+        if edit_diff:
             if hasattr(self.qgs_layer, "setCacheImage"):
                 self.qgs_layer.setCacheImage(None)
             self.qgs_layer.reload()
             self.qgs_layer.triggerRepaint()
             ThRasE.dialog.registry_widget.update_registry()
-            # pixels and values edited to send to the history
-            pixels_and_values = [(pixel_log.pixel, pixel_log.old_value) for pixel_log in pixel_logs]
-            return pixels_and_values
-
-    @wait_process
-    def edit_to_entire_thematic_raster(self, record_in_registry=False):
-        """Edit the entire thematic raster with the new values using gdal"""
+            # changes of the pixels edited to send to the history
+            return edit_diff
+
+    def run_global_edit(self, description, on_finished, background=False, **kwargs):
+        """Recode the file of the thematic raster by block windows (see recode_raster_file) with
+        the current recode table
+
+        Args:
+            description (str): description of the edit, shown in the progress
+            on_finished (function): on_finished(result, error) called when the edit ends, result
+                is the output of recode_raster_file, or None if it failed (error) or was canceled
+            background (bool): run the edit as a cancellable QGIS task, the file is not modified
+                if it is canceled
+            **kwargs: memory_budget, record, region, mask_func and workers of recode_raster_file,
+                or rollback with the change set of the global edit to roll back
+
+        Returns:
+            GlobalEditTask: the task of the edit, its result_status is the value returned by on_finished
+        """
         from ThRasE.thrase import ThRasE
 
-        edited_pixels_count = 0
-        row_indices = col_indices = None
-        old_values = new_values = None
+        if "rollback" not in kwargs:
+            # the old values of the pixels changed, to undo the edit
+            if ThRasE.tmp_dir is None:
+                ThRasE.tmp_dir = tempfile.mkdtemp()
+            change_set_fd, change_set_file = tempfile.mkstemp(prefix="change_set_", suffix=".bin", dir=ThRasE.tmp_dir)
+            os.close(change_set_fd)
+            kwargs["change_set"] = ChangeSet(change_set_file)
+
+        task = GlobalEditTask(description, self, on_finished, **kwargs)
+        if not background:
+            task.finished(task.run())
+            return task
+
+        self.global_edit_task = task
+        # progress and cancel button in the ThRasE message bar, the rollback is not cancellable
+        task.message = ThRasE.dialog.MsgBar.createMessage(description, "running in background...")
+        if "rollback" not in kwargs:
+            cancel_button = QPushButton("Cancel")
+            cancel_button.clicked.connect(task.cancel)
+            task.message.layout().addWidget(cancel_button)
+        ThRasE.dialog.MsgBar.pushWidget(task.message, Qgis.MessageLevel.Info)
+        task.progressChanged.connect(
+            lambda progress: ThRasE.dialog.editing_status.setText(f"{description}: {progress:.0f}%")
+        )
+        QgsApplication.taskManager().addTask(task)
+        return task
 
-        try:
-            # read
-            ds_in = gdal.Open(self.file_path, gdal.GA_ReadOnly)
-            if ds_in is None:
-                raise RuntimeError(f"Unable to open raster {self.file_path}")
-            num_bands = ds_in.RasterCount
-            src_band = ds_in.GetRasterBand(self.band)
-            data_array = src_band.ReadAsArray().astype(int)
-            new_data_array = deepcopy(data_array)
-
-            # apply changes
-            for old_value, new_value in self.old_new_value.items():
-                new_data_array[data_array == old_value] = new_value
-
-            # compute which pixels actually changed
-            row_indices, col_indices = np.nonzero(new_data_array != data_array)
-            edited_pixels_count = int(row_indices.size)
-            if edited_pixels_count:
-                old_values = data_array[row_indices, col_indices]
-                new_values = new_data_array[row_indices, col_indices]
-
-            # create file
-            fn, ext = os.path.splitext(self.file_path)
-            fn_out = fn + "_tmp" + ext
-            driver_name = ds_in.GetDriver().ShortName
-            driver = gdal.GetDriverByName(driver_name)
-            if driver is None:
-                raise RuntimeError(f"GDAL driver '{driver_name}' is not available")
-
-            (x, y) = new_data_array.shape
-            ds_out = None
-            create_copy_used = False
-            if driver.GetMetadataItem("DCAP_CREATECOPY") == "YES":
-                ds_out = driver.CreateCopy(fn_out, ds_in)
-                if ds_out is not None:
-                    create_copy_used = True
-
-            if ds_out is None:
-                ds_out = driver.Create(fn_out, y, x, num_bands, src_band.DataType)
-                if ds_out is None:
-                    raise RuntimeError(f"Failed to create output raster {fn_out}")
-
-            src_band_i = dst_band_i = None
-            for band_index in range(1, num_bands + 1):
-                src_band_i = ds_in.GetRasterBand(band_index)
-                dst_band_i = ds_out.GetRasterBand(band_index)
-                if band_index == self.band:
-                    dst_band_i.WriteArray(new_data_array)
-                elif not create_copy_used:
-                    dst_band_i.WriteArray(src_band_i.ReadAsArray())
-                copy_band_metadata(src_band_i, dst_band_i)
-            del src_band_i, dst_band_i
-
-            ds_out.SetGeoTransform(ds_in.GetGeoTransform())
-            ds_out.SetProjection(ds_in.GetProjection())
-            copy_dataset_metadata(ds_in, ds_out)
-
-            ds_out.FlushCache()
-            del ds_out, driver, src_band, ds_in
-            move(fn_out, self.file_path)
-
-            # record the changes in ThRasE registry
-            if record_in_registry and edited_pixels_count:
-                ps_x = self.qgs_layer.rasterUnitsPerPixelX()
-                ps_y = self.qgs_layer.rasterUnitsPerPixelY()
-                xmin, _ymin, _xmax, ymax = self.bounds
-
-                group_id = uuid.uuid4()
-                for row_idx, col_idx, old_val, new_val in zip(
-                    row_indices, col_indices, old_values, new_values, strict=True
-                ):
-                    x_coord = xmin + (float(col_idx) + 0.5) * ps_x
-                    y_coord = ymax - (float(row_idx) + 0.5) * ps_y
-                    PixelLog(Pixel(x=x_coord, y=y_coord), int(old_val), int(new_val), group_id, store=True)
-
-            del new_data_array, data_array
-            if old_values is not None:
-                del old_values, new_values
-            if row_indices is not None:
-                del row_indices, col_indices
-        except Exception as e:
-            ThRasE.dialog.MsgBar.pushMessage(f"ERROR: {e}", level=Qgis.MessageLevel.Critical, duration=20)
+    def global_edit_finished(self, result, error, record_in_registry=False):
+        """Record the changes of a global edit in the registry and refresh the layer
+
+        Returns:
+            int or bool: the number of pixels edited, or False if the edit failed or was canceled
+        """
+        from ThRasE.thrase import ThRasE
+
+        if error is not None:
+            self.block_cache.clear()
+            ThRasE.dialog.MsgBar.pushMessage(f"ERROR: {error}", level=Qgis.MessageLevel.Critical, duration=20)
+            return False
+        if result is None:
+            ThRasE.dialog.editing_status.setText("Edit canceled")
+            ThRasE.dialog.MsgBar.pushMessage(
+                "The edit was canceled, the thematic raster was not modified",
+                level=Qgis.MessageLevel.Info,
+                duration=10,
+            )
             return False
 
+        edited_pixels_count, value_changes, changes = result
+        # the file was modified outside the block cache
+        self.block_cache.clear()
+        self.update_pixel_counts_by_change(value_changes)
+        # record the changes in ThRasE registry
+        if record_in_registry and changes is not None:
+            self.log_edits(*changes, group_id=uuid.uuid4(), edit_date=datetime.now(), tool="global")
+        del changes
+
         if hasattr(self.qgs_layer, "setCacheImage"):
             self.qgs_layer.setCacheImage(None)
         self.qgs_layer.reload()
@@ -518,6 +731,134 @@ class LayerToEdit:
 
         return edited_pixels_count
 
+    def preserve_blocks(self, band, xoff, yoff, changed):
+        """Save in the last snapshot the native blocks of a window of a global edit, read from the
+        GDAL band before the window is written"""
+        rows, cols = changed.shape
+        self.snapshots.preserve(band.ReadAsArray, xoff, yoff, cols, rows, changed)
+
+    @wait_process
+    @edit_layer
+    def restore_snapshot(self, snapshot):
+        """Write back the native blocks that changed since the snapshot. A new snapshot is taken
+        first, the blocks restored are saved in it before they are written, so restoring can be
+        reverted by restoring that snapshot
+
+        Returns:
+            int: number of pixels restored
+        """
+        from ThRasE.thrase import ThRasE
+
+        before_restoring = self.snapshots.take(f"Before restoring {snapshot.name}")
+        changes = []
+        for (xoff, yoff, _, _), values, current_values, changed in self.snapshots.compare(snapshot, self.read_window):
+            if not self.write_window(values, xoff, yoff, changed):
+                continue
+            self.block_cache.update(values, xoff, yoff)
+            self.update_pixel_counts(current_values[changed], values[changed])
+            row_indices, col_indices = np.nonzero(changed)
+            changes.append((row_indices + yoff, col_indices + xoff, current_values[changed], values[changed]))
+        if not changes:
+            # nothing to revert
+            self.snapshots.remove(before_restoring)
+            return 0
+
+        changes = tuple(np.concatenate(column) for column in zip(*changes, strict=True))
+        if self.registry.enabled:
+            self.log_edits(*changes, group_id=uuid.uuid4(), edit_date=datetime.now(), tool="snapshot")
+        if hasattr(self.qgs_layer, "setCacheImage"):
+            self.qgs_layer.setCacheImage(None)
+        self.qgs_layer.reload()
+        self.qgs_layer.triggerRepaint()
+        ThRasE.dialog.registry_widget.update_registry()
+        return len(changes[0])
+
+    def keep_change_set(self, change_set, description):
+        """Keep the change set of a global edit applied, with its undo button in the message bar"""
+        from ThRasE.thrase import ThRasE
+
+        self.change_sets.append(change_set)
+        message = ThRasE.dialog.MsgBar.createMessage(description, f"{len(change_set)} pixels edited")
+        undo_button = QPushButton("Undo")
+        undo_button.setToolTip("Restore the pixels edited by this global edit")
+        undo_button.clicked.connect(lambda: self.rollback_global_edit(change_set, message))
+        message.layout().addWidget(undo_button)
+        ThRasE.dialog.MsgBar.pushWidget(message, Qgis.MessageLevel.Info)
+
+    def rollback_global_edit(self, change_set, message=None, background=True):
+        """Restore the old values of the pixels changed by a global edit, streaming its change set
+        by block windows. Only the last global edit not undone can be rolled back"""
+        from ThRasE.thrase import ThRasE
+
+        if self.global_edit_task is not None:
+            ThRasE.dialog.MsgBar.pushMessage(
+                "A global edit is being applied to the thematic raster, wait until it finishes",
+                level=Qgis.MessageLevel.Warning,
+                duration=10,
+            )
+            return False
+        if change_set not in self.change_sets:
+            return False
+        if change_set is not self.change_sets[-1]:
+            ThRasE.dialog.MsgBar.pushMessage(
+                "Undo first the global edits applied after this one",
+                level=Qgis.MessageLevel.Warning,
+                duration=10,
+            )
+            return False
+
+        def finished(result, error):
+            status = self.global_edit_finished(result, error, change_set.recorded)
+            if status is not False:
+                self.change_sets.remove(change_set)
+                change_set.remove()
+                if message is not None:
+                    # the message could have been closed while the rollback was running
+                    with contextlib.suppress(RuntimeError):
+                        ThRasE.dialog.MsgBar.popWidget(message)
+                ThRasE.dialog.MsgBar.pushMessage(
+                    f"DONE: The global edit was undone, {status} pixels restored",
+                    level=Qgis.MessageLevel.Success,
+                    duration=10,
+                )
+            return status
+
+        task = self.run_global_edit(
+            "Undoing the global edit", finished, background, rollback=change_set, record=change_set.recorded
+        )
+        if not background:
+            return task.result_status
+
+    @wait_process
+    def edit_to_entire_thematic_raster(
+        self, record_in_registry=False, memory_budget=None, workers=None, background=False, on_finished=None
+    ):
+        """Edit the entire thematic raster with the new values using gdal, streaming the band
+        by block windows so that the memory used is bounded by the memory budget. The file is
+        updated in place (only the blocks with changes) when the driver supports it. The
+        block windows are recoded in parallel by the number of workers
+
+        With background the edit runs as a cancellable task and on_finished(status) is called
+        when it ends, status is the number of pixels edited or False if it failed or was canceled,
+        otherwise the status is returned"""
+
+        def finished(result, error):
+            status = self.global_edit_finished(result, error, record_in_registry)
+            if on_finished is not None:
+                on_finished(status)
+            return status
+
+        task = self.run_global_edit(
+            "Applying changes to entire thematic raster",
+            finished,
+            background,
+            memory_budget=memory_budget or LayerToEdit.memory_budget,
+            record=record_in_registry,
+            workers=workers or LayerToEdit.workers,
+        )
+        if not background:
+            return task.result_status
+
     @wait_process
     def save_config(self, file_out):
         from ThRasE.thrase import ThRasE
@@ -654,6 +995,13 @@ class LayerToEdit:
             if data["navigation"]["type"] in ["polygons", "points", "centroid of polygons"]:
                 data["navigation"]["vector_file"] = setup_path(get_source_from(self.navigation_dialog.QCBox_VectorFile))
 
+        # live pixel count of each value, with the signature of the file it belongs to
+        if self.histogram is not None:
+            data["pixel_counts"] = {
+                "histogram": dict(self.histogram),
+                "file_signature": list(get_file_signature(self.file_path)),
+            }
+
         # registry (widget state and pixel logs)
         rw = ThRasE.dialog.registry_widget
         data["registry"] = {
@@ -663,33 +1011,23 @@ class LayerToEdit:
             "slider_position": int(rw.PixelLogGroups_Slider.value()),
             "auto_center": rw.autoCenter.isChecked(),
             "show_all": rw.showAll.isChecked(),
+            "sidecar": self.registry.sidecar is not None,
         }
 
-        # serialize all pixel logs from the current layer registry
-        def serialize_pixel_log(pixel_log):
-            return {
-                "x": pixel_log.pixel.x(),
-                "y": pixel_log.pixel.y(),
-                "old_value": int(pixel_log.old_value),
-                "new_value": int(pixel_log.new_value),
-                "edit_date": pixel_log.edit_date.isoformat(),
-                "group_id": str(pixel_log.group_id) if pixel_log.group_id is not None else None,
-            }
-
-        # compress pixel logs: JSON -> gzip -> base64
-        import base64
-        import gzip
-        import json
-
-        pixel_logs = list(self.pixel_log_store.values())
-        pixel_logs.sort(key=lambda pl: (pl.edit_date, str(pl.group_id)))
-        pixel_logs_serialized = [serialize_pixel_log(pl) for pl in pixel_logs]
-        json_bytes = json.dumps(pixel_logs_serialized, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
-        gz_bytes = gzip.compress(json_bytes)
-        b64_str = base64.b64encode(gz_bytes).decode("ascii")
-        data["registry"]["pixel_logs"] = b64_str
-        data["registry"]["pixel_logs_encoding"] = "gzip+base64+json"
-        data["registry"]["pixel_logs_count"] = len(pixel_logs_serialized)
+        if self.registry.sidecar:
+            # the pixel logs are kept in sync in the GeoPackage sidecar, with the edits since the last update
+            self.registry.update()
+            data["registry"]["pixel_logs_count"] = len(self.pixel_log_store)
+        else:
+            # pixel logs as compressed NumPy columns in a file next to the config file
+            pixel_logs_file = os.path.splitext(file_out)[0] + "_pixel_logs.npz"
+            self.pixel_log_store.save(pixel_logs_file)
+            data["registry"]["pixel_logs_file"] = setup_path(pixel_logs_file)
+            data["registry"]["pixel_logs_encoding"] = "npz"
+            data["registry"]["pixel_logs_count"] = len(self.pixel_log_store)
+        # the pixel logs saved have all the edits of the journal
+        self.journal.compact()
+        self.report_journal_error()
 
         # CCD plugin config
         if ThRasE.dialog.ccd_plugin_available:
@@ -702,34 +1040,184 @@ class LayerToEdit:
             yaml.dump(data, yaml_file, Dumper=dumper, default_flow_style=False, sort_keys=False)
 
 
+class GlobalEditTask(QgsTask):
+    """Task that recodes the file of the layer to edit by block windows, it reports the progress
+    per window and it can be canceled leaving the file untouched"""
+
+    def __init__(self, description, layer_to_edit, on_finished, change_set=None, rollback=None, **kwargs):
+        super().__init__(description, QgsTask.Flag.CanCancel)
+        self.layer_to_edit = layer_to_edit
+        self.on_finished = on_finished
+        self.change_set = change_set
+        self.rollback = rollback
+        self.kwargs = kwargs
+        # snapshot of the recode table, it can change while the task is running
+        self.old_new_value = dict(layer_to_edit.old_new_value)
+        self.message = None
+        self.result = None
+        self.error = None
+        self.result_status = None
+
+    def run(self):
+        try:
+            if self.rollback is not None:
+                self.result = rollback_raster_file(
+                    self.layer_to_edit.file_path,
+                    self.layer_to_edit.band,
+                    self.rollback,
+                    record=self.kwargs.get("record", False),
+                    feedback=self,
+                    before_write=self.layer_to_edit.preserve_blocks,
+                )
+            else:
+                self.result = recode_raster_file(
+                    self.layer_to_edit.file_path,
+                    self.layer_to_edit.band,
+                    self.old_new_value,
+                    feedback=self,
+                    change_set=self.change_set,
+                    before_write=self.layer_to_edit.preserve_blocks,
+                    **self.kwargs,
+                )
+        except RecodeCanceled:
+            return False
+        except Exception as err:
+            self.error = err
+            return False
+        return True
+
+    def finished(self, result):
+        from ThRasE.thrase import ThRasE
+
+        self.layer_to_edit.global_edit_task = None
+        if self.message is not None:
+            # the message could have been closed by the user
+            with contextlib.suppress(RuntimeError):
+                ThRasE.dialog.MsgBar.popWidget(self.message)
+        self.result_status = self.on_finished(self.result, self.error)
+        # the global edit applied can be undone with its change set
+        if self.change_set is not None:
+            if self.result_status and len(self.change_set):
+                self.change_set.recorded = bool(self.kwargs.get("record"))
+                self.layer_to_edit.keep_change_set(self.change_set, self.description())
+            else:
+                self.change_set.remove()
+
+
+class HistogramTask(QgsTask):
+    """Task that reads the pixel count of each value in the band of the layer to edit, so
+    selecting a large thematic raster does not freeze QGIS. It is read again if the layer was
+    edited meanwhile"""
+
+    def __init__(self, layer_to_edit, on_loaded):
+        super().__init__(f"Counting the pixels of {layer_to_edit.qgs_layer.name()}", QgsTask.Flag.CanCancel)
+        self.layer_to_edit = layer_to_edit
+        self.on_loaded = on_loaded
+        self.edits_count = layer_to_edit.edits_count
+        self.histogram = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.histogram = get_band_histogram(
+                self.layer_to_edit.file_path,
+                self.layer_to_edit.band,
+                LayerToEdit.memory_budget,
+                LayerToEdit.workers,
+            )
+        except Exception as err:
+            self.error = err
+            return False
+        return True
+
+    def finished(self, result):
+        from ThRasE.thrase import ThRasE
+
+        layer_to_edit = self.layer_to_edit
+        layer_to_edit.histogram_task = None
+        if not result:
+            if self.error is not None and ThRasE.dialog is not None:
+                ThRasE.dialog.MsgBar.pushMessage(
+                    f"Unable to count the pixels of the thematic raster: {self.error}",
+                    level=Qgis.MessageLevel.Warning,
+                    duration=10,
+                )
+            return
+        if layer_to_edit.edits_count != self.edits_count:
+            # the histogram read can miss some edits
+            forget_band_histogram(layer_to_edit.file_path, layer_to_edit.band)
+            layer_to_edit.load_pixel_counts(self.on_loaded)
+            return
+        layer_to_edit.histogram = dict(self.histogram)
+        if layer_to_edit is LayerToEdit.current:
+            self.on_loaded()
+
+
+class PixelGrid:
+    """Geotransform of the raster to edit, to convert between map coordinates and the
+    integer (row, col) indices of the pixels"""
+
+    __slots__ = ("pixel_size_x", "pixel_size_y", "xmin", "ymax")
+
+    def __init__(self, xmin, ymax, pixel_size_x, pixel_size_y):
+        self.xmin = xmin
+        self.ymax = ymax
+        self.pixel_size_x = pixel_size_x
+        self.pixel_size_y = pixel_size_y
+
+    def position(self, x, y):
+        """Column and row of the pixel at the map coordinates"""
+        return math.floor((x - self.xmin) / self.pixel_size_x), math.floor((self.ymax - y) / self.pixel_size_y)
+
+    def center(self, row, col):
+        """Map coordinates of the centroid of the pixel"""
+        return self.xmin + (col + 0.5) * self.pixel_size_x, self.ymax - (row + 0.5) * self.pixel_size_y
+
+    def geo_transform(self):
+        """GDAL geotransform of the grid"""
+        return self.xmin, self.pixel_size_x, 0, self.ymax, 0, -self.pixel_size_y
+
+
 class Pixel:
+    """Pixel of the raster to edit identified by its (row, col) indices in the grid, the map
+    coordinates of the centroid are computed only when needed"""
+
+    __slots__ = ("col", "grid", "row")
+
     def __eq__(self, other):
-        return self.__hash__() == other.__hash__()
+        return isinstance(other, Pixel) and self.row == other.row and self.col == other.col
 
     def __hash__(self):
-        return self._hash or hash(
-            (
-                round(self.qgs_point.x(), LayerToEdit.current.pixel_tolerance),
-                round(self.qgs_point.y(), LayerToEdit.current.pixel_tolerance),
-            )
-        )
+        return hash((self.row, self.col))
 
-    def __init__(self, x=None, y=None, point=None):
-        self._hash = None
-        self.qgs_point = point if point is not None else QgsPointXY(x, y)
+    def __init__(self, row, col, grid):
+        self.row = row
+        self.col = col
+        self.grid = grid
+
+    @classmethod
+    def from_xy(cls, grid, x, y):
+        col, row = grid.position(x, y)
+        return cls(row, col, grid)
+
+    @property
+    def qgs_point(self):
+        return QgsPointXY(*self.grid.center(self.row, self.col))
 
     def x(self):
-        return self.qgs_point.x()
+        return self.grid.center(self.row, self.col)[0]
 
     def y(self):
-        return self.qgs_point.y()
+        return self.grid.center(self.row, self.col)[1]
 
     def geometry(self):
         return QgsGeometry.fromPointXY(self.qgs_point)
 
 
 class PixelLog:
-    """Class for store the pixel changes"""
+    """Class for the pixel changes of an edit, the registry keeps them in the PixelLogStore"""
+
+    __slots__ = ("edit_date", "group_id", "new_value", "old_value", "pixel")
 
     def __eq__(self, other):
         return self.pixel == other.pixel
@@ -737,25 +1225,59 @@ class PixelLog:
     def __hash__(self):
         return self.pixel.__hash__()
 
-    def __init__(self, pixel, old_value, new_value, group_id, edit_date=None, store=True):
+    def __init__(self, pixel, old_value, new_value, group_id, edit_date=None):
         self.pixel = pixel
-        self.old_value = int(old_value)
+        # the old value is None for a pixel not read (e.g. nodata)
+        self.old_value = None if old_value is None else int(old_value)
         self.new_value = int(new_value)
         self.edit_date = edit_date or datetime.now()
         self.group_id = group_id
 
-        if store:
-            if self.pixel in LayerToEdit.current.pixel_log_store:
-                # if the pixel is already registered, update it
-                pixel_logged = LayerToEdit.current.pixel_log_store[self.pixel]
-                if pixel_logged.old_value == self.new_value:
-                    del LayerToEdit.current.pixel_log_store[self.pixel]
-                else:
-                    pixel_logged.new_value = self.new_value
-                    pixel_logged.edit_date = self.edit_date
-                    pixel_logged.group_id = self.group_id
-            else:
-                LayerToEdit.current.pixel_log_store[self.pixel] = self
+
+class EditDiff:
+    """Changes of an edit as compressed arrays: the cell indices (row * width + col), sorted and
+    delta encoded, with the old and the new values of the cells. The undo writes back the old
+    values and the redo the new ones, without reading the raster"""
+
+    __slots__ = ("count", "data", "dtype", "sequence", "width")
+
+    # order of creation of the diffs, for evicting the oldest ones
+    sequence_counter = itertools.count()
+
+    def __init__(self, rows, cols, old_values, new_values, width):
+        cells = np.asarray(rows, dtype=np.int64) * width + np.asarray(cols, dtype=np.int64)
+        order = np.argsort(cells, kind="stable")
+        old_values, new_values = np.asarray(old_values)[order], np.asarray(new_values)[order]
+        self.dtype = np.result_type(old_values, new_values)
+        self.count = len(cells)
+        self.width = width
+        self.sequence = next(EditDiff.sequence_counter)
+        self.data = zlib.compress(
+            b"".join(
+                (
+                    np.diff(cells[order], prepend=0).tobytes(),
+                    old_values.astype(self.dtype).tobytes(),
+                    new_values.astype(self.dtype).tobytes(),
+                )
+            ),
+            1,
+        )
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    def cells(self):
+        """Return the rows, cols, old values and new values of the cells changed"""
+        data = zlib.decompress(self.data)
+        cells = np.cumsum(np.frombuffer(data, dtype=np.int64, count=self.count))
+        offset = self.count * 8
+        old_values = np.frombuffer(data, dtype=self.dtype, count=self.count, offset=offset)
+        new_values = np.frombuffer(data, dtype=self.dtype, count=self.count, offset=offset + old_values.nbytes)
+        return cells // self.width, cells % self.width, old_values, new_values
 
 
 class EditLog:
@@ -763,17 +1285,24 @@ class EditLog:
     purpose to go undo or redo the edit actions by user
 
     For pixels:
-        [(Pixel, value), ...]
+        [(Pixel, EditDiff), ...]
 
-    for polygons:
-        [(polygon_feature, ((Pixel, value), ...)), ...]
+    for lines and polygons:
+        [(feature, EditDiff), ...]
 
+    The diffs of all the edit logs are kept up to the memory budget, the redo entries are
+    evicted first and then the oldest undo entries.
     """
 
+    # maximum size (bytes) of the compressed diffs of all the edit logs
+    memory_budget = 128 * 1024 * 1024
+    instances = weakref.WeakSet()
+
     def __init__(self, edit_type):
         self.edit_type = edit_type
         self.undos = []
         self.redos = []
+        EditLog.instances.add(self)
 
     def can_be_undone(self):
         return len(self.undos) > 0
@@ -781,28 +1310,43 @@ class EditLog:
     def can_be_redone(self):
         return len(self.redos) > 0
 
-    def get_current_status(self, edit_log_entry):
-        if self.edit_type == "pixel":
-            pixel, _ = edit_log_entry
-            return pixel, LayerToEdit.current.get_pixel_value_from_pnt(pixel.qgs_point)
-        if self.edit_type in ["line", "polygon"]:
-            feature, pixel_values = edit_log_entry
-            return feature, [
-                (pixel, LayerToEdit.current.get_pixel_value_from_pnt(pixel.qgs_point)) for pixel, _ in pixel_values
-            ]
-
     def undo(self):
         if self.can_be_undone():
             edit_log_entry = self.undos.pop()
-            self.redos.append(self.get_current_status(edit_log_entry))
+            self.redos.append(edit_log_entry)
             return edit_log_entry
 
     def redo(self):
         if self.can_be_redone():
             edit_log_entry = self.redos.pop()
-            self.undos.append(self.get_current_status(edit_log_entry))
+            self.undos.append(edit_log_entry)
             return edit_log_entry
 
     def add(self, edit_log_entry):
         self.undos.append(edit_log_entry)
         self.redos = []
+        EditLog.evict(keep=edit_log_entry)
+
+    def nbytes(self):
+        return sum(diff.nbytes for _, diff in self.undos + self.redos)
+
+    @staticmethod
+    def evict(keep=None):
+        """Drop entries of all the edit logs until they fit in the memory budget: first the redo
+        entries (the last to be redone first), then the oldest undo entries, but never the entry
+        to keep (the one just added)"""
+        total = sum(edit_log.nbytes() for edit_log in EditLog.instances)
+        while total > EditLog.memory_budget:
+            edit_logs = [edit_log for edit_log in EditLog.instances if edit_log.redos]
+            if edit_logs:
+                oldest = min(edit_logs, key=lambda edit_log: edit_log.redos[0][1].sequence)
+                _, diff = oldest.redos.pop(0)
+            else:
+                edit_logs = [
+                    edit_log for edit_log in EditLog.instances if edit_log.undos and edit_log.undos[0] is not keep
+                ]
+                if not edit_logs:
+                    break
+                oldest = min(edit_logs, key=lambda edit_log: edit_log.undos[0][1].sequence)
+                _, diff = oldest.undos.pop(0)
+            total -= diff.nbytes
@@ -0,0 +1,412 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import itertools
+from datetime import datetime
+
+import numpy as np
+
+# columns of the store and their data types
+COLUMNS = {
+    "rows": np.int32,
+    "cols": np.int32,
+    "old_values": np.int64,
+    "new_values": np.int64,
+    "edit_dates": np.float64,  # POSIX timestamp
+    "groups": np.int32,  # index in group_ids, -1 without group
+    "alive": np.bool_,
+}
+
+
+def search_sorted_keys(sorted_keys, sorted_slots, keys):
+    """Slots of the keys in the sorted index, -1 for the keys that are not in it"""
+    slots = np.full(len(keys), -1, dtype=np.int64)
+    if not len(sorted_keys) or not len(keys):
+        return slots
+    # the search is much faster with the keys in order (as they come from np.nonzero)
+    order = None if np.all(keys[1:] >= keys[:-1]) else np.argsort(keys, kind="stable")
+    query = keys if order is None else keys[order]
+    pos = np.minimum(np.searchsorted(sorted_keys, query), len(sorted_keys) - 1)
+    found = sorted_keys[pos] == query
+    found_slots = np.where(found, sorted_slots[pos], -1)
+    if order is None:
+        return found_slots
+    slots[order] = found_slots
+    return slots
+
+
+def split_by_group(groups, slots):
+    """Pairs of (group, slots of the group)"""
+    if not len(groups):
+        return []
+    if (groups == groups[0]).all():
+        return [(int(groups[0]), slots)]
+    return [(int(group), slots[groups == group]) for group in np.unique(groups)]
+
+
+class PixelLogStore:
+    """Registry of the pixels edited in the layer, kept in growable NumPy columns (row, col,
+    old value, new value, edit date and group) with an index on the grid cell.
+
+    A pixel is logged once: a new edit of a logged pixel updates its new value, date and
+    group, and its log is removed when the pixel goes back to the original value.
+    """
+
+    initial_capacity = 1024
+    # slots added after the last sort of the index that are kept in a dict
+    recent_limit = 65536
+
+    def __init__(self, width):
+        self.width = width  # number of columns of the raster, for the keys of the cells
+        self.clear()
+
+    def clear(self):
+        # file of the pixel logs saved that are loaded on the first use of the store
+        self.pending_file = None
+        self.pending_count = 0
+        self.size = 0  # slots used, including the removed logs
+        self.count = 0  # pixels logged
+        for name, dtype in COLUMNS.items():
+            setattr(self, name, np.zeros(self.initial_capacity, dtype=dtype))
+        self.group_ids = []
+        self.group_index = {}
+        # group index -> chunks of slots of its members, the slots that moved to other groups or
+        # were removed are filtered when the members of the group are read
+        self.group_slots = {}
+        # groups changed since the registry took them, None if the store was cleared
+        self.dirty_groups = None
+        # index of the cells: keys sorted with their slots, plus a dict for the recent slots
+        self.index_keys = np.empty(0, dtype=np.int64)
+        self.index_slots = np.empty(0, dtype=np.int64)
+        self.recent = {}
+
+    def __len__(self):
+        return self.pending_count if self.pending_file else self.count
+
+    def load_pending(self):
+        if self.pending_file:
+            file_path, self.pending_file = self.pending_file, None
+            self.load(file_path)
+
+    def save(self, file_path):
+        """Save the pixel logs as compressed NumPy columns (.npz)"""
+        self.load_pending()
+        live = self.live_slots()
+        np.savez_compressed(
+            file_path,
+            **{name: getattr(self, name)[live] for name in COLUMNS if name != "alive"},
+            group_ids=np.array([str(group_id) for group_id in self.group_ids], dtype=str),
+        )
+
+    def load(self, file_path, lazy=False, count=0):
+        """Load the pixel logs saved with save, if lazy they are loaded when the store is used
+        (count is the number of pixel logs in the file)"""
+        self.clear()
+        if lazy:
+            self.pending_file = file_path
+            self.pending_count = count
+            return
+        with np.load(file_path, allow_pickle=False) as data:
+            for group_id in data["group_ids"].tolist():
+                self.group_of(group_id)
+            self.insert(*(data[name] for name in COLUMNS if name != "alive"))
+        self.dirty_groups = None
+
+    def cell_keys(self, rows, cols):
+        return np.asarray(rows, dtype=np.int64) * self.width + np.asarray(cols, dtype=np.int64)
+
+    def group_of(self, group_id):
+        """Index of the group id in the store"""
+        if group_id is None:
+            return -1
+        if group_id not in self.group_index:
+            self.group_index[group_id] = len(self.group_ids)
+            self.group_ids.append(group_id)
+        return self.group_index[group_id]
+
+    def add_to_group(self, group, slots):
+        if group >= 0:
+            self.group_slots.setdefault(group, []).append(np.asarray(slots, dtype=np.int64))
+        self.mark_dirty([group])
+
+    def mark_dirty(self, groups):
+        if self.dirty_groups is not None:
+            self.dirty_groups.update(group for group in groups if group >= 0)
+
+    def take_dirty_groups(self):
+        """Ids of the groups changed since the last call, None if the store was cleared or
+        restored (all the groups must be rebuilt)"""
+        self.load_pending()
+        dirty_groups, self.dirty_groups = self.dirty_groups, set()
+        return None if dirty_groups is None else {self.group_ids[group] for group in dirty_groups}
+
+    def members(self, group_id):
+        """Slots of the pixels logged in the group, sorted by edit date"""
+        self.load_pending()
+        group = self.group_index.get(group_id, -1)
+        chunks = self.group_slots.get(group)
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+        slots = np.unique(np.concatenate(chunks)) if len(chunks) > 1 else chunks[0]
+        slots = slots[self.alive[slots] & (self.groups[slots] == group)]
+        slots = slots[np.argsort(self.edit_dates[slots], kind="stable")]
+        # keep the members filtered
+        if len(slots):
+            self.group_slots[group] = [slots]
+        else:
+            del self.group_slots[group]
+        return slots
+
+    def index_groups(self):
+        """Rebuild the members of all the groups from the columns"""
+        self.group_slots = {self.group_index[group_id]: [slots] for group_id, slots in self.group_members().items()}
+
+    def reserve(self, count):
+        capacity = len(self.alive)
+        if self.size + count <= capacity:
+            return
+        while capacity < self.size + count:
+            capacity *= 2
+        for name in COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[: self.size] = column[: self.size]
+            setattr(self, name, grown)
+
+    def lookup(self, rows, cols):
+        """Slots of the pixels logged, -1 for the pixels that are not in the store"""
+        self.load_pending()
+        keys = self.cell_keys(rows, cols)
+        slots = search_sorted_keys(self.index_keys, self.index_slots, keys)
+        if self.recent and len(keys) <= len(self.recent):
+            recent = np.fromiter(
+                map(self.recent.get, keys.tolist(), itertools.repeat(-1)), dtype=np.int64, count=len(keys)
+            )
+            slots = np.where(recent >= 0, recent, slots)
+        elif self.recent:
+            recent_keys = np.fromiter(self.recent.keys(), dtype=np.int64, count=len(self.recent))
+            recent_slots = np.fromiter(self.recent.values(), dtype=np.int64, count=len(self.recent))
+            order = np.argsort(recent_keys)
+            recent = search_sorted_keys(recent_keys[order], recent_slots[order], keys)
+            slots = np.where(recent >= 0, recent, slots)
+        found = slots >= 0
+        slots[found] = np.where(self.alive[slots[found]], slots[found], -1)
+        return slots
+
+    def lookup_one(self, row, col):
+        """Slot of the pixel logged, -1 if it is not in the store"""
+        self.load_pending()
+        key = int(row) * self.width + int(col)
+        slot = self.recent.get(key, -1)
+        if slot < 0 and len(self.index_keys):
+            pos = int(np.searchsorted(self.index_keys, key))
+            if pos < len(self.index_keys) and self.index_keys[pos] == key:
+                slot = int(self.index_slots[pos])
+        return slot if slot >= 0 and self.alive[slot] else -1
+
+    def rebuild_index(self):
+        """Drop the removed logs and sort the index of the cells"""
+        live = np.flatnonzero(self.alive[: self.size])
+        if len(live) < self.size:
+            for name in COLUMNS:
+                column = getattr(self, name)
+                column[: len(live)] = column[live]
+                column[len(live) : self.size] = 0
+            self.size = len(live)
+            self.index_groups()
+        keys = self.cell_keys(self.rows[: self.size], self.cols[: self.size])
+        order = np.argsort(keys, kind="stable")
+        self.index_keys = keys[order]
+        self.index_slots = order.astype(np.int64)
+        self.recent = {}
+
+    def add(self, row, col, old_value, new_value, group_id=None, edit_date=None):
+        """Log the edit of one pixel"""
+        self.load_pending()
+        edit_date = (edit_date or datetime.now()).timestamp()
+        group = self.group_of(group_id)
+        slot = self.lookup_one(row, col)
+        if slot >= 0:
+            self.mark_dirty([int(self.groups[slot])])
+            if self.old_values[slot] == new_value:
+                self.alive[slot] = False
+                self.count -= 1
+            else:
+                self.new_values[slot] = new_value
+                self.edit_dates[slot] = edit_date
+                if self.groups[slot] != group:
+                    self.groups[slot] = group
+                    self.add_to_group(group, [slot])
+            return
+
+        self.reserve(1)
+        slot = self.size
+        self.rows[slot], self.cols[slot] = row, col
+        self.old_values[slot], self.new_values[slot] = old_value, new_value
+        self.edit_dates[slot], self.groups[slot], self.alive[slot] = edit_date, group, True
+        self.size += 1
+        self.count += 1
+        self.add_to_group(group, [slot])
+        if len(self.recent) + 1 > max(self.recent_limit, self.size // 8):
+            self.rebuild_index()
+        else:
+            self.recent[int(row) * self.width + int(col)] = slot
+
+    def add_many(self, rows, cols, old_values, new_values, group_id=None, edit_date=None):
+        """Log the edit of the pixels at the (rows, cols) indices, e.g. from np.nonzero, all in
+        the same group and date. The cells must not be repeated"""
+        self.load_pending()
+        count = len(rows)
+        if not count:
+            return
+        edit_date = (edit_date or datetime.now()).timestamp()
+        self.insert(
+            np.asarray(rows),
+            np.asarray(cols),
+            np.asarray(old_values, dtype=np.int64),
+            np.asarray(new_values, dtype=np.int64),
+            np.full(count, edit_date, dtype=np.float64),
+            np.full(count, self.group_of(group_id), dtype=np.int32),
+        )
+
+    def insert(self, rows, cols, old_values, new_values, edit_dates, groups):
+        slots = self.lookup(rows, cols)
+        logged = slots >= 0
+
+        # pixels already logged: keep the original value, remove the log if it goes back to it
+        if logged.any():
+            logged_slots = slots[logged]
+            self.mark_dirty(group for group, _ in split_by_group(self.groups[logged_slots], logged_slots))
+            reverted = self.old_values[logged_slots] == new_values[logged]
+            self.alive[logged_slots[reverted]] = False
+            self.count -= int(reverted.sum())
+            updated = logged_slots[~reverted]
+            self.new_values[updated] = new_values[logged][~reverted]
+            self.edit_dates[updated] = edit_dates[logged][~reverted]
+            self.groups[updated] = groups[logged][~reverted]
+            for group, group_slots in split_by_group(groups[logged][~reverted], updated):
+                self.add_to_group(group, group_slots)
+
+        # new pixels, appended at the end of the columns
+        new = ~logged
+        new_count = int(new.sum())
+        if not new_count:
+            return
+        self.reserve(new_count)
+        start, end = self.size, self.size + new_count
+        self.rows[start:end] = rows[new]
+        self.cols[start:end] = cols[new]
+        self.old_values[start:end] = old_values[new]
+        self.new_values[start:end] = new_values[new]
+        self.edit_dates[start:end] = edit_dates[new]
+        self.groups[start:end] = groups[new]
+        self.alive[start:end] = True
+        self.size = end
+        self.count += new_count
+        for group, group_slots in split_by_group(groups[new], np.arange(start, end)):
+            self.add_to_group(group, group_slots)
+
+        if len(self.recent) + new_count > max(self.recent_limit, self.size // 8):
+            self.rebuild_index()
+        else:
+            self.recent.update(zip(self.cell_keys(rows[new], cols[new]).tolist(), range(start, end), strict=True))
+
+    def restore(self, rows, cols, old_values, new_values, edit_dates, group_ids):
+        """Load the pixel logs saved, in the order they were saved. The edit dates are datetimes
+        or POSIX timestamps"""
+        self.clear()
+        if not len(rows):
+            return
+        edit_dates = np.asarray(edit_dates)
+        if edit_dates.dtype == object:
+            edit_dates = np.array([edit_date.timestamp() for edit_date in edit_dates.tolist()], dtype=np.float64)
+        # keep only the last log of each cell
+        keys = self.cell_keys(rows, cols)[::-1]
+        _, last = np.unique(keys, return_index=True)
+        last = np.sort(len(keys) - 1 - last)
+        self.insert(
+            np.asarray(rows)[last],
+            np.asarray(cols)[last],
+            np.asarray(old_values, dtype=np.int64)[last],
+            np.asarray(new_values, dtype=np.int64)[last],
+            edit_dates.astype(np.float64)[last],
+            np.fromiter(map(self.group_of, group_ids), dtype=np.int32, count=len(group_ids))[last],
+        )
+        self.dirty_groups = None
+
+    def live_slots(self):
+        self.load_pending()
+        return np.flatnonzero(self.alive[: self.size])
+
+    def group_members(self):
+        """Slots of the pixels logged of each group, sorted by edit date"""
+        live = self.live_slots()
+        live = live[self.groups[live] >= 0]
+        if not len(live):
+            return {}
+        live = live[np.lexsort((self.edit_dates[live], self.groups[live]))]
+        groups = self.groups[live]
+        bounds = np.flatnonzero(np.diff(groups)) + 1
+        return {
+            self.group_ids[members[0]]: slots
+            for members, slots in zip(np.split(groups, bounds), np.split(live, bounds), strict=True)
+        }
+
+    def edit_date(self, slot):
+        return datetime.fromtimestamp(float(self.edit_dates[slot]))
+
+    def group_id(self, slot):
+        group = int(self.groups[slot])
+        return self.group_ids[group] if group >= 0 else None
+
+    def serialize(self, grid):
+        """Pixel logs as records with the map coordinates of the pixel centroid, sorted by edit
+        date and group id"""
+        live = self.live_slots()
+        group_names = [str(group_id) for group_id in self.group_ids] + [str(None)]
+        groups = np.where(self.groups[live] >= 0, self.groups[live], len(self.group_ids))
+        group_rank = np.argsort(np.argsort(np.array(group_names, dtype=object), kind="stable"))
+        live = live[np.lexsort((group_rank[groups], self.edit_dates[live]))]
+
+        x_coords, y_coords = grid.center(self.rows[live].astype(np.float64), self.cols[live].astype(np.float64))
+        edit_dates = {}
+        records = []
+        for x_coord, y_coord, old_value, new_value, edit_date, group in zip(
+            x_coords.tolist(),
+            y_coords.tolist(),
+            self.old_values[live].tolist(),
+            self.new_values[live].tolist(),
+            self.edit_dates[live].tolist(),
+            self.groups[live].tolist(),
+            strict=True,
+        ):
+            if edit_date not in edit_dates:
+                edit_dates[edit_date] = datetime.fromtimestamp(edit_date).isoformat()
+            records.append(
+                {
+                    "x": x_coord,
+                    "y": y_coord,
+                    "old_value": old_value,
+                    "new_value": new_value,
+                    "edit_date": edit_dates[edit_date],
+                    "group_id": group_names[group] if group >= 0 else None,
+                }
+            )
+        return records
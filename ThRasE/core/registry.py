@@ -18,99 +18,77 @@
  ***************************************************************************/
 """
 
-import itertools
 import os
+import uuid
 
+import numpy as np
+from osgeo import gdal
 from qgis.core import (
+    Qgis,
     QgsCoordinateTransformContext,
     QgsFeature,
     QgsField,
     QgsFields,
     QgsFillSymbol,
     QgsGeometry,
+    QgsPalettedRasterRenderer,
+    QgsRasterLayer,
     QgsRectangle,
     QgsSingleSymbolRenderer,
     QgsVectorFileWriter,
     QgsVectorLayer,
     QgsWkbTypes,
 )
+from qgis.gui import QgsRubberBand
 from qgis.PyQt.QtCore import QVariant
 from qgis.PyQt.QtGui import QColor
 
-
-class RegistryTile:
-    def __init__(self, idx, group_idx, center_x, center_y, px_size_x, px_size_y, memory_layer):
-        self.idx = idx
-        self.group_idx = group_idx
-        self.center_x = center_x
-        self.center_y = center_y
-        self.px_size_x = px_size_x
-        self.px_size_y = px_size_y
-
-        xmin = center_x - px_size_x / 2
-        xmax = center_x + px_size_x / 2
-        ymin = center_y - px_size_y / 2
-        ymax = center_y + px_size_y / 2
-
-        self.extent = QgsRectangle(xmin, ymin, xmax, ymax)
-
-        # create feature in memory layer
-        geom = QgsGeometry.fromRect(self.extent)
-        feature = QgsFeature(memory_layer.fields())
-        feature.setGeometry(geom)
-        feature.setAttributes([self.idx, self.group_idx, center_x, center_y])
-
-        # add feature to memory layer
-        memory_layer.dataProvider().addFeature(feature)
-        self.feature_id = feature.id()
+from ThRasE.core.registry_geopackage import RegistryGeoPackage
+from ThRasE.utils.raster_utils import burn_cells_to_raster, polygonize_cells
 
 
 class RegistryTileGroup:
-    def __init__(self, idx, group_id, edit_date, tiles, memory_layer, registry):
+    """Group of pixels edited in the same action, drawn as one feature with the dissolved
+    outline of its pixels"""
+
+    def __init__(self, idx, group_id, edit_date, pixel_count, geometry, memory_layer, registry):
         self.idx = idx
         self.group_id = group_id
         self.edit_date = edit_date
-        self.tiles = tiles
+        self.pixel_count = pixel_count
         self.memory_layer = memory_layer
         self.registry = registry
-        self.extent = None
+        # the display of the group is precomputed once
+        self.geometry = geometry
+        self.extent = geometry.boundingBox()
+        self.centroid = self.extent.center()
 
-    def tiles_extent(self):
-        if self.extent is None:
-            extent = QgsRectangle()
-            for tile in self.tiles:
-                extent.combineExtentWith(tile.extent)
-            self.extent = extent
-        return self.extent
+        # create the feature of the group in the memory layer
+        feature = QgsFeature(memory_layer.fields())
+        feature.setGeometry(geometry)
+        feature.setAttributes([self.idx, self.pixel_count])
+        memory_layer.dataProvider().addFeature(feature)
+        self.feature_id = feature.id()
 
     def show(self):
-        # display tile borders without fill by applying filter to memory layer
-        if not self.tiles:
+        # display the group outline in the highlight overlay, the layers are not redrawn
+        if not self.pixel_count:
             return
-
-        # set filter to show only tiles from this group
-        filter_expr = f'"group_idx" = {self.idx}'
-        self.memory_layer.setSubsetString(filter_expr)
-        self.memory_layer.triggerRepaint()
-        self.registry.refresh_all_canvases()
+        self.registry.highlight_group(self)
 
     def clear(self):
-        # hide tiles by setting a filter that matches nothing
-        self.memory_layer.setSubsetString("FALSE")
-        self.memory_layer.triggerRepaint()
-        self.registry.refresh_all_canvases()
+        self.registry.clear_highlight()
 
     def center(self):
         # center the view on the group without changing zoom level
         from ThRasE.gui.main_dialog import ThRasEDialog
 
-        tiles_extent = self.tiles_extent()
-        if tiles_extent.isEmpty():
+        if self.extent.isEmpty():
             return
 
         # get the center point of the group
-        center_x = tiles_extent.center().x()
-        center_y = tiles_extent.center().y()
+        center_x = self.centroid.x()
+        center_y = self.centroid.y()
 
         # center all active views on this point without changing scale
         for view_widget in ThRasEDialog.view_widgets:
@@ -134,7 +112,7 @@ class Registry:
         self.tiles_color = QColor("#ff00ff")
         self.enabled = True
 
-        # create memory vector layer for tiles
+        # create memory vector layer for the outlines of the groups
         self.memory_layer = None
         self.create_memory_layer()
 
@@ -142,19 +120,48 @@ class Registry:
         self.renderer = None
         self.setup_renderer()
 
+        # show all as a raster overlay aligned to the thematic grid, with the group index
+        # burned in the edited cells, instead of the tiles of all groups
+        self.show_all_as_raster = True
+        self.overlay_layer = None
+        self.overlay_path = None
+        self.overlay_outdated = True
+        self.overlay_visible = False
+
+        # lightweight overlay of the current group in each canvas
+        self.highlights = {}
+
+        # optional persistent registry in a GeoPackage next to the thematic raster
+        self.sidecar = None
+
+    def enable_sidecar(self, enabled, sync=True):
+        """Keep the pixel logs in the GeoPackage sidecar, written in full when it is enabled
+        (unless it is already in sync) and then incrementally with the groups changed"""
+        if not enabled:
+            if self.sidecar:
+                self.sidecar.close()
+            self.sidecar = None
+            return
+        if self.sidecar is None:
+            self.sidecar = RegistryGeoPackage(
+                RegistryGeoPackage.sidecar_path(self.layer_to_edit.file_path),
+                self.layer_to_edit.grid,
+                self.layer_to_edit.qgs_layer.crs().toWkt(),
+            )
+        if sync:
+            self.sidecar.sync(self.layer_to_edit.pixel_log_store)
+
     def create_memory_layer(self):
-        """Create memory vector layer to store tile geometries."""
+        """Create memory vector layer to store one outline geometry per group."""
         crs = self.layer_to_edit.qgs_layer.crs()
-        self.memory_layer = QgsVectorLayer(f"Polygon?crs={crs.authid()}", "ThRasE Registry", "memory")
+        self.memory_layer = QgsVectorLayer(f"MultiPolygon?crs={crs.authid()}", "ThRasE Registry", "memory")
 
         # add fields
         provider = self.memory_layer.dataProvider()
         provider.addAttributes(
             [
-                QgsField("tile_idx", QVariant.Int),
                 QgsField("group_idx", QVariant.Int),
-                QgsField("center_x", QVariant.Double),
-                QgsField("center_y", QVariant.Double),
+                QgsField("pixels", QVariant.Int),
             ]
         )
         self.memory_layer.updateFields()
@@ -183,6 +190,94 @@ class Registry:
         )
         self.renderer = QgsSingleSymbolRenderer(border_symbol)
 
+    def highlight_group(self, group):
+        """Draw the outline of the group over the active canvases with rubber bands, only
+        the canvas items are repainted"""
+        from ThRasE.gui.main_dialog import ThRasEDialog
+
+        for view_widget in ThRasEDialog.view_widgets:
+            if not view_widget.is_active:
+                continue
+            canvas = view_widget.render_widget.canvas
+            rubber_band = self.highlights.get(canvas)
+            if rubber_band is None:
+                rubber_band = QgsRubberBand(canvas, Qgis.GeometryType.Polygon)
+                rubber_band.setFillColor(QColor(0, 0, 0, 0))
+                rubber_band.setWidth(2)
+                self.highlights[canvas] = rubber_band
+            rubber_band.setStrokeColor(self.tiles_color)
+            rubber_band.setToGeometry(group.geometry, self.layer_to_edit.qgs_layer)
+
+    def clear_highlight(self):
+        for rubber_band in self.highlights.values():
+            rubber_band.reset(Qgis.GeometryType.Polygon)
+
+    def setup_overlay_renderer(self):
+        """Paletted renderer of the raster overlay, all groups drawn with the tiles color"""
+        if not self.overlay_layer:
+            return
+        color = QColor(self.tiles_color)
+        classes = [QgsPalettedRasterRenderer.Class(group.idx, color, str(group.idx)) for group in self.groups]
+        renderer = QgsPalettedRasterRenderer(self.overlay_layer.dataProvider(), 1, classes)
+        renderer.setOpacity(0.6)
+        self.overlay_layer.setRenderer(renderer)
+
+    def build_overlay(self):
+        """Burn the group index of the edited cells into an in-memory raster aligned to the
+        thematic grid, only the tiles with edits are written"""
+        store = self.layer_to_edit.pixel_log_store
+        live = store.live_slots()
+        group_of_slot = store.groups[live]
+        live = live[group_of_slot >= 0]
+        group_of_slot = group_of_slot[group_of_slot >= 0]
+
+        # map the group index of the store to the index of the registry group
+        store_idx_to_group_idx = np.zeros(len(store.group_ids), dtype=np.uint32)
+        for group in self.groups:
+            store_idx = store.group_index.get(group.group_id)
+            if store_idx is not None:
+                store_idx_to_group_idx[store_idx] = group.idx
+        values = store_idx_to_group_idx[group_of_slot]
+        keep = values > 0
+        data_type = gdal.GDT_UInt16 if len(self.groups) < 65535 else gdal.GDT_UInt32
+
+        grid = self.layer_to_edit.grid
+        overlay_path = f"/vsimem/thrase_registry_{uuid.uuid4().hex}.tif"
+        burn_cells_to_raster(
+            overlay_path,
+            self.layer_to_edit.width,
+            self.layer_to_edit.height,
+            grid.geo_transform(),
+            self.layer_to_edit.qgs_layer.crs().toWkt(),
+            store.rows[live][keep],
+            store.cols[live][keep],
+            values[keep],
+            data_type=data_type,
+        )
+
+        self.remove_overlay()
+        self.overlay_path = overlay_path
+        self.overlay_layer = QgsRasterLayer(overlay_path, "ThRasE Registry overlay", "gdal")
+        self.setup_overlay_renderer()
+        self.overlay_outdated = False
+
+    def remove_overlay(self):
+        """Release the raster overlay and its in-memory file"""
+        self.overlay_layer = None
+        if self.overlay_path:
+            gdal.Unlink(self.overlay_path)
+            self.overlay_path = None
+        self.overlay_outdated = True
+
+    def canvas_layers(self):
+        """Layers of the registry to draw on top of the layers of the view canvases"""
+        layers = []
+        if self.memory_layer:
+            layers.append(self.memory_layer)
+        if self.overlay_visible and self.overlay_layer:
+            layers.append(self.overlay_layer)
+        return layers
+
     def update_registry_layer_in_canvases(self):
         """Refresh render layers in all active canvases to update registry layer visibility."""
         from ThRasE.gui.main_dialog import ThRasEDialog
@@ -195,17 +290,25 @@ class Registry:
         self.clear()
         self.groups = []
         self.current_group = None
+        had_overlay = self.overlay_layer is not None
+        self.remove_overlay()
 
         # clear memory layer
         if self.memory_layer:
             self.memory_layer.dataProvider().truncate()
             self.update_registry_layer_in_canvases()
+        elif had_overlay:
+            self.update_registry_layer_in_canvases()
 
     def clear(self):
+        self.clear_highlight()
         # hide all features by setting a filter that matches nothing
         if self.memory_layer:
             self.memory_layer.setSubsetString("FALSE")
             self.memory_layer.triggerRepaint()
+        if self.overlay_visible:
+            self.overlay_visible = False
+            self.update_registry_layer_in_canvases()
 
     def refresh_all_canvases(self):
         """Refresh all active view widget canvases."""
@@ -216,10 +319,20 @@ class Registry:
                 view_widget.render_widget.canvas.refresh()
 
     def show_all(self):
-        """Display all tiles with border."""
+        """Display the outlines of all groups, or all edited cells in the raster overlay."""
         if not self.groups or not self.memory_layer:
             return
 
+        if self.show_all_as_raster:
+            # the cost of the overlay rendering depends on the screen, not on the edits
+            if self.overlay_outdated or not self.overlay_layer:
+                self.build_overlay()
+            self.overlay_visible = True
+            self.update_registry_layer_in_canvases()
+            self.overlay_layer.triggerRepaint()
+            self.refresh_all_canvases()
+            return
+
         # ensure layer is in canvases
         self.update_registry_layer_in_canvases()
 
@@ -236,6 +349,10 @@ class Registry:
         if not self.memory_layer:
             return
 
+        if self.overlay_visible:
+            self.overlay_visible = False
+            self.update_registry_layer_in_canvases()
+
         # check if registry widget is visible and enabled, and if we have a current group
         from ThRasE.thrase import ThRasE
 
@@ -249,61 +366,122 @@ class Registry:
 
         if registry_visible:
             # restore current group display
-            self.memory_layer.setRenderer(self.renderer.clone())
-            filter_expr = f'"group_idx" = {self.current_group.idx}'
-            self.memory_layer.setSubsetString(filter_expr)
+            self.current_group.show()
         else:
-            # hide all features
-            self.memory_layer.setSubsetString("FALSE")
+            self.clear_highlight()
 
-        self.memory_layer.triggerRepaint()
-        self.refresh_all_canvases()
+        # hide all features of the vector show all
+        if self.memory_layer.subsetString() != "FALSE":
+            self.memory_layer.setSubsetString("FALSE")
+            self.memory_layer.triggerRepaint()
+            self.refresh_all_canvases()
 
     def update_color(self):
         """Update the border color for current display."""
         # recreate renderer with current color
         self.setup_renderer(self.tiles_color)
 
+        for rubber_band in self.highlights.values():
+            rubber_band.setStrokeColor(self.tiles_color)
+
         # if currently displaying something, update renderer
         if self.memory_layer and self.memory_layer.subsetString() != "FALSE":
             self.memory_layer.setRenderer(self.renderer.clone())
             self.memory_layer.triggerRepaint()
             self.refresh_all_canvases()
 
-    def update(self, force_rebuild=False):
-        """Update registry state after pixel edits."""
-        grouped_logs = {
-            gid: list(logs)
-            for gid, logs in itertools.groupby(
-                (pl for pl in self.layer_to_edit.pixel_log_store.values() if pl.group_id is not None),
-                key=lambda pl: pl.group_id,
-            )
-        }
+        if self.overlay_layer:
+            self.setup_overlay_renderer()
+            if self.overlay_visible:
+                self.overlay_layer.triggerRepaint()
+                self.refresh_all_canvases()
 
-        if not grouped_logs:
+    def update(self, force_rebuild=False):
+        """Update registry state after pixel edits, only the groups changed since the last
+        update are rebuilt."""
+        store = self.layer_to_edit.pixel_log_store
+        dirty_ids = store.take_dirty_groups()
+        if self.sidecar:
+            self.sidecar.sync(store, dirty_ids)
+
+        if not len(store):
             if self.groups:
                 self.delete()
             return False
 
-        if force_rebuild:
-            return self.add_registry_groups(grouped_logs, reset=True)
+        if force_rebuild or (dirty_ids is None and self.groups):
+            return self.add_registry_groups(store.group_members(), reset=True)
+        if dirty_ids is None:
+            return self.add_registry_groups(store.group_members(), reset=False)
+        if not dirty_ids:
+            return bool(self.groups)
 
+        members = {gid: store.members(gid) for gid in dirty_ids}
         existing_ids = {group.group_id for group in self.groups}
-        current_ids = set(grouped_logs.keys())
 
-        removed_ids = existing_ids - current_ids
-        new_ids = current_ids - existing_ids
+        removed_ids = {gid for gid in dirty_ids & existing_ids if not len(members[gid])}
+        changed_ids = {gid for gid in dirty_ids & existing_ids if len(members[gid])}
+        new_ids = {gid for gid in dirty_ids - existing_ids if len(members[gid])}
 
         changed = False
 
         if removed_ids and self.remove_registry_groups(removed_ids):
             changed = True
 
-        if new_ids and self.add_registry_groups(grouped_logs, group_ids=new_ids, reset=False):
+        if changed_ids and self.refresh_registry_groups(members, changed_ids):
+            changed = True
+
+        if new_ids and self.add_registry_groups(members, group_ids=new_ids, reset=False):
             changed = True
 
         return changed or bool(self.groups)
 
+    def group_outline(self, slots):
+        """Dissolved outline of the pixels logged in the slots of the store."""
+        store = self.layer_to_edit.pixel_log_store
+        outline = polygonize_cells(
+            store.rows[slots], store.cols[slots], self.layer_to_edit.grid.geo_transform(), self.layer_to_edit.width
+        )
+        geometry = QgsGeometry()
+        geometry.fromWkb(outline.ExportToWkb())
+        geometry.convertToMultiType()
+        return geometry
+
+    def create_group(self, idx, group_id, slots):
+        """Create the registry group of the pixels logged in the slots of the store."""
+        store = self.layer_to_edit.pixel_log_store
+        return RegistryTileGroup(
+            idx,
+            group_id,
+            store.edit_date(slots[0]),
+            len(slots),
+            self.group_outline(slots),
+            self.memory_layer,
+            self,
+        )
+
+    def refresh_registry_groups(self, group_id_to_logs, group_ids):
+        """Recreate the outlines of registry groups whose pixels changed, keeping their order."""
+        to_refresh = [group for group in self.groups if group.group_id in group_ids]
+        if not self.memory_layer or not to_refresh:
+            return False
+
+        self.memory_layer.startEditing()
+        self.memory_layer.dataProvider().deleteFeatures([group.feature_id for group in to_refresh])
+        refreshed = {
+            group.group_id: self.create_group(group.idx, group.group_id, group_id_to_logs[group.group_id])
+            for group in to_refresh
+        }
+        self.groups = [refreshed.get(group.group_id, group) for group in self.groups]
+        if self.current_group and self.current_group.group_id in refreshed:
+            self.current_group = refreshed[self.current_group.group_id]
+        self.memory_layer.commitChanges()
+        self.memory_layer.updateExtents()
+        self.memory_layer.triggerRepaint()
+        self.overlay_outdated = True
+
+        return True
+
     def remove_registry_groups(self, group_ids):
         """Remove registry groups to the memory layer."""
         if not self.memory_layer or not self.groups or not group_ids:
@@ -315,9 +493,7 @@ class Registry:
             return False
 
         provider = self.memory_layer.dataProvider()
-        feature_ids = []
-        for group in to_remove:
-            feature_ids.extend(tile.feature_id for tile in group.tiles)
+        feature_ids = [group.feature_id for group in to_remove]
 
         remaining_groups = [group for group in self.groups if group.group_id not in target_ids]
         previous_current_id = self.current_group.group_id if self.current_group else None
@@ -333,10 +509,8 @@ class Registry:
             if group.idx == new_idx:
                 continue
             group.idx = new_idx
-            for tile in group.tiles:
-                tile.group_idx = new_idx
-                if group_idx_field >= 0:
-                    attr_updates.setdefault(tile.feature_id, {})[group_idx_field] = new_idx
+            if group_idx_field >= 0:
+                attr_updates[group.feature_id] = {group_idx_field: new_idx}
 
         if attr_updates:
             provider.changeAttributeValues(attr_updates)
@@ -345,6 +519,7 @@ class Registry:
         self.memory_layer.updateExtents()
 
         self.groups = remaining_groups
+        self.overlay_outdated = True
 
         if previous_current_id and previous_current_id not in target_ids:
             self.current_group = next((g for g in remaining_groups if g.group_id == previous_current_id), None)
@@ -353,20 +528,18 @@ class Registry:
         else:
             self.current_group = None
 
-        subset_after = subset_before
-        if subset_before.startswith('"group_idx"'):
-            subset_after = f'"group_idx" = {self.current_group.idx}' if self.current_group else "FALSE"
-        elif subset_before == "" and not self.groups:
-            subset_after = "FALSE"
-
-        self.memory_layer.setSubsetString(subset_after)
+        if not self.current_group:
+            self.clear_highlight()
+        if subset_before == "" and not self.groups:
+            self.memory_layer.setSubsetString("FALSE")
         self.memory_layer.triggerRepaint()
         self.refresh_all_canvases()
 
         return True
 
     def add_registry_groups(self, group_id_to_logs, group_ids=None, reset=False):
-        """Add registry tile groups to the registry memory layer."""
+        """Add registry groups to the registry memory layer, from the slots of the pixel
+        logs of each group in the pixel log store."""
         if reset:
             self.delete()
             self.create_memory_layer()
@@ -381,30 +554,22 @@ class Registry:
             if group_ids is not None
             else group_id_to_logs.items()
         )
-        for gid, logs in iterable:
-            if not logs:
+        store = self.layer_to_edit.pixel_log_store
+        for gid, slots in iterable:
+            if slots is None or not len(slots):
                 continue
-            logs_sorted = sorted(logs, key=lambda pl: pl.edit_date)
-            first_date = logs_sorted[0].edit_date
-            entries.append((gid, first_date, logs_sorted))
+            # the slots are sorted by edit date
+            entries.append((gid, store.edit_date(slots[0]), slots))
 
         if not entries:
             return False
 
         entries.sort(key=lambda item: item[1])
 
-        psx = self.layer_to_edit.qgs_layer.rasterUnitsPerPixelX()
-        psy = self.layer_to_edit.qgs_layer.rasterUnitsPerPixelY()
-
         self.memory_layer.startEditing()
 
-        for gid, fdate, logs_sorted in entries:
-            tiles = []
-            for idx, pl in enumerate(logs_sorted, start=1):
-                cx = pl.pixel.x()
-                cy = pl.pixel.y()
-                tiles.append(RegistryTile(idx, next_idx, cx, cy, psx, psy, self.memory_layer))
-            self.groups.append(RegistryTileGroup(next_idx, gid, fdate, tiles, self.memory_layer, self))
+        for gid, _, slots in entries:
+            self.groups.append(self.create_group(next_idx, gid, slots))
             next_idx += 1
 
         self.memory_layer.commitChanges()
@@ -412,6 +577,7 @@ class Registry:
 
         if reset:
             self.current_group = self.groups[0] if self.groups else None
+        self.overlay_outdated = True
 
         return True
 
@@ -422,13 +588,6 @@ class Registry:
         if not self.current_group:
             return
 
-        # ensure layer is in canvases
-        self.update_registry_layer_in_canvases()
-
-        # apply renderer for current group
-        if self.memory_layer:
-            self.memory_layer.setRenderer(self.renderer.clone())
-
         if ThRasE.dialog.registry_widget.autoCenter.isChecked():
             self.current_group.center()
         self.current_group.show()
@@ -470,11 +629,11 @@ class Registry:
         half_psy = psy / 2
 
         # build features efficiently
+        store = self.layer_to_edit.pixel_log_store
+        live = store.live_slots()
+        x_coords, y_coords = self.layer_to_edit.grid.center(store.rows[live], store.cols[live])
         features = []
-        for pl in self.layer_to_edit.pixel_log_store.values():
-            cx = pl.pixel.x()
-            cy = pl.pixel.y()
-
+        for slot, cx, cy in zip(live.tolist(), x_coords.tolist(), y_coords.tolist(), strict=True):
             # create geometry
             rect = QgsRectangle(cx - half_psx, cy - half_psy, cx + half_psx, cy + half_psy)
             geom = QgsGeometry.fromRect(rect)
@@ -483,7 +642,12 @@ class Registry:
             feat = QgsFeature(fields)
             feat.setGeometry(geom)
             feat.setAttributes(
-                [group_ids.get(pl.group_id), int(pl.old_value), int(pl.new_value), pl.edit_date.isoformat()]
+                [
+                    group_ids.get(store.group_id(slot)),
+                    int(store.old_values[slot]),
+                    int(store.new_values[slot]),
+                    store.edit_date(slot).isoformat(),
+                ]
             )
             features.append(feat)
 
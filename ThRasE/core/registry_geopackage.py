@@ -0,0 +1,211 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+
+import numpy as np
+from osgeo import ogr, osr
+
+# fields of the pixel logs in the GeoPackage
+FIELDS = {
+    "row": ogr.OFTInteger,
+    "col": ogr.OFTInteger,
+    "old_value": ogr.OFTInteger64,
+    "new_value": ogr.OFTInteger64,
+    "edit_time": ogr.OFTReal,  # POSIX timestamp
+    "group_id": ogr.OFTString,
+}
+
+# WKB of a polygon with one ring of 5 points, little endian
+POLYGON_WKB = np.dtype([("order", "u1"), ("type", "<u4"), ("rings", "<u4"), ("points", "<u4"), ("xy", "<f8", (10,))])
+
+
+def pixels_polygon_wkb(grid, rows, cols):
+    """WKB of the squares of the pixels, built at once for all the pixels
+
+    Returns:
+        (bytes, int): WKB of all the squares concatenated and the size of each one
+    """
+    x_min = grid.xmin + np.asarray(cols, dtype=np.float64) * grid.pixel_size_x
+    y_max = grid.ymax - np.asarray(rows, dtype=np.float64) * grid.pixel_size_y
+    x_max = x_min + grid.pixel_size_x
+    y_min = y_max - grid.pixel_size_y
+
+    records = np.zeros(len(x_min), dtype=POLYGON_WKB)
+    records["order"] = 1
+    records["type"] = ogr.wkbPolygon
+    records["rings"] = 1
+    records["points"] = 5
+    records["xy"] = np.column_stack((x_min, y_max, x_max, y_max, x_max, y_min, x_min, y_min, x_min, y_max))
+    return records.tobytes(), POLYGON_WKB.itemsize
+
+
+class RegistryGeoPackage:
+    """Persistent registry of the pixel logs in a GeoPackage next to the thematic raster. Each
+    pixel logged is the square feature of the pixel, with an R-tree spatial index, and it is
+    kept in sync with the pixel log store by the groups changed in each edit"""
+
+    layer_name = "pixel_logs"
+
+    def __init__(self, file_path, grid, crs_wkt):
+        self.file_path = file_path
+        self.grid = grid
+        self.crs_wkt = crs_wkt
+        self.dataset = None
+
+    @staticmethod
+    def sidecar_path(raster_path):
+        """GeoPackage of the registry next to the thematic raster"""
+        return os.path.splitext(raster_path)[0] + "_thrase_registry.gpkg"
+
+    def open(self):
+        if self.dataset is not None:
+            return self.dataset
+        if os.path.isfile(self.file_path):
+            self.dataset = ogr.Open(self.file_path, update=1)
+            if self.dataset is not None and self.dataset.GetLayerByName(self.layer_name) is not None:
+                return self.dataset
+            self.dataset = None
+            os.remove(self.file_path)
+
+        self.dataset = ogr.GetDriverByName("GPKG").CreateDataSource(self.file_path)
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(self.crs_wkt)
+        layer = self.dataset.CreateLayer(self.layer_name, srs, ogr.wkbPolygon, ["SPATIAL_INDEX=YES"])
+        for name, field_type in FIELDS.items():
+            layer.CreateField(ogr.FieldDefn(name, field_type))
+        # the groups changed are replaced in each sync
+        self.dataset.ExecuteSQL(f"CREATE INDEX {self.layer_name}_group_id ON {self.layer_name}(group_id)")
+        return self.dataset
+
+    def close(self):
+        self.dataset = None
+
+    def sync(self, store, group_ids=None):
+        """Replace the pixel logs of the groups changed, or all the pixel logs if group_ids
+        is None, in one transaction"""
+        if group_ids is not None and not group_ids:
+            return
+        dataset = self.open()
+        layer = dataset.GetLayerByName(self.layer_name)
+        dataset.StartTransaction()
+        try:
+            if group_ids is None:
+                dataset.ExecuteSQL(f"DELETE FROM {self.layer_name}")
+                slots = store.live_slots()
+            else:
+                names = ",".join("'{}'".format(str(group_id).replace("'", "''")) for group_id in group_ids)
+                dataset.ExecuteSQL(f"DELETE FROM {self.layer_name} WHERE group_id IN ({names})")
+                slots = np.concatenate([store.members(group_id) for group_id in group_ids])
+            self.append(layer, store, slots)
+        except Exception:
+            dataset.RollbackTransaction()
+            raise
+        dataset.CommitTransaction()
+
+    def append(self, layer, store, slots):
+        """Write the pixel logs in the slots of the store as new features"""
+        if not len(slots):
+            return
+        group_names = [str(group_id) for group_id in store.group_ids]
+        wkb, wkb_size = pixels_polygon_wkb(self.grid, store.rows[slots], store.cols[slots])
+        definition = layer.GetLayerDefn()
+        for idx, (row, col, old_value, new_value, edit_time, group) in enumerate(
+            zip(
+                store.rows[slots].tolist(),
+                store.cols[slots].tolist(),
+                store.old_values[slots].tolist(),
+                store.new_values[slots].tolist(),
+                store.edit_dates[slots].tolist(),
+                store.groups[slots].tolist(),
+                strict=True,
+            )
+        ):
+            feature = ogr.Feature(definition)
+            feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb[idx * wkb_size : (idx + 1) * wkb_size]))
+            feature.SetField("row", row)
+            feature.SetField("col", col)
+            feature.SetField("old_value", old_value)
+            feature.SetField("new_value", new_value)
+            feature.SetField("edit_time", edit_time)
+            if group >= 0:
+                feature.SetField("group_id", group_names[group])
+            layer.CreateFeature(feature)
+
+    def read_columns(self, extent=None):
+        """Columns of the pixel logs (rows, cols, old values, new values, edit timestamps and
+        group ids) sorted by edit time, only the pixels inside the extent (xmin, ymin, xmax,
+        ymax) if given, queried with the spatial index"""
+        dataset = self.open()
+        layer = dataset.GetLayerByName(self.layer_name)
+        if extent:
+            layer.SetSpatialFilterRect(*extent)
+        else:
+            # the geometries are only needed to filter by the extent
+            layer.SetSpatialFilter(None)
+            layer.SetIgnoredFields(["OGR_GEOMETRY"])
+        try:
+            columns = self.read_arrow_columns(layer) if hasattr(layer, "GetArrowStreamAsNumPy") else None
+            if columns is None:
+                columns = self.read_feature_columns(layer)
+        finally:
+            layer.SetIgnoredFields([])
+            layer.SetSpatialFilter(None)
+
+        order = np.argsort(columns["edit_time"], kind="stable")
+        return (
+            columns["row"][order],
+            columns["col"][order],
+            columns["old_value"][order],
+            columns["new_value"][order],
+            columns["edit_time"][order],
+            [None if group_id is None else str(group_id) for group_id in columns["group_id"][order].tolist()],
+        )
+
+    @staticmethod
+    def read_arrow_columns(layer):
+        """Read the fields in batches of NumPy arrays, None if the Arrow stream is not available"""
+        try:
+            stream = layer.GetArrowStreamAsNumPy(options=["USE_MASKED_ARRAYS=NO", "INCLUDE_FID=NO"])
+        except Exception:
+            return None
+        batches = {name: [] for name in FIELDS}
+        for batch in stream:
+            for name in FIELDS:
+                values = batch[name]
+                if name == "group_id":
+                    values = np.array(
+                        [value.decode("utf-8") if isinstance(value, bytes) else value for value in values],
+                        dtype=object,
+                    )
+                batches[name].append(values)
+        return {
+            name: np.concatenate(chunks) if chunks else np.empty(0, dtype=object if name == "group_id" else None)
+            for name, chunks in batches.items()
+        }
+
+    @staticmethod
+    def read_feature_columns(layer):
+        values = {name: [] for name in FIELDS}
+        layer.ResetReading()
+        for feature in layer:
+            for name in FIELDS:
+                values[name].append(feature.GetField(name))
+        return {name: np.array(column, dtype=object if name == "group_id" else None) for name, column in values.items()}
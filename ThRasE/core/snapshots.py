@@ -0,0 +1,245 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import json
+import os
+import struct
+import uuid
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+# record of a block: block column, block row and size of the compressed values
+BLOCK_HEADER = struct.Struct("<iiI")
+
+
+class Snapshot:
+    """Snapshot of the thematic raster, with the native blocks saved before their first write
+    after it, as compressed records in its file"""
+
+    def __init__(self, snapshot_id, name, date, file_path):
+        self.id = snapshot_id
+        self.name = name
+        self.date = date
+        self.file_path = file_path
+        # (block_x, block_y) -> offset of the record in the file
+        self.offsets = {}
+
+    def load(self):
+        """Index the blocks of the file reading only the record headers. The file is truncated
+        after the last complete record (e.g. torn by a crash), so the records added next are
+        aligned"""
+        self.offsets = {}
+        if not os.path.isfile(self.file_path):
+            return
+        with open(self.file_path, "r+b") as snapshot_file:
+            file_size = os.fstat(snapshot_file.fileno()).st_size
+            offset = 0
+            while offset + BLOCK_HEADER.size <= file_size:
+                block_x, block_y, size = BLOCK_HEADER.unpack(snapshot_file.read(BLOCK_HEADER.size))
+                if offset + BLOCK_HEADER.size + size > file_size:
+                    break
+                self.offsets.setdefault((block_x, block_y), offset)
+                offset += BLOCK_HEADER.size + size
+                snapshot_file.seek(offset)
+            if offset < file_size:
+                snapshot_file.truncate(offset)
+
+    def add(self, block, values):
+        record = zlib.compress(np.ascontiguousarray(values).tobytes(), 1)
+        with open(self.file_path, "ab") as snapshot_file:
+            self.offsets[block] = snapshot_file.tell()
+            snapshot_file.write(BLOCK_HEADER.pack(*block, len(record)) + record)
+
+    def read(self, block, shape, dtype):
+        with open(self.file_path, "rb") as snapshot_file:
+            snapshot_file.seek(self.offsets[block])
+            _, _, size = BLOCK_HEADER.unpack(snapshot_file.read(BLOCK_HEADER.size))
+            values = np.frombuffer(zlib.decompress(snapshot_file.read(size)), dtype=dtype)
+        return values.reshape(shape)
+
+    def size(self):
+        """Bytes of the blocks saved in the snapshot"""
+        return os.path.getsize(self.file_path) if os.path.isfile(self.file_path) else 0
+
+
+class RasterSnapshots:
+    """Copy-on-write snapshots of a band of the thematic raster by native blocks, in a directory
+    next to the raster. Taking a snapshot only writes its index, and each native block is saved
+    in the last snapshot before it is written for the first time after it. The state of a
+    snapshot is the first copy of each block saved in it or in the later snapshots, and the
+    current values of the blocks never saved
+
+    Args:
+        raster_path (str): file of the thematic raster
+        band (int): band to edit
+        width, height (int): size of the band
+        block_size (tuple): native (x, y) block size of the band
+        dtype (np.dtype): native data type of the band
+    """
+
+    def __init__(self, raster_path, band, width, height, block_size, dtype):
+        self.directory = self.snapshots_dir(raster_path)
+        self.index_path = os.path.join(self.directory, f"band_{band}.json")
+        self.band = band
+        self.width = width
+        self.height = height
+        self.block_x, self.block_y = block_size
+        self.dtype = np.dtype(dtype)
+        # snapshots, the oldest first
+        self.snapshots = []
+        self.load()
+
+    @staticmethod
+    def snapshots_dir(raster_path):
+        """Directory of the snapshots next to the thematic raster"""
+        return os.path.splitext(raster_path)[0] + "_thrase_snapshots"
+
+    def load(self):
+        self.snapshots = []
+        if not os.path.isfile(self.index_path):
+            return
+        with open(self.index_path, encoding="utf-8") as index_file:
+            index = json.load(index_file)
+        for item in index.get("snapshots", []):
+            snapshot = Snapshot(
+                item["id"],
+                item["name"],
+                datetime.fromisoformat(item["date"]),
+                os.path.join(self.directory, f"{item['id']}.blocks"),
+            )
+            snapshot.load()
+            self.snapshots.append(snapshot)
+
+    def save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        index = {
+            "band": self.band,
+            "snapshots": [
+                {"id": snapshot.id, "name": snapshot.name, "date": snapshot.date.isoformat()}
+                for snapshot in self.snapshots
+            ],
+        }
+        with open(self.index_path, "w", encoding="utf-8") as index_file:
+            json.dump(index, index_file, indent=1)
+
+    def take(self, name=None):
+        """Take a snapshot of the current state, no block is copied until it is written"""
+        date = datetime.now()
+        snapshot_id = uuid.uuid4().hex
+        snapshot = Snapshot(
+            snapshot_id,
+            name or date.strftime("%d %b %Y, %H:%M:%S"),
+            date,
+            os.path.join(self.directory, f"{snapshot_id}.blocks"),
+        )
+        self.snapshots.append(snapshot)
+        self.save_index()
+        return snapshot
+
+    def remove(self, snapshot):
+        """Delete the snapshot, its blocks not saved in the previous snapshot are moved to it
+        (they are still the state of that snapshot)"""
+        idx = self.snapshots.index(snapshot)
+        if idx > 0:
+            previous = self.snapshots[idx - 1]
+            for block in snapshot.offsets.keys() - previous.offsets.keys():
+                previous.add(block, snapshot.read(block, self.block_shape(block), self.dtype))
+        self.snapshots.remove(snapshot)
+        if os.path.isfile(snapshot.file_path):
+            os.remove(snapshot.file_path)
+        self.save_index()
+
+    def block_window(self, block):
+        """Pixel window (xoff, yoff, cols, rows) of the native block"""
+        xoff, yoff = block[0] * self.block_x, block[1] * self.block_y
+        return xoff, yoff, min(self.block_x, self.width - xoff), min(self.block_y, self.height - yoff)
+
+    def block_shape(self, block):
+        _, _, cols, rows = self.block_window(block)
+        return rows, cols
+
+    def blocks_in_window(self, xoff, yoff, cols, rows, changed=None):
+        """Native blocks that intersect the window, only the ones with changed pixels if the
+        mask of the window is given"""
+        blocks = []
+        for block_y in range(yoff // self.block_y, (yoff + rows - 1) // self.block_y + 1):
+            for block_x in range(xoff // self.block_x, (xoff + cols - 1) // self.block_x + 1):
+                if changed is not None:
+                    b_xoff, b_yoff, b_cols, b_rows = self.block_window((block_x, block_y))
+                    r0, c0 = max(b_yoff - yoff, 0), max(b_xoff - xoff, 0)
+                    if not changed[r0 : b_yoff + b_rows - yoff, c0 : b_xoff + b_cols - xoff].any():
+                        continue
+                blocks.append((block_x, block_y))
+        return blocks
+
+    def preserve(self, read_window, xoff, yoff, cols, rows, changed=None):
+        """Save in the last snapshot the native blocks of the window, before they are written,
+        that were not saved yet
+
+        Args:
+            read_window (function): read_window(xoff, yoff, cols, rows) -> current values
+            xoff, yoff, cols, rows (int): window to write
+            changed (np.ndarray): boolean mask of the pixels to change in the window
+        """
+        if not self.snapshots:
+            return
+        snapshot = self.snapshots[-1]
+        for block in self.blocks_in_window(xoff, yoff, cols, rows, changed):
+            if block not in snapshot.offsets:
+                snapshot.add(block, read_window(*self.block_window(block)))
+
+    def state_blocks(self, snapshot):
+        """Snapshot with the first copy of each block written after the snapshot given"""
+        holders = {}
+        for later_snapshot in self.snapshots[self.snapshots.index(snapshot) :]:
+            for block in later_snapshot.offsets:
+                holders.setdefault(block, later_snapshot)
+        return holders
+
+    def compare(self, snapshot, read_window):
+        """Yield the blocks that differ from the snapshot: (window, values in the snapshot,
+        current values, changed mask)"""
+        for block, holder in sorted(self.state_blocks(snapshot).items(), key=lambda item: item[0][::-1]):
+            window = self.block_window(block)
+            values = holder.read(block, self.block_shape(block), self.dtype)
+            current_values = read_window(*window)
+            changed = values != current_values
+            if changed.any():
+                yield window, values, current_values, changed
+
+    def diff(self, snapshot, read_window):
+        """Pixels that differ between the snapshot and the current state
+
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray, np.ndarray): rows, cols, values in the
+                snapshot and current values
+        """
+        changes = []
+        for (xoff, yoff, _, _), values, current_values, changed in self.compare(snapshot, read_window):
+            row_indices, col_indices = np.nonzero(changed)
+            changes.append((row_indices + yoff, col_indices + xoff, values[changed], current_values[changed]))
+        if not changes:
+            return tuple(np.empty(0, dtype=dtype) for dtype in (np.int64, np.int64, self.dtype, self.dtype))
+        return tuple(np.concatenate(column) for column in zip(*changes, strict=True))
+
+    def total_size(self):
+        return sum(snapshot.size() for snapshot in self.snapshots)
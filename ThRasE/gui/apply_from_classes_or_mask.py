@@ -19,13 +19,10 @@
 """
 
 import os
-import uuid
 from copy import deepcopy
 from pathlib import Path
-from shutil import move
 
-import numpy as np
-from osgeo import gdal, ogr, osr
+from osgeo import gdal
 from qgis.core import Qgis, QgsFillSymbol, QgsSingleSymbolRenderer
 from qgis.gui import QgsMapToolPan
 from qgis.PyQt import uic
@@ -33,14 +30,15 @@ from qgis.PyQt.QtCore import Qt, pyqtSlot
 from qgis.PyQt.QtGui import QColor
 from qgis.PyQt.QtWidgets import QDialog, QDialogButtonBox, QTableWidgetItem
 
-from ThRasE.core.editing import LayerToEdit, Pixel, PixelLog
-from ThRasE.utils.others_utils import copy_band_metadata, copy_dataset_metadata, get_xml_style
+from ThRasE.core.editing import LayerToEdit
+from ThRasE.utils.others_utils import get_xml_style
 from ThRasE.utils.qgis_utils import (
     apply_symbology,
     browse_dialog_to_load_file,
     get_source_from,
     remove_layers_hidden_from_legend,
 )
+from ThRasE.utils.raster_utils import RasterClassesMask, VectorPolygonMask
 from ThRasE.utils.system_utils import block_signals_to, error_handler, wait_process
 
 # plugin path
@@ -136,7 +134,9 @@ class ApplyFromClassesOrMask(QDialog, FORM_CLASS):
             self.DialogButtons.button(QDialogButtonBox.StandardButton.Apply).clicked.disconnect()
         except (TypeError, RuntimeError):
             pass
-        self.DialogButtons.button(QDialogButtonBox.StandardButton.Apply).clicked.connect(lambda: self.apply())
+        self.DialogButtons.button(QDialogButtonBox.StandardButton.Apply).clicked.connect(
+            lambda: self.apply(background=True)
+        )
         # registry checkbox (tooltip reflects whether the registry is available)
         registry_enabled = LayerToEdit.current.registry.enabled if LayerToEdit.current else False
         self.RecordChangesInRegistry.setChecked(False)
@@ -467,12 +467,9 @@ class ApplyFromClassesOrMask(QDialog, FORM_CLASS):
         return source, None
 
     @wait_process
-    def apply(self):
+    def apply(self, background=False):
         """Apply the recode pixel table changes restricted to the selected mask
-        (raster classes or vector polygons)."""
-
-        from ThRasE.thrase import ThRasE
-
+        (raster classes or vector polygons), in a cancellable task with background."""
         if not (self.raster_mask_layer or self.vector_mask_layer):
             self.MsgBar.pushMessage(
                 "Please select a raster or polygon vector layer to use as a mask",
@@ -510,24 +507,18 @@ class ApplyFromClassesOrMask(QDialog, FORM_CLASS):
             return
 
         record_changes = self.RecordChangesInRegistry.isChecked() and LayerToEdit.current.registry.enabled
-        edited_pixels_count = 0
-        row_indices = col_indices = None
-        old_values = new_values = None
 
         try:
-            # Read the layer to edit using GDAL
+            # Read the georeferencing information of the layer to edit using GDAL
             layer_to_edit_path = LayerToEdit.current.file_path
             ds_in = gdal.Open(layer_to_edit_path, gdal.GA_ReadOnly)
             if ds_in is None:
                 raise RuntimeError(f"Unable to open raster {layer_to_edit_path}")
-
-            num_bands = ds_in.RasterCount
-            src_band = ds_in.GetRasterBand(LayerToEdit.current.band)
-            data_array = src_band.ReadAsArray().astype(int)
-            new_data_array = deepcopy(data_array)
-
-            # Get georeferencing information of the layer to edit
             layer_gt = ds_in.GetGeoTransform()
+            layer_projection = ds_in.GetProjection()
+            layer_x_size, layer_y_size = ds_in.RasterXSize, ds_in.RasterYSize
+            del ds_in
+
             ps_x = layer_gt[1]  # pixel size in x
             ps_y = abs(layer_gt[5])  # pixel size in y (absolute value)
 
@@ -547,143 +538,46 @@ class ApplyFromClassesOrMask(QDialog, FORM_CLASS):
                 self.MsgBar.pushMessage(
                     "No pixels were identified within the overlap extent", level=Qgis.MessageLevel.Info, duration=10
                 )
-                del ds_in
                 return
 
             # Clamp to valid bounds for layer to edit
             layer_idx_x = max(0, layer_idx_x)
             layer_idx_y = max(0, layer_idx_y)
-            cols = min(cols, ds_in.RasterXSize - layer_idx_x)
-            rows = min(rows, ds_in.RasterYSize - layer_idx_y)
+            cols = min(cols, layer_x_size - layer_idx_x)
+            rows = min(rows, layer_y_size - layer_idx_y)
 
             if cols <= 0 or rows <= 0:
                 self.MsgBar.pushMessage(
                     "No pixels to read within valid raster bounds", level=Qgis.MessageLevel.Info, duration=10
                 )
-                del ds_in
                 return
 
-            # ---- Build the boolean mask over the overlap sub-region ---- #
+            # ---- Build the mask over the overlap sub-region, evaluated by block windows ---- #
+            region = (layer_idx_x, layer_idx_y, cols, rows)
             if self.raster_mask_layer:
-                mask = self._build_raster_classes_mask(x_min, y_max, cols, rows, ps_x, ps_y, classes_selected)
+                mask = self._build_raster_classes_mask(x_min, y_max, region, ps_x, ps_y, classes_selected)
             else:
-                mask = self._build_vector_polygon_mask(
-                    ds_in, layer_gt, layer_idx_x, layer_idx_y, cols, rows, ps_x, ps_y
-                )
+                mask = self._build_vector_polygon_mask(layer_projection, layer_gt)
 
             if mask is None:
-                del ds_in
-                return
-            if not mask.any():
-                self.MsgBar.pushMessage(
-                    "No pixels of the layer to edit fall within the selected mask in the overlap area",
-                    level=Qgis.MessageLevel.Info,
-                    duration=10,
-                )
-                del ds_in
                 return
 
-            # Extract the corresponding region from the layer to edit and apply recodes
-            overlap_data = data_array[layer_idx_y : layer_idx_y + rows, layer_idx_x : layer_idx_x + cols]
-            for old_value, new_value in LayerToEdit.current.old_new_value.items():
-                change_mask = mask & (overlap_data == old_value)
-                new_data_array[layer_idx_y : layer_idx_y + rows, layer_idx_x : layer_idx_x + cols][change_mask] = (
-                    new_value
-                )
-
-            # Compute which pixels actually changed
-            row_indices, col_indices = np.nonzero(new_data_array != data_array)
-            edited_pixels_count = int(row_indices.size)
-
-            if edited_pixels_count == 0:
-                self.MsgBar.pushMessage(
-                    "No pixels were edited (the selected mask may not require changes in the target layer)",
-                    level=Qgis.MessageLevel.Info,
-                    duration=10,
-                )
-                del ds_in
-                return
-
-            if record_changes:
-                old_values = data_array[row_indices, col_indices]
-                new_values = new_data_array[row_indices, col_indices]
-
-            # Create temporary output file
-            fn, ext = os.path.splitext(layer_to_edit_path)
-            fn_out = fn + "_tmp" + ext
-            driver_name = ds_in.GetDriver().ShortName
-            driver = gdal.GetDriverByName(driver_name)
-            if driver is None:
-                raise RuntimeError(f"GDAL driver '{driver_name}' is not available")
-
-            (x, y) = new_data_array.shape
-            ds_out = None
-            create_copy_used = False
-            if driver.GetMetadataItem("DCAP_CREATECOPY") == "YES":
-                ds_out = driver.CreateCopy(fn_out, ds_in)
-                if ds_out is not None:
-                    create_copy_used = True
-
-            if ds_out is None:
-                ds_out = driver.Create(fn_out, y, x, num_bands, src_band.DataType)
-                if ds_out is None:
-                    raise RuntimeError(f"Failed to create output raster {fn_out}")
-
-            src_band_i = dst_band_i = None
-            for band_index in range(1, num_bands + 1):
-                src_band_i = ds_in.GetRasterBand(band_index)
-                dst_band_i = ds_out.GetRasterBand(band_index)
-                if band_index == LayerToEdit.current.band:
-                    dst_band_i.WriteArray(new_data_array)
-                elif not create_copy_used:
-                    dst_band_i.WriteArray(src_band_i.ReadAsArray())
-                copy_band_metadata(src_band_i, dst_band_i)
-            del src_band_i, dst_band_i
-
-            ds_out.SetGeoTransform(ds_in.GetGeoTransform())
-            ds_out.SetProjection(ds_in.GetProjection())
-            copy_dataset_metadata(ds_in, ds_out)
-
-            ds_out.FlushCache()
-            del ds_out, driver, src_band, ds_in
-            move(fn_out, layer_to_edit_path)
-
-            # Record the changes in ThRasE registry
-            if record_changes and edited_pixels_count:
-                xmin, _ymin, _xmax, ymax = LayerToEdit.current.bounds
-                group_id = uuid.uuid4()
-                for row_idx, col_idx, old_val, new_val in zip(
-                    row_indices, col_indices, old_values, new_values, strict=True
-                ):
-                    x_coord = xmin + (float(col_idx) + 0.5) * ps_x
-                    y_coord = ymax - (float(row_idx) + 0.5) * ps_y
-                    PixelLog(Pixel(x=x_coord, y=y_coord), int(old_val), int(new_val), group_id, store=True)
-
-            del new_data_array, data_array, mask
-            if old_values is not None:
-                del old_values, new_values
-            if row_indices is not None:
-                del row_indices, col_indices
-
+            # Apply the recodes restricted to the mask, in place when the driver supports it
+            layer_to_edit = LayerToEdit.current
+            layer_to_edit.run_global_edit(
+                "Applying changes within the selected mask",
+                lambda result, error: self.mask_edit_finished(layer_to_edit, mask, result, error, record_changes),
+                background,
+                memory_budget=LayerToEdit.memory_budget,
+                record=record_changes,
+                region=region,
+                mask_func=mask,
+                workers=LayerToEdit.workers,
+            )
         except Exception as e:
             self.MsgBar.pushMessage(f"ERROR: {e}", level=Qgis.MessageLevel.Critical, duration=20)
             return
 
-        if hasattr(LayerToEdit.current.qgs_layer, "setCacheImage"):
-            LayerToEdit.current.qgs_layer.setCacheImage(None)
-        LayerToEdit.current.qgs_layer.reload()
-        LayerToEdit.current.qgs_layer.triggerRepaint()
-
-        ThRasE.dialog.editing_status.setText(f"{edited_pixels_count} pixels edited!")
-        if record_changes and edited_pixels_count:
-            ThRasE.dialog.registry_widget.update_registry()
-
-        self.MsgBar.pushMessage(
-            "DONE: Changes were successfully applied within the selected mask",
-            level=Qgis.MessageLevel.Success,
-            duration=10,
-        )
-
         # finish the edition
         self.restore_mask_symbology()
         # remove any layer hidden from the QGIS legend (e.g. loaded via the
@@ -702,107 +596,111 @@ class ApplyFromClassesOrMask(QDialog, FORM_CLASS):
 
         self.accept()
 
-    def _build_raster_classes_mask(self, x_min, y_max, cols, rows, ps_x, ps_y, classes_selected):
-        """Return a boolean mask where selected classes in the raster mask are True."""
-        classes_ds = gdal.Open(get_source_from(self.raster_mask_layer), gdal.GA_ReadOnly)
+    @staticmethod
+    def mask_edit_finished(layer_to_edit, mask, result, error, record_changes):
+        """Report the result of the edit within the mask when it finishes"""
+        from ThRasE.thrase import ThRasE
+
+        status = layer_to_edit.global_edit_finished(result, error, record_changes)
+        if status is False:
+            return status
+
+        if status == 0 and mask.pixels_count == 0:
+            ThRasE.dialog.MsgBar.pushMessage(
+                "No pixels of the layer to edit fall within the selected mask in the overlap area",
+                level=Qgis.MessageLevel.Info,
+                duration=10,
+            )
+        elif status == 0:
+            ThRasE.dialog.MsgBar.pushMessage(
+                "No pixels were edited (the selected mask may not require changes in the target layer)",
+                level=Qgis.MessageLevel.Info,
+                duration=10,
+            )
+        else:
+            ThRasE.dialog.MsgBar.pushMessage(
+                "DONE: Changes in recode pixels table were successfully applied within the selected mask",
+                level=Qgis.MessageLevel.Success,
+                duration=10,
+            )
+        return status
+
+    def _build_raster_classes_mask(self, x_min, y_max, region, ps_x, ps_y, classes_selected):
+        """Return the mask, for block windows of the layer to edit inside the overlap region,
+        where selected classes in the raster mask are True."""
+        classes_path = get_source_from(self.raster_mask_layer)
+        classes_ds = gdal.Open(classes_path, gdal.GA_ReadOnly)
         if classes_ds is None:
             raise RuntimeError("Unable to open the raster mask file")
         try:
+            layer_idx_x, layer_idx_y, cols, rows = region
             classes_gt = classes_ds.GetGeoTransform()
             classes_idx_x = max(0, round((x_min - classes_gt[0]) / ps_x))
             classes_idx_y = max(0, round((classes_gt[3] - y_max) / ps_y))
             cols_c = min(cols, classes_ds.RasterXSize - classes_idx_x)
             rows_c = min(rows, classes_ds.RasterYSize - classes_idx_y)
-            if cols_c <= 0 or rows_c <= 0:
-                self.MsgBar.pushMessage(
-                    "No pixels to read within valid raster bounds", level=Qgis.MessageLevel.Info, duration=10
-                )
-                return None
-
-            raster_mask_band = int(self.QCBox_LayerForMaskingBand.currentText())
-            class_array = (
-                classes_ds.GetRasterBand(raster_mask_band)
-                .ReadAsArray(classes_idx_x, classes_idx_y, cols_c, rows_c)
-                .astype(int)
-            )
         finally:
             del classes_ds
+        if cols_c <= 0 or rows_c <= 0:
+            self.MsgBar.pushMessage(
+                "No pixels to read within valid raster bounds", level=Qgis.MessageLevel.Info, duration=10
+            )
+            return None
+
+        return RasterClassesMask(
+            classes_path,
+            int(self.QCBox_LayerForMaskingBand.currentText()),
+            classes_selected,
+            offset_x=classes_idx_x - layer_idx_x,
+            offset_y=classes_idx_y - layer_idx_y,
+            valid_region=(layer_idx_x, layer_idx_y, cols_c, rows_c),
+        )
 
-        mask = np.zeros((rows, cols), dtype=bool)
-        mask[: class_array.shape[0], : class_array.shape[1]] = np.isin(class_array, classes_selected)
-        return mask
-
-    def _build_vector_polygon_mask(self, ds_in, layer_gt, layer_idx_x, layer_idx_y, cols, rows, ps_x, ps_y):
-        """Rasterize the polygon vector mask over the layer-to-edit grid and return a boolean mask.
+    def _build_vector_polygon_mask(self, layer_projection, layer_gt):
+        """Return the mask that rasterizes the polygon vector mask over block windows of the
+        layer-to-edit grid.
 
         Supports both file-backed vector layers (via a path that OGR can open) and
-        QGIS memory/scratch layers (features are transferred into an OGR in-memory
-        datasource before rasterization).
+        QGIS memory/scratch layers (their polygons are transferred as WKB into an OGR
+        in-memory datasource before rasterization).
 
         Rasterization rule: GDAL's default (pixel-center rule). A pixel is included
         in the mask only when the polygon contains its center.
         """
-        # align the in-memory mask raster to the layer-to-edit grid at the overlap sub-region
-        overlap_x_min = layer_gt[0] + layer_idx_x * ps_x
-        overlap_y_max = layer_gt[3] - layer_idx_y * ps_y
-
-        mask_ds = gdal.GetDriverByName("MEM").Create("", cols, rows, 1, gdal.GDT_Byte)
-        mask_ds.SetGeoTransform((overlap_x_min, ps_x, 0, overlap_y_max, 0, -ps_y))
-        mask_ds.SetProjection(ds_in.GetProjection())
-
         vec_path, vec_layer_name = self._parse_vector_source(self.vector_mask_layer)
         is_file_backed = (
             self.vector_mask_layer.providerType() != "memory" and bool(vec_path) and os.path.isfile(vec_path)
         )
 
         if is_file_backed:
-            rasterize_kwargs = {"burnValues": [1], "allTouched": False}
-            if vec_layer_name:
-                rasterize_kwargs["layers"] = [vec_layer_name]
-            if gdal.Rasterize(mask_ds, vec_path, **rasterize_kwargs) is None:
-                raise RuntimeError(f'Unable to rasterize the vector mask "{vec_path}"')
+            mask = VectorPolygonMask(layer_gt, layer_projection, source=vec_path, layer_name=vec_layer_name)
         else:
             # non file-backed layers (memory, scratch, etc.) cannot be opened by
-            # OGR via a path; transfer their polygons into an OGR in-memory
-            # datasource and rasterize that instead
-            ogr_ds = self._qgs_layer_to_ogr_memory(self.vector_mask_layer)
-            ogr_layer = ogr_ds.GetLayer(0)
-            if ogr_layer is None or ogr_layer.GetFeatureCount() == 0:
-                raise RuntimeError("The selected vector mask has no polygon features")
-            if gdal.RasterizeLayer(mask_ds, [1], ogr_layer, burn_values=[1], options=["ALL_TOUCHED=FALSE"]) != 0:
-                raise RuntimeError("Unable to rasterize the in-memory vector mask")
-
-        return mask_ds.GetRasterBand(1).ReadAsArray().astype(bool)
+            # OGR via a path; pass their polygons to rasterize them instead
+            mask = VectorPolygonMask(
+                layer_gt,
+                layer_projection,
+                geometries=self._qgs_layer_polygons_wkb(self.vector_mask_layer),
+                srs_wkt=self.vector_mask_layer.crs().toWkt(),
+            )
+        # check the vector source before starting the edit
+        mask.open()
+        return mask
 
     @staticmethod
-    def _qgs_layer_to_ogr_memory(qgs_layer):
-        """Copy polygon features of a QGIS vector layer into an OGR in-memory datasource.
+    def _qgs_layer_polygons_wkb(qgs_layer):
+        """Return the polygons of a QGIS vector layer as WKB.
 
         Used for memory/scratch layers that cannot be opened directly by GDAL/OGR
         through their source string.
         """
-        srs = osr.SpatialReference()
-        srs.ImportFromWkt(qgs_layer.crs().toWkt())
-
-        mem_drv = ogr.GetDriverByName("Memory")
-        mem_ds = mem_drv.CreateDataSource("thrase_vector_mask")
-        mem_layer = mem_ds.CreateLayer("mask", srs, ogr.wkbMultiPolygon)
-        layer_defn = mem_layer.GetLayerDefn()
-
+        polygons_wkb = []
         for feature in qgs_layer.getFeatures():
             geom = feature.geometry()
             if geom is None or geom.isEmpty():
                 continue
             try:
-                wkb = bytes(geom.asWkb())
+                polygons_wkb.append(bytes(geom.asWkb()))
             except (RuntimeError, ValueError, TypeError):
                 continue
-            ogr_geom = ogr.CreateGeometryFromWkb(wkb)
-            if ogr_geom is None:
-                continue
-            ogr_feat = ogr.Feature(layer_defn)
-            ogr_feat.SetGeometry(ogr_geom)
-            mem_layer.CreateFeature(ogr_feat)
-            ogr_feat = None
-
-        return mem_ds
+        return polygons_wkb
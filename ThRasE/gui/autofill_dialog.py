@@ -326,5 +326,5 @@ class AutoFill(QDialog, FORM_CLASS):
         for idx_row, new_value in enumerate(rounded_values):
             LayerToEdit.current.pixels[idx_row]["new_value"] = new_value
 
-        ThRasE.dialog.set_recode_pixel_table()
+        # only the rows changed are refreshed in the recode table
         ThRasE.dialog.update_recode_pixel_table()
@@ -21,6 +21,7 @@
 import configparser
 import os
 import tempfile
+from collections import Counter
 from copy import deepcopy
 from datetime import datetime
 from html import escape
@@ -37,9 +38,10 @@ from qgis.core import (
     QgsRectangle,
 )
 from qgis.PyQt import uic
-from qgis.PyQt.QtCore import QEvent, Qt, QTimer, pyqtSignal, pyqtSlot
-from qgis.PyQt.QtGui import QColor, QFont, QIcon
+from qgis.PyQt.QtCore import QEvent, QModelIndex, Qt, QTimer, pyqtSignal, pyqtSlot
+from qgis.PyQt.QtGui import QColor
 from qgis.PyQt.QtWidgets import (
+    QAbstractItemView,
     QApplication,
     QCheckBox,
     QColorDialog,
@@ -50,18 +52,22 @@ from qgis.PyQt.QtWidgets import (
     QFileDialog,
     QFrame,
     QGridLayout,
+    QHeaderView,
+    QInputDialog,
     QLabel,
+    QMenu,
     QMessageBox,
-    QTableWidgetItem,
     QWidget,
 )
 from qgis.utils import iface
 
-from ThRasE.core.editing import LayerToEdit
+from ThRasE.core.editing import LayerToEdit, check_before_editing
+from ThRasE.core.registry_geopackage import RegistryGeoPackage
 from ThRasE.gui.about_dialog import AboutDialog
 from ThRasE.gui.apply_from_classes_or_mask import ApplyFromClassesOrMask
 from ThRasE.gui.autofill_dialog import AutoFill
 from ThRasE.gui.navigation_dialog import NavigationDialog
+from ThRasE.gui.recode_pixel_table import RecodePixelTableModel
 from ThRasE.gui.view_widget import ViewWidget, ViewWidgetMulti, ViewWidgetSingle
 from ThRasE.utils.kml_utils import write_google_earth_kml
 from ThRasE.utils.qgis_utils import (
@@ -78,6 +84,7 @@ from ThRasE.utils.qgis_utils import (
     unset_the_nodata_value,
     valid_file_selected_in,
 )
+from ThRasE.utils.raster_utils import set_band_histogram
 from ThRasE.utils.system_utils import (
     LegacyLoader,
     block_signals_to,
@@ -98,6 +105,20 @@ VERSION = cfg.get("general", "version")
 HOMEPAGE = cfg.get("general", "homepage")
 
 
+def classes_to_edit_text(pixels, pixel_counts):
+    """Return the text of the number of classes to edit and the total of pixels affected by
+    the recode, from the new values of the recode pixel table and the pixel count per class"""
+    values_to_edit = [pixel["value"] for pixel in pixels if pixel["new_value"] is not None]
+    number_classes_to_edit = len(values_to_edit)
+    number_pixels_to_edit = sum((pixel_counts or {}).get(value, 0) for value in values_to_edit)
+    return "({} {} to edit, {:,} {})".format(
+        number_classes_to_edit,
+        "class" if number_classes_to_edit == 1 else "classes",
+        number_pixels_to_edit,
+        "pixel" if number_pixels_to_edit == 1 else "pixels",
+    )
+
+
 class ThRasEDialog(QDialog, FORM_CLASS):
     closingPlugin = pyqtSignal()
     view_widgets: ClassVar[list] = []
@@ -231,10 +252,18 @@ class ThRasEDialog(QDialog, FORM_CLASS):
         )
         # open the layer style editor for the thematic layer
         self.QPBtn_LayerStyle.clicked.connect(self.open_layer_style_editor)
+        # recode pixel table, a view over the pixels of the layer to edit
+        self.recode_pixel_table_model = RecodePixelTableModel(self)
+        self.recodePixelTable.setModel(self.recode_pixel_table_model)
+        self.recodePixelTable.verticalHeader().setVisible(False)
+        self.recodePixelTable.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.recodePixelTable.verticalHeader().setResizeContentsPrecision(100)
+        self.recodePixelTable.horizontalHeader().setMinimumSectionSize(10)
+        self.recodePixelTable.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
         # update recode pixel table
-        self.recodePixelTable.itemChanged.connect(self.update_recode_pixel_table)
+        self.recode_pixel_table_model.pixelsEdited.connect(self.update_recode_pixel_table)
         # for change the class color
-        self.recodePixelTable.itemClicked.connect(self.table_item_clicked)
+        self.recodePixelTable.clicked.connect(self.table_item_clicked)
 
         # ######### setup layer and editing toolbars ######### #
         self.QPBtn_LayerToolbars.clicked.connect(ViewWidget.toggle_layer_toolbars)
@@ -250,6 +279,9 @@ class ThRasEDialog(QDialog, FORM_CLASS):
         self.QPBtn_ApplyToEntireThematicRaster.clicked.connect(self.apply_to_entire_thematic_raster)
         self.apply_from_classes_or_mask = ApplyFromClassesOrMask()
         self.QPBtn_ApplyFromClassesOrMask.clicked.connect(self.apply_from_classes_or_mask_dialog)
+        self.snapshots_menu = QMenu(self)
+        self.snapshots_menu.aboutToShow.connect(self.fill_snapshots_menu)
+        self.QPBtn_Snapshots.setMenu(self.snapshots_menu)
         self.SaveConfig.clicked.connect(self.save_thrase_config)
         self.SaveAsConfig.clicked.connect(self.file_dialog_save_thrase_config)
         self.update_save_buttons_state()
@@ -399,8 +431,9 @@ class ThRasEDialog(QDialog, FORM_CLASS):
     @wait_process
     def restore_config(self, yaml_file_path, yaml_config):
         # Restoration performs compatibility migrations below.  Keep the caller's
-        # parsed YAML untouched so it can safely be reused by callers/tests.
-        yaml_config = deepcopy(yaml_config)
+        # parsed YAML untouched so it can safely be reused by callers/tests. The registry is
+        # only read, and it can hold the pixel logs of old configs.
+        yaml_config = {key: value if key == "registry" else deepcopy(value) for key, value in yaml_config.items()}
 
         def get_restore_path(_path):
             """check if the file path exists or try using relative path to the yml file"""
@@ -441,8 +474,21 @@ class ThRasEDialog(QDialog, FORM_CLASS):
                 duration=-1,
             )
             return
+        # pixel counts saved in the session, used if the file was not modified since
+        if "pixel_counts" in yaml_config:
+            set_band_histogram(
+                get_source_from(thematic_layer),
+                yaml_config["thematic_file_to_edit"].get("band", 1),
+                yaml_config["pixel_counts"]["histogram"],
+                yaml_config["pixel_counts"]["file_signature"],
+            )
         nodata_action = yaml_config["thematic_file_to_edit"].get("nodata_action")
-        self.select_layer_to_edit(self.QCBox_LayerToEdit.currentLayer(), nodata_action=nodata_action)
+        # the journal is replayed with the pixel logs of the registry restored below
+        self.select_layer_to_edit(
+            self.QCBox_LayerToEdit.currentLayer(),
+            nodata_action=nodata_action,
+            recover_journal="registry" not in yaml_config,
+        )
         # band number
         if "band" in yaml_config["thematic_file_to_edit"]:
             self.QCBox_band_LayerToEdit.setCurrentIndex(yaml_config["thematic_file_to_edit"]["band"] - 1)
@@ -727,9 +773,35 @@ class ThRasEDialog(QDialog, FORM_CLASS):
         # restore registry widget and pixel logs
         if "registry" in yaml_config:
             reg_cfg = yaml_config["registry"]
+            # pixel logs kept in the GeoPackage sidecar of the thematic raster
+            sidecar = None
+            if reg_cfg.get("sidecar"):
+                sidecar = RegistryGeoPackage(
+                    RegistryGeoPackage.sidecar_path(LayerToEdit.current.file_path),
+                    LayerToEdit.current.grid,
+                    LayerToEdit.current.qgs_layer.crs().toWkt(),
+                )
+                if not os.path.isfile(sidecar.file_path):
+                    self.MsgBar.pushMessage(
+                        f'Could not find the registry GeoPackage: "{sidecar.file_path}"',
+                        level=Qgis.MessageLevel.Warning,
+                        duration=-1,
+                    )
+                    sidecar = None
+            # pixel logs saved as compressed NumPy columns, loaded when the registry is needed
+            pixel_logs_file = None
+            if not sidecar and reg_cfg.get("pixel_logs_encoding") == "npz":
+                pixel_logs_file = get_restore_path(reg_cfg.get("pixel_logs_file"))
+                if not pixel_logs_file or not os.path.isfile(pixel_logs_file):
+                    self.MsgBar.pushMessage(
+                        f'Could not find the pixel logs file of the registry: "{reg_cfg.get("pixel_logs_file")}"',
+                        level=Qgis.MessageLevel.Warning,
+                        duration=-1,
+                    )
+                    pixel_logs_file = None
             # decode pixel logs (supports compressed and legacy plain list)
             logs_list = []
-            pixel_logs_data = reg_cfg.get("pixel_logs")
+            pixel_logs_data = None if sidecar or pixel_logs_file else reg_cfg.get("pixel_logs")
             if isinstance(pixel_logs_data, str) and reg_cfg.get("pixel_logs_encoding") == "gzip+base64+json":
                 import base64
                 import gzip
@@ -745,25 +817,43 @@ class ThRasEDialog(QDialog, FORM_CLASS):
                 logs_list = pixel_logs_data
 
             # rebuild pixel_log_store
-            from ThRasE.core.editing import Pixel, PixelLog
-
-            LayerToEdit.current.pixel_log_store = {}
+            columns = sidecar.read_columns() if sidecar else ([], [], [], [], [], [])
+            grid = LayerToEdit.current.grid
             for item in logs_list:
                 try:
-                    pixel = Pixel(x=item["x"], y=item["y"])
-                    PixelLog(
-                        pixel,
-                        item["old_value"],
-                        item["new_value"],
-                        item.get("group_id"),
+                    col, row = grid.position(float(item["x"]), float(item["y"]))
+                    record = (
+                        row,
+                        col,
+                        int(item["old_value"]),
+                        int(item["new_value"]),
                         datetime.fromisoformat(item.get("edit_date")),
-                        store=True,
+                        item.get("group_id"),
                     )
                 except (KeyError, TypeError, ValueError, OverflowError):
                     continue
-            self.registry_widget.total_pixels_modified = reg_cfg.get(
-                "pixel_logs_count", len(LayerToEdit.current.pixel_log_store)
-            )
+                for column, value in zip(columns, record, strict=True):
+                    column.append(value)
+            if pixel_logs_file:
+                LayerToEdit.current.pixel_log_store.load(
+                    pixel_logs_file, lazy=True, count=int(reg_cfg.get("pixel_logs_count", 0))
+                )
+            else:
+                LayerToEdit.current.pixel_log_store.restore(*columns)
+            pixel_logs_count = reg_cfg.get("pixel_logs_count", len(LayerToEdit.current.pixel_log_store))
+            # edits after the last save of the config, recovered from the journal of the layer
+            if LayerToEdit.current.journal.has_entries():
+                recovered = LayerToEdit.current.replay_journal()
+                if recovered and sidecar:
+                    sidecar.sync(LayerToEdit.current.pixel_log_store)
+                if recovered:
+                    pixel_logs_count = len(LayerToEdit.current.pixel_log_store)
+                    self.MsgBar.pushMessage(
+                        f"{recovered} edit groups not saved in the config file were recovered into the registry",
+                        level=Qgis.MessageLevel.Info,
+                        duration=10,
+                    )
+            self.registry_widget.total_pixels_modified = pixel_logs_count
 
             # registry visual settings
             if reg_cfg.get("tiles_color"):
@@ -771,21 +861,28 @@ class ThRasEDialog(QDialog, FORM_CLASS):
             self.registry_widget.autoCenter.setChecked(bool(reg_cfg.get("auto_center", False)))
             self.registry_widget.showAll.setChecked(bool(reg_cfg.get("show_all", False)))
 
-            # ensure registry groups are built
-            LayerToEdit.current.registry.update()
+            # ensure registry groups are built, deferred until the registry is shown or the next
+            # edit for the pixel logs not loaded yet
+            opened = bool(reg_cfg.get("opened", False))
+            if opened or not LayerToEdit.current.pixel_log_store.pending_file:
+                LayerToEdit.current.registry.update()
+            # the sidecar is already in sync with the pixel logs restored
+            LayerToEdit.current.registry.sidecar = sidecar
+            with block_signals_to(self.registry_widget.PersistRegistry):
+                self.registry_widget.PersistRegistry.setChecked(sidecar is not None)
 
             # enable/disable registry
             LayerToEdit.current.registry.enabled = bool(reg_cfg.get("enabled", True))
             self.registry_widget.EnableRegistry.setChecked(LayerToEdit.current.registry.enabled)
 
             # ui configuration
-            opened = bool(reg_cfg.get("opened", False))
             with block_signals_to(self.registry_widget):
                 self.registry_widget.setVisible(opened)
             with block_signals_to(self.QPBtn_Registry):
                 self.QPBtn_Registry.setChecked(opened)
             total_groups = len(LayerToEdit.current.registry.groups)
             slider_pos = int(reg_cfg.get("slider_position", total_groups or 0))
+            self.registry_widget.last_slider_position = max(1, slider_pos)
             if total_groups:
                 slider_pos = max(1, min(slider_pos, total_groups))
                 with block_signals_to(self.registry_widget.PixelLogGroups_Slider):
@@ -1057,10 +1154,9 @@ class ThRasEDialog(QDialog, FORM_CLASS):
         if self.registry_widget.isVisible():
             self.registry_widget.setDisabled(True)
 
-    def select_layer_to_edit(self, layer_selected, nodata_action=None):
+    def select_layer_to_edit(self, layer_selected, nodata_action=None, recover_journal=True):
         # first clear table
-        self.recodePixelTable.setRowCount(0)
-        self.recodePixelTable.setColumnCount(0)
+        self.recode_pixel_table_model.set_pixels(None)
 
         # first check
         if layer_selected is None:
@@ -1103,10 +1199,10 @@ class ThRasEDialog(QDialog, FORM_CLASS):
             self.QCBox_band_LayerToEdit.clear()
             self.QCBox_band_LayerToEdit.addItems([str(x) for x in range(1, layer_selected.bandCount() + 1)])
 
-        self.setup_layer_to_edit(nodata_action=nodata_action)
+        self.setup_layer_to_edit(nodata_action=nodata_action, recover_journal=recover_journal)
 
     @error_handler
-    def setup_layer_to_edit(self, nodata_action=None):
+    def setup_layer_to_edit(self, nodata_action=None, recover_journal=True):
         layer = self.QCBox_LayerToEdit.currentLayer()
         band = int(self.QCBox_band_LayerToEdit.currentText())
         nodata = get_nodata_value(layer, band)
@@ -1197,6 +1293,27 @@ class ThRasEDialog(QDialog, FORM_CLASS):
                 with block_signals_to(self.QCBox_band_LayerToEdit):
                     self.QCBox_band_LayerToEdit.clear()
                 return
+            # edits logged in the registry of a previous session not saved, e.g. after a crash
+            if recover_journal and layer_to_edit.journal.has_entries():
+                reply = QMessageBox.question(
+                    None,
+                    "ThRasE - Recover the registry",
+                    f"The registry of '{layer.name()}' has edits of a previous session that were not saved "
+                    "in a config file, the pixels of the layer already have them.\n\n"
+                    "Do you want to recover these edits into the registry?",
+                    QMessageBox.StandardButton.Yes,
+                    QMessageBox.StandardButton.No,
+                )
+                if reply == QMessageBox.StandardButton.Yes:
+                    recovered = layer_to_edit.replay_journal()
+                    self.MsgBar.pushMessage(
+                        f"{recovered} edit groups were recovered into the registry",
+                        level=Qgis.MessageLevel.Info,
+                        duration=10,
+                    )
+                else:
+                    layer_to_edit.journal.compact()
+                    layer_to_edit.report_journal_error()
 
         # remember the nodata action for this layer (avoids re-asking on reload)
         if nodata is not None:
@@ -1229,33 +1346,28 @@ class ThRasEDialog(QDialog, FORM_CLASS):
     @pyqtSlot()
     @error_handler
     def update_recode_pixel_table(self):
+        """Apply the new values and the visibility of the pixels in the recode table to the
+        layer to edit, refreshing only the rows that changed"""
         layer_to_edit = LayerToEdit.current
-        layer_to_edit.old_new_value = {}
         if not layer_to_edit or layer_to_edit.pixels is None:
             return
 
-        for row_idx, pixel in enumerate(layer_to_edit.pixels):
-            # assign the new value
-            new_value = self.recodePixelTable.item(row_idx, 3).text()
-            try:
-                if new_value == "":
-                    pixel["new_value"] = None
-                elif float(new_value) == int(new_value) and int(new_value) != pixel["value"]:
-                    pixel["new_value"] = int(new_value)
-                    layer_to_edit.old_new_value[pixel["value"]] = pixel["new_value"]
-            except (ValueError, OverflowError, TypeError):
-                pass
-            # assign the on state
-            on = self.recodePixelTable.item(row_idx, 1)
-            if on.checkState() == 2:
-                pixel["s/h"] = True
-            if on.checkState() == 0:
-                pixel["s/h"] = False
+        previous_old_new_value = layer_to_edit.old_new_value
+        layer_to_edit.old_new_value = {
+            pixel["value"]: pixel["new_value"]
+            for pixel in layer_to_edit.pixels
+            if pixel["new_value"] is not None and pixel["new_value"] != pixel["value"]
+        }
 
         # update pixel class visibility
-        pixel_class_visibility = [
-            255 if self.recodePixelTable.item(row_idx, 1).checkState() == 2 else 0
-            for row_idx in range(len(layer_to_edit.pixels))
+        pixel_class_visibility = [255 if pixel["s/h"] else 0 for pixel in layer_to_edit.pixels]
+        changed_rows = [
+            row_idx
+            for row_idx, (pixel, row, pcv) in enumerate(
+                zip(layer_to_edit.pixels, layer_to_edit.symbology, pixel_class_visibility, strict=True)
+            )
+            if row[2][3] != pcv
+            or previous_old_new_value.get(pixel["value"]) != layer_to_edit.old_new_value.get(pixel["value"])
         ]
         layer_to_edit.symbology = [
             (row[0], row[1], (row[2][0], row[2][1], row[2][2], pcv))
@@ -1263,152 +1375,85 @@ class ThRasEDialog(QDialog, FORM_CLASS):
         ]
         apply_symbology(layer_to_edit.qgs_layer, layer_to_edit.band, layer_to_edit.symbology)
 
-        # update table
-        self.set_recode_pixel_table()
+        # update the rows of the table changed from outside the table (autofill, restore)
+        self.recode_pixel_table_model.refresh_rows(changed_rows)
 
-        # update classes to edit label
-        number_classes_to_edit = sum(
-            1 if self.recodePixelTable.item(idx, 3).text() != "" else 0 for idx in range(len(layer_to_edit.pixels))
+        # update classes to edit label, with the total of pixels affected by the recode
+        self.QLbl_NumberClassesToEdit.setText(
+            classes_to_edit_text(layer_to_edit.pixels, self.recode_pixel_table_model.pixel_counts)
         )
+
+    @error_handler
+    def update_pixel_counts(self):
+        """Update the pixel count of the classes in the recode table from the live histogram of
+        the layer to edit, without rebuilding the table"""
+        layer_to_edit = LayerToEdit.current
+        if not layer_to_edit or layer_to_edit.pixels is None or not self.recode_pixel_table_model.pixels:
+            return
+        if layer_to_edit.histogram is None:
+            return
+
+        self.recode_pixel_table_model.set_pixel_counts(layer_to_edit.histogram)
         self.QLbl_NumberClassesToEdit.setText(
-            "({} {} to edit)".format(number_classes_to_edit, "class" if number_classes_to_edit == 1 else "classes")
+            classes_to_edit_text(layer_to_edit.pixels, self.recode_pixel_table_model.pixel_counts)
         )
 
     @error_handler
     def set_recode_pixel_table(self):
+        """Set the classes of the layer to edit in the recode pixel table"""
         layer_to_edit = LayerToEdit.current
 
         if not layer_to_edit or layer_to_edit.pixels is None:
             # clear table
-            self.recodePixelTable.clear()
+            self.recode_pixel_table_model.set_pixels(None)
             return
 
-        with block_signals_to(self.recodePixelTable):
-            header = ["", "", "Pixel Value", "New Value", ""]
-            row_length = len(layer_to_edit.pixels)
-            # init table
-            self.recodePixelTable.setRowCount(row_length)
-            self.recodePixelTable.setColumnCount(5)
-            self.recodePixelTable.horizontalHeader().setMinimumSectionSize(45)
-            # hidden row labels
-            self.recodePixelTable.verticalHeader().setVisible(False)
-            # add Header
-            self.recodePixelTable.setHorizontalHeaderLabels(header)
-            # insert items
-            for col_idx, _ in enumerate(header):
-                if col_idx == 0:  # color class
-                    for row_idx, pixel in enumerate(layer_to_edit.pixels):
-                        item_table = QTableWidgetItem()
-                        item_table.setFlags(item_table.flags() & ~Qt.ItemFlag.ItemIsSelectable)
-                        item_table.setToolTip(
-                            "Class color, click to edit.\n"
-                            "INFO: editing the color is only temporary and does not affect the layer"
-                        )
-                        item_table.setBackground(
-                            QColor(pixel["color"]["R"], pixel["color"]["G"], pixel["color"]["B"], pixel["color"]["A"])
-                        )
-                        self.recodePixelTable.setItem(row_idx, col_idx, item_table)
-                if col_idx == 1:  # Show/Hide
-                    for row_idx, pixel in enumerate(layer_to_edit.pixels):
-                        item_table = QTableWidgetItem()
-                        item_table.setFlags(item_table.flags() | Qt.ItemFlag.ItemIsUserCheckable)
-                        item_table.setFlags(item_table.flags() | Qt.ItemFlag.ItemIsEnabled)
-                        item_table.setFlags(item_table.flags() & ~Qt.ItemFlag.ItemIsSelectable)
-                        item_table.setTextAlignment(Qt.AlignmentFlag.AlignCenter | Qt.AlignmentFlag.AlignVCenter)
-                        item_table.setToolTip(
-                            "Show/Hide the pixel class value.\n"
-                            "INFO: It is only temporary and does not affect the layer.\n"
-                            "WARNING: If the class is hidden it does not avoid being edited!"
-                        )
-                        if pixel["s/h"]:
-                            item_table.setCheckState(Qt.CheckState.Checked)
-                        else:
-                            item_table.setCheckState(Qt.CheckState.Unchecked)
-                        self.recodePixelTable.setItem(row_idx, col_idx, item_table)
-                if col_idx == 2:  # Pixel Value
-                    for row_idx, pixel in enumerate(layer_to_edit.pixels):
-                        label = pixel.get("label", "")
-                        if label and label != str(pixel["value"]):
-                            cell_text = "{} ({})".format(label, pixel["value"])
-                            item_table = QTableWidgetItem(cell_text)
-                            item_table.setToolTip(f"Label: {label}\nPixel value: {pixel['value']}")
-                        else:
-                            item_table = QTableWidgetItem(str(pixel["value"]))
-                            item_table.setToolTip(f"Pixel value: {pixel['value']}")
-                        item_table.setFlags(item_table.flags() & ~Qt.ItemFlag.ItemIsSelectable)
-                        item_table.setFlags(item_table.flags() & ~Qt.ItemFlag.ItemIsEditable)
-                        item_table.setTextAlignment(Qt.AlignmentFlag.AlignCenter | Qt.AlignmentFlag.AlignVCenter)
-                        if pixel["new_value"] is not None and pixel["new_value"] != pixel["value"]:
-                            font = QFont()
-                            font.setBold(True)
-                            item_table.setFont(font)
-                        self.recodePixelTable.setItem(row_idx, col_idx, item_table)
-                if col_idx == 3:  # New Value
-                    for row_idx, pixel in enumerate(layer_to_edit.pixels):
-                        item_table = QTableWidgetItem(str(pixel["new_value"]) if pixel["new_value"] is not None else "")
-                        item_table.setFlags(item_table.flags() | Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsEditable)
-                        item_table.setFlags(item_table.flags() & ~Qt.ItemFlag.ItemIsSelectable)
-                        item_table.setTextAlignment(Qt.AlignmentFlag.AlignCenter | Qt.AlignmentFlag.AlignVCenter)
-                        item_table.setToolTip(
-                            "Set the new pixel value for this class.\n"
-                            "WARNING: After each editing operation, the layer is saved on disk!"
-                        )
-                        if pixel["new_value"] is not None and pixel["new_value"] != pixel["value"]:
-                            font = QFont()
-                            font.setBold(True)
-                            item_table.setFont(font)
-                        self.recodePixelTable.setItem(row_idx, col_idx, item_table)
-                if col_idx == 4:  # clear new value
-                    for row_idx, _ in enumerate(layer_to_edit.pixels):
-                        item_table = QTableWidgetItem()
-                        path = ":/plugins/thrase/icons/clear.svg"
-                        icon = QIcon(path)
-                        item_table.setIcon(icon)
-                        item_table.setFlags(item_table.flags() & ~Qt.ItemFlag.ItemIsSelectable)
-                        item_table.setTextAlignment(Qt.AlignmentFlag.AlignCenter | Qt.AlignmentFlag.AlignVCenter)
-                        item_table.setToolTip("Clear this row")
-                        self.recodePixelTable.setItem(row_idx, col_idx, item_table)
-
-            # adjust size of Table
-            self.recodePixelTable.horizontalHeader().setMinimumSectionSize(10)
-            self.recodePixelTable.resizeColumnsToContents()
-            self.recodePixelTable.resizeRowsToContents()
-            self.recodePixelTable.setColumnWidth(0, 45)
-            # cap "Pixel Value" column (col 2) to ~15 characters wide
-            self.recodePixelTable.setColumnWidth(2, min(self.recodePixelTable.columnWidth(2), 180))
-            # adjust the editor block based on table content
-            table_width = self.recodePixelTable.horizontalHeader().length() + 40
-            self.EditSettingsBlock.setMaximumWidth(table_width)
-            self.EditSettingsBlock.setMinimumWidth(table_width)
-
-    @pyqtSlot(QTableWidgetItem)
-    def table_item_clicked(self, table_item):
-        if table_item.text() == "none":
-            return
+        # pixel count per class, from the histogram cached per file and band, otherwise it is
+        # read in background and the counts are shown when it finishes
+        self.recode_pixel_table_model.set_pixels(
+            layer_to_edit.pixels, layer_to_edit.load_pixel_counts(self.update_pixel_counts)
+        )
+
+        # adjust size of Table, the contents are measured only over the first rows
+        self.recodePixelTable.verticalHeader().setDefaultSectionSize(self.recodePixelTable.fontMetrics().height() + 8)
+        self.recodePixelTable.resizeColumnsToContents()
+        self.recodePixelTable.setColumnWidth(0, 45)
+        # cap "Pixel Value" column (col 2) to ~15 characters wide
+        self.recodePixelTable.setColumnWidth(2, min(self.recodePixelTable.columnWidth(2), 180))
+        # adjust the editor block based on table content
+        table_width = self.recodePixelTable.horizontalHeader().length() + 40
+        self.EditSettingsBlock.setMaximumWidth(table_width)
+        self.EditSettingsBlock.setMinimumWidth(table_width)
+        # value -> row index for the mouse pointer highlighting
+        layer_to_edit.index_pixel_rows()
+
+    @pyqtSlot(QModelIndex)
+    def table_item_clicked(self, index):
+        row_idx = index.row()
         # set color
-        if table_item.column() == 0:
-            remember_color = table_item.background().color()
+        if index.column() == 0:
+            pixel_color = LayerToEdit.current.pixels[row_idx]["color"]
+            remember_color = QColor(pixel_color["R"], pixel_color["G"], pixel_color["B"], pixel_color["A"])
             color = QColorDialog.getColor(remember_color, self)
             if color.isValid():
-                # update recode table
-                with block_signals_to(self.recodePixelTable):
-                    self.recodePixelTable.item(table_item.row(), 0).setBackground(color)
                 # update pixels variable
-                LayerToEdit.current.pixels[table_item.row()]["color"] = {
+                LayerToEdit.current.pixels[row_idx]["color"] = {
                     "R": color.red(),
                     "G": color.green(),
                     "B": color.blue(),
                     "A": color.alpha(),
                 }
                 # apply to layer
-                LayerToEdit.current.symbology[table_item.row()] = (
-                    *LayerToEdit.current.symbology[table_item.row()][0:2],
+                LayerToEdit.current.symbology[row_idx] = (
+                    *LayerToEdit.current.symbology[row_idx][0:2],
                     (color.red(), color.green(), color.blue(), color.alpha()),
                 )
+                # update recode table
+                self.recode_pixel_table_model.refresh_rows([row_idx])
                 self.update_recode_pixel_table()
         # clear the current new value for the row clicked
-        elif table_item.column() == 4:
-            self.recodePixelTable.item(table_item.row(), 3).setText("")
+        elif index.column() == 4:
+            self.recode_pixel_table_model.setData(self.recode_pixel_table_model.index(row_idx, 3), "")
 
     @pyqtSlot()
     @error_handler
@@ -1418,9 +1463,7 @@ class ThRasEDialog(QDialog, FORM_CLASS):
         recode_pixel_table_status = LayerToEdit.current.setup_pixel_table(force_update=True)
 
         if recode_pixel_table_status is False:  # wrong style for set the recode pixel table
-            self.recodePixelTable.clear()
-            self.recodePixelTable.setRowCount(0)
-            self.recodePixelTable.setColumnCount(0)
+            self.recode_pixel_table_model.set_pixels(None)
             # disable some components
             self.NavigationBlockWidget.setEnabled(False)
             [view_widget.widget_EditingToolbar.setEnabled(False) for view_widget in ThRasEDialog.view_widgets]
@@ -1477,10 +1520,13 @@ class ThRasEDialog(QDialog, FORM_CLASS):
 
     @pyqtSlot()
     def apply_to_entire_thematic_raster(self):
+        if not check_before_editing():
+            return
         # first prompt
         quit_msg = (
             "This action applies the changes defined in the pixel recoding table to the entire thematic raster. "
-            "This operation cannot be undone.\n\n"
+            "When the file can be updated in place (e.g. GeoTIFF), the edit can be undone with the Undo button "
+            "shown in the message bar when it finishes.\n\n"
             f'Target file: "{LayerToEdit.current.file_path}"\n'
         )
 
@@ -1510,39 +1556,129 @@ class ThRasEDialog(QDialog, FORM_CLASS):
         record_in_registry = record_checkbox.isChecked() and registry_enabled
 
         if reply == QMessageBox.StandardButton.Apply:
-            status = LayerToEdit.current.edit_to_entire_thematic_raster(record_in_registry=record_in_registry)
-            if status is not False and status > 0:
-                self.MsgBar.pushMessage(
-                    "DONE: Changes in the recoded pixels table were successfully applied"
-                    " to the entire thematic raster.",
-                    level=Qgis.MessageLevel.Success,
-                    duration=10,
-                )
-            elif status is not False and status == 0:
-                self.MsgBar.pushMessage(
-                    "No changes were applied: no pixels matched the recode criteria. Please check the recode table.",
-                    level=Qgis.MessageLevel.Info,
-                    duration=10,
-                )
+            # run in background, with progress and cancel button in the message bar
+            LayerToEdit.current.edit_to_entire_thematic_raster(
+                record_in_registry=record_in_registry,
+                background=True,
+                on_finished=self.entire_thematic_raster_edited,
+            )
 
-    @pyqtSlot()
-    def apply_from_classes_or_mask_dialog(self):
-        # check if the recode pixel table is empty
-        if not LayerToEdit.current.old_new_value:
+    def entire_thematic_raster_edited(self, status):
+        if status is not False and status > 0:
             self.MsgBar.pushMessage(
-                "There are no changes to apply in the recode pixel table. Please set new pixel values first",
-                level=Qgis.MessageLevel.Warning,
+                "DONE: Changes in the recoded pixels table were successfully applied to the entire thematic raster.",
+                level=Qgis.MessageLevel.Success,
+                duration=10,
+            )
+        elif status is not False and status == 0:
+            self.MsgBar.pushMessage(
+                "No changes were applied: no pixels matched the recode criteria. Please check the recode table.",
+                level=Qgis.MessageLevel.Info,
                 duration=10,
             )
+
+    @pyqtSlot()
+    def apply_from_classes_or_mask_dialog(self):
+        # check if the recode pixel table is empty or its new values are not valid
+        if not check_before_editing():
             return
 
         self.apply_from_classes_or_mask.setup_gui()
-        if self.apply_from_classes_or_mask.exec():
+        # the edit runs in background after the dialog is accepted, it reports when it finishes
+        self.apply_from_classes_or_mask.exec()
+
+    @pyqtSlot()
+    def fill_snapshots_menu(self):
+        self.snapshots_menu.clear()
+        layer_to_edit = LayerToEdit.current
+        if not layer_to_edit:
+            return
+        # the snapshots are blocked while a global edit is writing the file
+        enabled = layer_to_edit.global_edit_task is None
+
+        action = self.snapshots_menu.addAction("Take a snapshot")
+        action.setEnabled(enabled)
+        action.triggered.connect(self.take_snapshot)
+        if not layer_to_edit.snapshots.snapshots:
+            return
+        self.snapshots_menu.addSeparator()
+        for snapshot in reversed(layer_to_edit.snapshots.snapshots):
+            snapshot_menu = self.snapshots_menu.addMenu(
+                "{} ({})".format(snapshot.name, snapshot.date.strftime("%d %b %Y, %H:%M:%S"))
+            )
+            snapshot_menu.setEnabled(enabled)
+            action = snapshot_menu.addAction("Restore")
+            action.triggered.connect(lambda checked, snapshot=snapshot: self.restore_snapshot(snapshot))
+            action = snapshot_menu.addAction("Compare with the current state")
+            action.triggered.connect(lambda checked, snapshot=snapshot: self.compare_snapshot(snapshot))
+            action = snapshot_menu.addAction("Delete")
+            action.triggered.connect(lambda checked, snapshot=snapshot: self.delete_snapshot(snapshot))
+        self.snapshots_menu.addSeparator()
+        action = self.snapshots_menu.addAction(f"Size on disk: {layer_to_edit.snapshots.total_size() / 1024**2:.1f} MB")
+        action.setEnabled(False)
+
+    @pyqtSlot()
+    def take_snapshot(self):
+        name, ok = QInputDialog.getText(
+            self, "Take a snapshot", "Name of the snapshot (optional, the date by default):"
+        )
+        if not ok:
+            return
+        snapshot = LayerToEdit.current.snapshots.take(name.strip() or None)
+        self.MsgBar.pushMessage(
+            f'Snapshot "{snapshot.name}" taken, the blocks of the thematic raster are saved when they are edited',
+            level=Qgis.MessageLevel.Success,
+            duration=5,
+        )
+
+    def restore_snapshot(self, snapshot):
+        reply = QMessageBox.question(
+            self,
+            "Restore snapshot",
+            f'Restore the thematic raster to the snapshot "{snapshot.name}"?\n\n'
+            f'The current state is saved first in a new snapshot "Before restoring {snapshot.name}", '
+            "restore it to revert this.",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            QMessageBox.StandardButton.No,
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+        pixels_restored = LayerToEdit.current.restore_snapshot(snapshot)
+        self.MsgBar.pushMessage(
+            f'Snapshot "{snapshot.name}" restored: {pixels_restored} pixels changed',
+            level=Qgis.MessageLevel.Success if pixels_restored else Qgis.MessageLevel.Info,
+            duration=10,
+        )
+
+    def compare_snapshot(self, snapshot):
+        layer_to_edit = LayerToEdit.current
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            _, _, old_values, new_values = layer_to_edit.snapshots.diff(snapshot, layer_to_edit.read_window)
+        finally:
+            QApplication.restoreOverrideCursor()
+        if not len(old_values):
             self.MsgBar.pushMessage(
-                "DONE: Changes in recode pixels table were successfully applied within the selected mask",
-                level=Qgis.MessageLevel.Success,
+                f'The thematic raster has no changes since the snapshot "{snapshot.name}"',
+                level=Qgis.MessageLevel.Info,
                 duration=10,
             )
+            return
+        value_changes = Counter(zip(old_values.tolist(), new_values.tolist(), strict=True))
+        summary = ", ".join(
+            f"{old_value}→{new_value}: {count}" for (old_value, new_value), count in value_changes.most_common(10)
+        )
+        if len(value_changes) > 10:
+            summary += ", ..."
+        self.MsgBar.pushMessage(
+            f'{len(old_values)} pixels changed since the snapshot "{snapshot.name}" ({summary})',
+            level=Qgis.MessageLevel.Info,
+            duration=20,
+        )
+
+    def delete_snapshot(self, snapshot):
+        LayerToEdit.current.snapshots.remove(snapshot)
+        self.MsgBar.pushMessage(f'Snapshot "{snapshot.name}" deleted', level=Qgis.MessageLevel.Info, duration=5)
 
     @pyqtSlot()
     def save_thrase_config(self):
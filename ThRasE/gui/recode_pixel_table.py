@@ -0,0 +1,188 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from qgis.PyQt.QtCore import QAbstractTableModel, QModelIndex, Qt, pyqtSignal
+from qgis.PyQt.QtGui import QColor, QFont, QIcon
+
+COLOR, SHOW_HIDE, PIXEL_VALUE, NEW_VALUE, CLEAR, PIXELS = range(6)
+HEADER = ["", "", "Pixel Value", "New Value", "", "Pixels"]
+
+TOOLTIPS = {
+    COLOR: "Class color, click to edit.\nINFO: editing the color is only temporary and does not affect the layer",
+    SHOW_HIDE: "Show/Hide the pixel class value.\n"
+    "INFO: It is only temporary and does not affect the layer.\n"
+    "WARNING: If the class is hidden it does not avoid being edited!",
+    NEW_VALUE: "Set the new pixel value for this class.\n"
+    "WARNING: After each editing operation, the layer is saved on disk!",
+    CLEAR: "Clear this row",
+    PIXELS: "Number of pixels of this class in the thematic raster",
+}
+
+
+def parse_new_value(text, value):
+    """Return the new value typed for a class: None for an empty cell or the same value,
+    raise ValueError if it is not an integer"""
+    text = str(text).strip()
+    if text == "":
+        return None
+    if float(text) != int(float(text)):
+        raise ValueError("the new value must be an integer")
+    new_value = int(float(text))
+    return None if new_value == value else new_value
+
+
+class RecodePixelTableModel(QAbstractTableModel):
+    """Model of the recode pixel table over the pixels list of the layer to edit. The view only
+    requests the visible rows, and the changes are notified only for the rows affected"""
+
+    # emitted when the user edits the new value or the visibility of the classes
+    pixelsEdited = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pixels = []
+        self.pixel_counts = {}
+        self.highlighted_row = None
+        self.clear_icon = QIcon(":/plugins/thrase/icons/clear.svg")
+        self.bold_font = QFont()
+        self.bold_font.setBold(True)
+
+    def set_pixels(self, pixels, pixel_counts=None):
+        """Reset the model, only when the classes of the table change"""
+        self.beginResetModel()
+        self.pixels = pixels or []
+        # copy, the live histogram of the layer is updated in place by the edits. None while
+        # the counts are being read
+        self.pixel_counts = None if pixel_counts is None else dict(pixel_counts)
+        self.highlighted_row = None
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):  # noqa: B008
+        return 0 if parent.isValid() else len(self.pixels)
+
+    def columnCount(self, parent=QModelIndex()):  # noqa: B008
+        return 0 if parent.isValid() or not self.pixels else len(HEADER)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return HEADER[section]
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        if index.column() == SHOW_HIDE:
+            return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsUserCheckable
+        if index.column() == NEW_VALUE:
+            return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsEditable
+        return Qt.ItemFlag.ItemIsEnabled
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        pixel = self.pixels[index.row()]
+        column = index.column()
+        is_edited = pixel["new_value"] is not None and pixel["new_value"] != pixel["value"]
+
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            if column == PIXEL_VALUE:
+                label = pixel.get("label", "")
+                if label and label != str(pixel["value"]):
+                    return "{} ({})".format(label, pixel["value"])
+                return str(pixel["value"])
+            if column == NEW_VALUE:
+                return str(pixel["new_value"]) if pixel["new_value"] is not None else ""
+            if column == PIXELS:
+                if self.pixel_counts is None:
+                    return ""
+                return "{:,}".format(self.pixel_counts.get(pixel["value"], 0))
+        elif role == Qt.ItemDataRole.BackgroundRole:
+            if column == COLOR:
+                return QColor(pixel["color"]["R"], pixel["color"]["G"], pixel["color"]["B"], pixel["color"]["A"])
+            if column == PIXEL_VALUE and index.row() == self.highlighted_row:
+                return QColor(Qt.GlobalColor.yellow)
+        elif role == Qt.ItemDataRole.CheckStateRole and column == SHOW_HIDE:
+            return Qt.CheckState.Checked if pixel["s/h"] else Qt.CheckState.Unchecked
+        elif role == Qt.ItemDataRole.DecorationRole and column == CLEAR:
+            return self.clear_icon
+        elif role == Qt.ItemDataRole.FontRole and column in (PIXEL_VALUE, NEW_VALUE) and is_edited:
+            return self.bold_font
+        elif role == Qt.ItemDataRole.TextAlignmentRole:
+            if column == PIXELS:
+                return int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+            return int(Qt.AlignmentFlag.AlignCenter | Qt.AlignmentFlag.AlignVCenter)
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            if column == PIXEL_VALUE:
+                label = pixel.get("label", "")
+                if label and label != str(pixel["value"]):
+                    return f"Label: {label}\nPixel value: {pixel['value']}"
+                return f"Pixel value: {pixel['value']}"
+            return TOOLTIPS.get(column)
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid():
+            return False
+        pixel = self.pixels[index.row()]
+
+        if index.column() == NEW_VALUE and role == Qt.ItemDataRole.EditRole:
+            try:
+                new_value = parse_new_value(value, pixel["value"])
+            except (ValueError, OverflowError, TypeError):
+                return False
+            if new_value == pixel["new_value"]:
+                return False
+            pixel["new_value"] = new_value
+        elif index.column() == SHOW_HIDE and role == Qt.ItemDataRole.CheckStateRole:
+            pixel["s/h"] = Qt.CheckState(value) == Qt.CheckState.Checked
+        else:
+            return False
+
+        self.refresh_rows([index.row()])
+        self.pixelsEdited.emit()
+        return True
+
+    def refresh_rows(self, rows, first_column=COLOR, last_column=PIXELS):
+        """Notify the view that the given rows changed, grouped in contiguous ranges"""
+        rows = sorted(row for row in set(rows) if row is not None and 0 <= row < len(self.pixels))
+        start = 0
+        for idx in range(1, len(rows) + 1):
+            if idx == len(rows) or rows[idx] != rows[idx - 1] + 1:
+                self.dataChanged.emit(self.index(rows[start], first_column), self.index(rows[idx - 1], last_column))
+                start = idx
+
+    def set_pixel_counts(self, pixel_counts):
+        """Update the pixel counts, refreshing only the rows whose count changed. The counts
+        are copied, so the next update is compared with the counts shown"""
+        changed_rows = [
+            row_idx
+            for row_idx, pixel in enumerate(self.pixels)
+            if self.pixel_counts is None
+            or pixel_counts.get(pixel["value"], 0) != self.pixel_counts.get(pixel["value"], 0)
+        ]
+        self.pixel_counts = dict(pixel_counts)
+        self.refresh_rows(changed_rows, PIXELS, PIXELS)
+
+    def set_highlighted_row(self, row_idx):
+        """Highlight the pixel value of a row, refreshing only the previous and the new row"""
+        if row_idx is not None and not 0 <= row_idx < len(self.pixels):
+            row_idx = None
+        previous_row, self.highlighted_row = self.highlighted_row, row_idx
+        self.refresh_rows([previous_row, row_idx], PIXEL_VALUE, PIXEL_VALUE)
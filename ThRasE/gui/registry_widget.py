@@ -23,10 +23,11 @@ from pathlib import Path
 
 from qgis.core import Qgis
 from qgis.PyQt import uic
-from qgis.PyQt.QtCore import pyqtSlot
+from qgis.PyQt.QtCore import QTimer, pyqtSlot
 from qgis.PyQt.QtWidgets import QColorDialog, QFileDialog, QMessageBox, QWidget
 
 from ThRasE.core.editing import LayerToEdit
+from ThRasE.gui.view_widget import display_refresh_interval
 from ThRasE.utils.system_utils import block_signals_to, wait_process
 
 # plugin path
@@ -55,8 +56,14 @@ class RegistryWidget(QWidget, FORM_CLASS):
         self.TilesColor.clicked.connect(self.change_tiles_color)
         self.previousTileGroup.clicked.connect(self.go_previous_group)
         self.nextTileGroup.clicked.connect(self.go_next_group)
-        # show tiles while dragging the slider, not only on release
-        self.PixelLogGroups_Slider.valueChanged.connect(self.change_group_from_slider)
+        # show the groups while dragging the slider, not only on release, coalesced to
+        # one redraw per frame of the screen
+        self.slider_group = None
+        self.slider_timer = QTimer(self)
+        self.slider_timer.setSingleShot(True)
+        self.slider_timer.setInterval(display_refresh_interval())
+        self.slider_timer.timeout.connect(self.show_slider_group)
+        self.PixelLogGroups_Slider.valueChanged.connect(self.queue_group_from_slider)
         self.PixelLogGroups_Slider.sliderMoved.connect(self.slider_manual_changed)
         # auto center button
         self.autoCenter.clicked.connect(self.center_to_current_group)
@@ -70,6 +77,8 @@ class RegistryWidget(QWidget, FORM_CLASS):
         self.DeleteRegistry.clicked.connect(self.delete_registry)
         # enable/disable registry
         self.EnableRegistry.toggled.connect(self.toggle_registry_enabled)
+        # keep the registry in a GeoPackage next to the thematic raster
+        self.PersistRegistry.toggled.connect(self.toggle_persist_registry)
 
     def update_registry(self, go_to_last=True):
         if not LayerToEdit.current:
@@ -86,7 +95,7 @@ class RegistryWidget(QWidget, FORM_CLASS):
             return
 
         # compute total modified pixels once to avoid repeated sums during slider moves
-        self.total_pixels_modified = sum(len(g.tiles) for g in LayerToEdit.current.registry.groups)
+        self.total_pixels_modified = sum(g.pixel_count for g in LayerToEdit.current.registry.groups)
         # toggle registry export button
         self.QPBtn_ExportRegistry.setEnabled(self.total_pixels_modified > 0)
         if not status or total_groups == 0:
@@ -154,8 +163,23 @@ class RegistryWidget(QWidget, FORM_CLASS):
             # update renderer with new color
             LayerToEdit.current.registry.update_color()
 
+    @pyqtSlot(int)
+    def queue_group_from_slider(self, idx_group):
+        # only the last position of the slider in each frame is displayed
+        self.slider_group = idx_group
+        if not self.slider_timer.isActive():
+            self.slider_timer.start()
+
+    @pyqtSlot()
+    def show_slider_group(self):
+        if self.slider_group is not None:
+            self.change_group_from_slider(self.slider_group)
+
     @pyqtSlot(int)
     def change_group_from_slider(self, idx_group):
+        # a queued slider position is superseded by this one
+        self.slider_timer.stop()
+        self.slider_group = None
         if not LayerToEdit.current or not LayerToEdit.current.registry.groups:
             self.set_empty_state()
             return
@@ -170,13 +194,26 @@ class RegistryWidget(QWidget, FORM_CLASS):
         group = registry.current_group
         self.PixelLogGroup_DetailText.setText(
             "{} pixels modified: {} | Total: {} pixels modified".format(
-                len(group.tiles), group.edit_date.strftime("%d %b %Y, %H:%M:%S"), self.total_pixels_modified
+                group.pixel_count, group.edit_date.strftime("%d %b %Y, %H:%M:%S"), self.total_pixels_modified
             )
         )
+        self.PixelLogGroup_DetailText.setToolTip(self.class_proportions_text())
         # enable/disable nav buttons
         self.previousTileGroup.setEnabled(idx_group > 1)
         self.nextTileGroup.setEnabled(idx_group < total_groups)
 
+    @staticmethod
+    def class_proportions_text():
+        """Return the proportion of each class in the thematic raster, from the live histogram of
+        the layer to edit (if it was already read)"""
+        histogram = LayerToEdit.current.histogram if LayerToEdit.current else None
+        total = sum(histogram.values()) if histogram else 0
+        if not total:
+            return ""
+        return "Class proportions in the thematic raster:\n" + "\n".join(
+            f"{value}: {count / total:.2%} ({count:,} pixels)" for value, count in sorted(histogram.items())
+        )
+
     def slider_manual_changed(self):
         # disable show all registry when manually changing the slider value
         self.showAll.setChecked(False)
@@ -185,7 +222,8 @@ class RegistryWidget(QWidget, FORM_CLASS):
     def go_previous_group(self):
         if not LayerToEdit.current or not LayerToEdit.current.registry.current_group:
             return
-        idx_group = LayerToEdit.current.registry.current_group.idx
+        # the slider is ahead of the current group while its redraw is queued
+        idx_group = self.PixelLogGroups_Slider.value()
         if idx_group <= 1:
             return
         self.PixelLogGroups_Slider.setValue(idx_group - 1)
@@ -197,7 +235,8 @@ class RegistryWidget(QWidget, FORM_CLASS):
         if not LayerToEdit.current or not LayerToEdit.current.registry.current_group:
             return
         total = len(LayerToEdit.current.registry.groups)
-        idx_group = LayerToEdit.current.registry.current_group.idx
+        # the slider is ahead of the current group while its redraw is queued
+        idx_group = self.PixelLogGroups_Slider.value()
         if idx_group >= total:
             return
         self.PixelLogGroups_Slider.setValue(idx_group + 1)
@@ -220,6 +259,13 @@ class RegistryWidget(QWidget, FORM_CLASS):
         else:
             LayerToEdit.current.registry.clear_show_all()
 
+    @pyqtSlot(bool)
+    @wait_process
+    def toggle_persist_registry(self, enabled):
+        if not LayerToEdit.current:
+            return
+        LayerToEdit.current.registry.enable_sidecar(enabled)
+
     @pyqtSlot(bool)
     def toggle_registry_enabled(self, enabled):
         if not LayerToEdit.current:
@@ -310,8 +356,11 @@ class RegistryWidget(QWidget, FORM_CLASS):
         )
         if reply != QMessageBox.StandardButton.Yes:
             return
-        # delete all registry entries for the current layer
-        LayerToEdit.current.pixel_log_store = {}
+        # delete all registry entries for the current layer (and in the sidecar if enabled)
+        LayerToEdit.current.pixel_log_store.clear()
+        LayerToEdit.current.journal.compact()
+        LayerToEdit.current.report_journal_error()
+        LayerToEdit.current.registry.update()
         LayerToEdit.current.registry.delete()
         self.set_empty_state()
         ThRasE.dialog.MsgBar.pushMessage(
@@ -80,16 +80,12 @@ class RenderWidget(QWidget):
                 self.refresh()
                 return
 
-            # include registry memory layer if exists
+            # include registry memory layer and raster overlay if exists
             from ThRasE.core.editing import LayerToEdit
 
-            memory_layer = (
-                LayerToEdit.current.registry.memory_layer
-                if LayerToEdit.current and LayerToEdit.current.registry.memory_layer
-                else None
-            )
+            registry_layers = LayerToEdit.current.registry.canvas_layers() if LayerToEdit.current else []
 
-            layers_to_set = [memory_layer, *valid_layers] if memory_layer else valid_layers
+            layers_to_set = [*registry_layers, *valid_layers]
             self.canvas.setLayers(layers_to_set)
 
             # set init extent from other view if any is activated else set layer extent
@@ -19,25 +19,37 @@
 """
 
 import os
-import uuid
 from pathlib import Path
 
 from qgis.core import Qgis, QgsFeature
 from qgis.gui import QgsMapTool, QgsRubberBand
 from qgis.PyQt import uic
 from qgis.PyQt.QtCore import Qt, QTimer, pyqtSlot
-from qgis.PyQt.QtGui import QColor
+from qgis.PyQt.QtGui import QColor, QGuiApplication
 from qgis.PyQt.QtWidgets import QColorDialog, QWidget
 from qgis.utils import iface
 
-from ThRasE.core.editing import EditLog, LayerToEdit, Pixel, check_before_editing, edit_layer
-from ThRasE.utils.qgis_utils import get_pixel_centroid
+from ThRasE.core.editing import (
+    EditLog,
+    LayerToEdit,
+    Pixel,
+    check_before_editing,
+    check_no_global_edit_running,
+    edit_layer,
+)
 from ThRasE.utils.system_utils import block_signals_to, wait_process
 
 # plugin path
 plugin_folder = os.path.dirname(os.path.dirname(__file__))
 
 
+def display_refresh_interval():
+    """Milliseconds between two frames of the primary screen (60 Hz if unknown)"""
+    screen = QGuiApplication.primaryScreen()
+    refresh_rate = screen.refreshRate() if screen is not None else 0
+    return max(1, round(1000 / (refresh_rate if refresh_rate > 0 else 60)))
+
+
 class ViewWidget(QWidget):
     def setup_view_widget(self):
         self.render_widget.parent_view = self
@@ -61,6 +73,12 @@ class ViewWidget(QWidget):
         }
         # mouse pixel value tracking in recode pixel table
         self.mouse_pixel_value_tracking = False
+        # the mouse moves are throttled to the display refresh rate, only the last position is resolved
+        self.mouse_pixel_value_point = None
+        self.mouse_pixel_value_timer = QTimer(self)
+        self.mouse_pixel_value_timer.setSingleShot(True)
+        self.mouse_pixel_value_timer.setInterval(display_refresh_interval())
+        self.mouse_pixel_value_timer.timeout.connect(self.update_pixel_value_highlight)
         self.mousePixelValue2Table.clicked.connect(self.unhighlight_cells_in_recode_pixel_table)
         self.mousePixelValue2Table.toggled.connect(self.toggle_mouse_pixel_value_tracking)
         if self.mousePixelValue2Table.isChecked():
@@ -130,34 +148,40 @@ class ViewWidget(QWidget):
     @staticmethod
     @pyqtSlot()
     def unhighlight_cells_in_recode_pixel_table():
-        from ThRasE.thrase import ThRasE
-
-        with block_signals_to(ThRasE.dialog.recodePixelTable):
-            [
-                ThRasE.dialog.recodePixelTable.item(idx, 2).setBackground(Qt.GlobalColor.white)
-                for idx in range(len(LayerToEdit.current.pixels))
-            ]
+        layer = LayerToEdit.current
+        if layer and layer.pixels:
+            layer.highlight_value_in_recode_pixel_table(None)
 
     def toggle_mouse_pixel_value_tracking(self, enabled):
         """Connect or disconnect canvas tracking for pixel-value highlighting."""
         if enabled and not self.mouse_pixel_value_tracking:
-            self.render_widget.canvas.xyCoordinates.connect(self.update_pixel_value_highlight)
+            self.render_widget.canvas.xyCoordinates.connect(self.queue_pixel_value_highlight)
             self.mouse_pixel_value_tracking = True
             return
 
         if not enabled and self.mouse_pixel_value_tracking:
             try:
-                self.render_widget.canvas.xyCoordinates.disconnect(self.update_pixel_value_highlight)
+                self.render_widget.canvas.xyCoordinates.disconnect(self.queue_pixel_value_highlight)
             except TypeError:
                 pass
             self.mouse_pixel_value_tracking = False
+            self.mouse_pixel_value_timer.stop()
+            self.mouse_pixel_value_point = None
             layer = LayerToEdit.current
             if layer and layer.pixels:
                 layer.highlight_value_in_recode_pixel_table(None)
 
-    def update_pixel_value_highlight(self, point):
+    def queue_pixel_value_highlight(self, point):
+        """Keep the last mouse position and resolve it at most once per display frame."""
+        self.mouse_pixel_value_point = point
+        if not self.mouse_pixel_value_timer.isActive():
+            self.mouse_pixel_value_timer.start()
+
+    def update_pixel_value_highlight(self):
         """Highlight the table row matching the pixel under the mouse pointer."""
-        if not self.mousePixelValue2Table.isChecked():
+        point = self.mouse_pixel_value_point
+        self.mouse_pixel_value_point = None
+        if point is None or not self.mousePixelValue2Table.isChecked():
             return
 
         layer = LayerToEdit.current
@@ -166,12 +190,8 @@ class ViewWidget(QWidget):
 
         pixel_value = None
         if layer.check_point_inside_layer(point):
-            try:
-                identify_result = layer.data_provider.identify(point, Qgis.RasterIdentifyFormat.Value)
-                if identify_result.isValid():
-                    pixel_value = identify_result.results().get(layer.band)
-            except Exception:
-                pixel_value = None
+            # from the block cache of the layer to edit
+            pixel_value = layer.get_pixel_value_from_pnt(point)
 
         layer.highlight_value_in_recode_pixel_table(pixel_value)
 
@@ -279,18 +299,25 @@ class ViewWidget(QWidget):
     def go_to_history(self, action, from_edit_tool):
         from ThRasE.thrase import ThRasE
 
+        # the undo/redo writes the band, not while a global edit writes the same file
+        if not check_no_global_edit_running():
+            return
+        # the oldest entries of the history could have been evicted by the memory budget
+        edit_log = self.edit_logs[from_edit_tool]
+        if not (edit_log.can_be_undone() if action == "undo" else edit_log.can_be_redone()):
+            return
+
         if from_edit_tool == "pixel":
             if action == "undo":
                 self.UndoPixel.setEnabled(False)
-                pixel, value = self.edit_logs["pixel"].undo()
+                _, edit_diff = self.edit_logs["pixel"].undo()
                 ThRasE.dialog.editing_status.setText("Undo: 1 pixel restored!")
             if action == "redo":
                 self.RedoPixel.setEnabled(False)
-                pixel, value = self.edit_logs["pixel"].redo()
+                _, edit_diff = self.edit_logs["pixel"].redo()
                 ThRasE.dialog.editing_status.setText("Redo: 1 pixel remade!")
             # make action
-            group_id = uuid.uuid4()
-            LayerToEdit.current.edit_pixel(pixel, value, group_id)
+            LayerToEdit.current.apply_diff(edit_diff, undo=action == "undo", tool=action)
             # refresh registry widget
             ThRasE.dialog.registry_widget.update_registry()
             # update status of undo/redo buttons
@@ -300,7 +327,7 @@ class ViewWidget(QWidget):
         if from_edit_tool == "line":
             if action == "undo":
                 self.UndoLine.setEnabled(False)
-                line_feature, pixels_and_values = self.edit_logs["line"].undo()
+                line_feature, edit_diff = self.edit_logs["line"].undo()
                 # delete the line
                 rubber_band = next(
                     (rb for rb in self.lines_drawn if rb.asGeometry().equals(line_feature.geometry())), None
@@ -308,10 +335,10 @@ class ViewWidget(QWidget):
                 if rubber_band:
                     rubber_band.reset(Qgis.GeometryType.Line)
                     self.lines_drawn.remove(rubber_band)
-                ThRasE.dialog.editing_status.setText(f"Undo: {len(pixels_and_values)} pixels restored!")
+                ThRasE.dialog.editing_status.setText(f"Undo: {len(edit_diff)} pixels restored!")
             if action == "redo":
                 self.RedoLine.setEnabled(False)
-                line_feature, pixels_and_values = self.edit_logs["line"].redo()
+                line_feature, edit_diff = self.edit_logs["line"].redo()
                 # create, repaint and save the rubber band to redo
                 rubber_band = QgsRubberBand(self.render_widget.canvas, Qgis.GeometryType.Line)
                 color = self.lines_color
@@ -320,10 +347,9 @@ class ViewWidget(QWidget):
                 rubber_band.setWidth(4)
                 rubber_band.addGeometry(line_feature.geometry())
                 self.lines_drawn.append(rubber_band)
-                ThRasE.dialog.editing_status.setText(f"Redo: {len(pixels_and_values)} pixels remade!")
+                ThRasE.dialog.editing_status.setText(f"Redo: {len(edit_diff)} pixels remade!")
             # make action
-            group_id = uuid.uuid4()
-            [LayerToEdit.current.edit_pixel(pixel, value, group_id) for pixel, value in pixels_and_values]
+            LayerToEdit.current.apply_diff(edit_diff, undo=action == "undo", tool=action)
             # refresh registry widget
             ThRasE.dialog.registry_widget.update_registry()
             # update status of undo/redo/clean buttons
@@ -334,7 +360,7 @@ class ViewWidget(QWidget):
         if from_edit_tool == "polygon":
             if action == "undo":
                 self.UndoPolygon.setEnabled(False)
-                polygon_feature, pixels_and_values = self.edit_logs["polygon"].undo()
+                polygon_feature, edit_diff = self.edit_logs["polygon"].undo()
                 # delete the rubber band
                 rubber_band = next(
                     (rb for rb in self.polygons_drawn if rb.asGeometry().equals(polygon_feature.geometry())), None
@@ -342,10 +368,10 @@ class ViewWidget(QWidget):
                 if rubber_band:
                     rubber_band.reset(Qgis.GeometryType.Polygon)
                     self.polygons_drawn.remove(rubber_band)
-                ThRasE.dialog.editing_status.setText(f"Undo: {len(pixels_and_values)} pixels restored!")
+                ThRasE.dialog.editing_status.setText(f"Undo: {len(edit_diff)} pixels restored!")
             if action == "redo":
                 self.RedoPolygon.setEnabled(False)
-                polygon_feature, pixels_and_values = self.edit_logs["polygon"].redo()
+                polygon_feature, edit_diff = self.edit_logs["polygon"].redo()
                 # create, repaint and save the rubber band to redo
                 rubber_band = QgsRubberBand(self.render_widget.canvas, Qgis.GeometryType.Polygon)
                 color = self.polygons_color
@@ -354,10 +380,9 @@ class ViewWidget(QWidget):
                 rubber_band.setWidth(4)
                 rubber_band.addGeometry(polygon_feature.geometry())
                 self.polygons_drawn.append(rubber_band)
-                ThRasE.dialog.editing_status.setText(f"Redo: {len(pixels_and_values)} pixels remade!")
+                ThRasE.dialog.editing_status.setText(f"Redo: {len(edit_diff)} pixels remade!")
             # make action
-            group_id = uuid.uuid4()
-            [LayerToEdit.current.edit_pixel(pixel, value, group_id) for pixel, value in pixels_and_values]
+            LayerToEdit.current.apply_diff(edit_diff, undo=action == "undo", tool=action)
             # refresh registry widget
             ThRasE.dialog.registry_widget.update_registry()
             # update status of undo/redo buttons
@@ -368,7 +393,7 @@ class ViewWidget(QWidget):
         if from_edit_tool == "freehand":
             if action == "undo":
                 self.UndoFreehand.setEnabled(False)
-                freehand_feature, pixels_and_values = self.edit_logs["freehand"].undo()
+                freehand_feature, edit_diff = self.edit_logs["freehand"].undo()
                 # delete the rubber band
                 rubber_band = next(
                     (rb for rb in self.freehand_drawn if rb.asGeometry().equals(freehand_feature.geometry())), None
@@ -376,10 +401,10 @@ class ViewWidget(QWidget):
                 if rubber_band:
                     rubber_band.reset(Qgis.GeometryType.Polygon)
                     self.freehand_drawn.remove(rubber_band)
-                ThRasE.dialog.editing_status.setText(f"Undo: {len(pixels_and_values)} pixels restored!")
+                ThRasE.dialog.editing_status.setText(f"Undo: {len(edit_diff)} pixels restored!")
             if action == "redo":
                 self.RedoFreehand.setEnabled(False)
-                freehand_feature, pixels_and_values = self.edit_logs["freehand"].redo()
+                freehand_feature, edit_diff = self.edit_logs["freehand"].redo()
                 # create, repaint and save the rubber band to redo
                 rubber_band = QgsRubberBand(self.render_widget.canvas, Qgis.GeometryType.Polygon)
                 color = self.freehand_color
@@ -388,10 +413,9 @@ class ViewWidget(QWidget):
                 rubber_band.setWidth(4)
                 rubber_band.addGeometry(freehand_feature.geometry())
                 self.freehand_drawn.append(rubber_band)
-                ThRasE.dialog.editing_status.setText(f"Redo: {len(pixels_and_values)} pixels remade!")
+                ThRasE.dialog.editing_status.setText(f"Redo: {len(edit_diff)} pixels remade!")
             # make action
-            group_id = uuid.uuid4()
-            [LayerToEdit.current.edit_pixel(pixel, value, group_id) for pixel, value in pixels_and_values]
+            LayerToEdit.current.apply_diff(edit_diff, undo=action == "undo", tool=action)
             # refresh registry widget
             ThRasE.dialog.registry_widget.update_registry()
             # update status of undo/redo buttons
@@ -587,15 +611,15 @@ class PickerPixelTool(QgsMapTool):
         x = event.pos().x()
         y = event.pos().y()
         point = self.view_widget.render_widget.canvas.getCoordinateTransform().toMapCoordinates(x, y)
-        pixel = Pixel(point=get_pixel_centroid(x=point.x(), y=point.y()))
+        pixel = Pixel.from_xy(LayerToEdit.current.grid, point.x(), point.y())
         # avoid editing the same pixel multiple times while drawing
-        if self.last_pixel is not None and pixel.qgs_point == self.last_pixel.qgs_point:
+        if pixel == self.last_pixel:
             return
         self.last_pixel = pixel
-        pixel_value = LayerToEdit.current.edit_from_pixel_picker(pixel)
-        if pixel_value is not None:
+        edit_diff = LayerToEdit.current.edit_from_pixel_picker(pixel)
+        if edit_diff:
             # store per-view edit history
-            self.view_widget.edit_logs["pixel"].add((pixel, pixel_value))
+            self.view_widget.edit_logs["pixel"].add((pixel, edit_diff))
             self.view_widget.render_widget.refresh()
             # update status of undo/redo buttons
             self.view_widget.UndoPixel.setEnabled(self.view_widget.edit_logs["pixel"].can_be_undone())
@@ -674,10 +698,10 @@ class PickerLineTool(QgsMapTool):
 
     def edit(self, new_feature):
         line_buffer = float(self.view_widget.LineBuffer.currentText())
-        pixels_and_values = LayerToEdit.current.edit_from_line_picker(new_feature, line_buffer)
-        if pixels_and_values:  # at least one pixel was edited
+        edit_diff = LayerToEdit.current.edit_from_line_picker(new_feature, line_buffer)
+        if edit_diff:  # at least one pixel was edited
             # store per-view edit history
-            self.view_widget.edit_logs["line"].add((new_feature, pixels_and_values))
+            self.view_widget.edit_logs["line"].add((new_feature, edit_diff))
             self.view_widget.render_widget.refresh()
             # update status of undo/redo/clean buttons
             self.view_widget.UndoLine.setEnabled(self.view_widget.edit_logs["line"].can_be_undone())
@@ -786,10 +810,10 @@ class PickerPolygonTool(QgsMapTool):
         self.start_new_polygon()
 
     def edit(self, new_feature):
-        pixels_and_values = LayerToEdit.current.edit_from_polygon_picker(new_feature)
-        if pixels_and_values:  # at least one pixel was edited
+        edit_diff = LayerToEdit.current.edit_from_polygon_picker(new_feature)
+        if edit_diff:  # at least one pixel was edited
             # store per-view edit history
-            self.view_widget.edit_logs["polygon"].add((new_feature, pixels_and_values))
+            self.view_widget.edit_logs["polygon"].add((new_feature, edit_diff))
             self.view_widget.render_widget.refresh()
             # update status of undo/redo/clean buttons
             self.view_widget.UndoPolygon.setEnabled(self.view_widget.edit_logs["polygon"].can_be_undone())
@@ -951,10 +975,10 @@ class PickerFreehandTool(QgsMapTool):
         self.start_new_freehand()
 
     def edit(self, new_feature):
-        pixels_and_values = LayerToEdit.current.edit_from_freehand_picker(new_feature)
-        if pixels_and_values:  # at least one pixel was edited
+        edit_diff = LayerToEdit.current.edit_from_freehand_picker(new_feature)
+        if edit_diff:  # at least one pixel was edited
             # store per-view edit history
-            self.view_widget.edit_logs["freehand"].add((new_feature, pixels_and_values))
+            self.view_widget.edit_logs["freehand"].add((new_feature, edit_diff))
             self.view_widget.render_widget.refresh()
             # update status of undo/redo/clean buttons
             self.view_widget.UndoFreehand.setEnabled(self.view_widget.edit_logs["freehand"].can_be_undone())
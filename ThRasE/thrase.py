@@ -112,8 +112,12 @@ class ThRasE:
     def run(self):
         """Run method that loads and starts the plugin"""
 
+        from ThRasE.core.editing import LayerToEdit
+
         if not self.pluginIsActive:
             self.pluginIsActive = True
+            # worker processes for the global edits, opt in with the "ThRasE/workers" setting
+            LayerToEdit.workers = max(1, QSettings().value("ThRasE/workers", 1, type=int))
 
             # dialog may not exist if:
             #    first run of plugin
@@ -192,6 +196,8 @@ class ThRasE:
         # reset some variables
         self.pluginIsActive = False
         ThRasEDialog.view_widgets = []
+        # write the edits queued in the journals
+        [layer_to_edit.journal.close() for layer_to_edit in LayerToEdit.instances.values()]
         LayerToEdit.instances = {}
         LayerToEdit.current = None
 
@@ -18,7 +18,6 @@
  ***************************************************************************/
 """
 
-import multiprocessing
 import xml.etree.ElementTree as ET  # nosec B405 - parses only QGIS-generated style XML, not untrusted input
 from random import randrange
 
@@ -30,7 +29,6 @@ from qgis.PyQt.QtGui import QColor
 from qgis.PyQt.QtWidgets import QApplication, QMessageBox, QProgressDialog
 
 from ThRasE.utils.qgis_utils import get_source_from
-from ThRasE.utils.system_utils import wait_process
 
 # --------------------------------------------------------------------------
 
@@ -169,55 +167,6 @@ def get_pixel_values(layer, band):
     return pixel_values
 
 
-# --------------------------------------------------------------------------
-# pixel count utils
-
-
-def chunks(lst, n):
-    """generate the sub-list of chunks of n-sizes from list lst"""
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
-
-
-def pixel_count_in_chunk(args):
-    img_path, band, pixel_values, xoff, yoff, xsize, ysize = args
-    pixel_count = [0] * len(pixel_values)
-    gdal_file = gdal.Open(img_path, gdal.GA_ReadOnly)
-
-    chunk_narray = gdal_file.GetRasterBand(band).ReadAsArray(xoff, yoff, xsize, ysize).astype(int)
-
-    for idx, pixel_value in enumerate(pixel_values):
-        pixel_count[idx] += (chunk_narray == int(pixel_value)).sum()
-    return pixel_count
-
-
-@wait_process
-def get_pixel_count_by_pixel_values(layer, band, pixel_values=None):
-    """Get the total pixel count for each pixel values"""
-
-    if pixel_values is None:
-        pixel_values = get_pixel_values(layer, band)
-
-    # split the image in chunks, the 0,0 is left-upper corner
-    gdal_file = gdal.Open(get_source_from(layer), gdal.GA_ReadOnly)
-    chunk_size = 1000
-    input_data = []
-    for y in chunks(range(gdal_file.RasterYSize), chunk_size):
-        yoff = y[0]
-        ysize = len(y)
-        for x in chunks(range(gdal_file.RasterXSize), chunk_size):
-            xoff = x[0]
-            xsize = len(x)
-
-            input_data.append((get_source_from(layer), band, pixel_values, xoff, yoff, xsize, ysize))
-
-    # compute and merge all parallel process returns in one result
-    with multiprocessing.Pool(multiprocessing.cpu_count()) as pool:
-        imap_it = pool.imap(pixel_count_in_chunk, input_data)
-        pixel_counts = np.sum(list(imap_it), axis=0).tolist()
-        return dict(zip(pixel_values, pixel_counts, strict=True))
-
-
 # --------------------------------------------------------------------------
 # GDAL metadata copy utils
 
@@ -0,0 +1,1278 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import itertools
+import math
+import multiprocessing
+import os
+import struct
+import sys
+import zlib
+from collections import OrderedDict, deque
+from shutil import move
+
+import numpy as np
+from osgeo import gdal, gdal_array, ogr, osr
+from qgis.core import Qgis, QgsRasterBlock
+from qgis.PyQt.QtCore import QByteArray
+
+from ThRasE.utils.others_utils import copy_band_metadata, copy_dataset_metadata
+
+# --------------------------------------------------------------------------
+# raster block <-> numpy array utils
+
+QGIS_TO_NUMPY_DTYPE = {
+    Qgis.DataType.Byte: np.uint8,
+    Qgis.DataType.UInt16: np.uint16,
+    Qgis.DataType.Int16: np.int16,
+    Qgis.DataType.UInt32: np.uint32,
+    Qgis.DataType.Int32: np.int32,
+    Qgis.DataType.Float32: np.float32,
+    Qgis.DataType.Float64: np.float64,
+}
+if hasattr(Qgis.DataType, "Int8"):  # QGIS >= 3.30
+    QGIS_TO_NUMPY_DTYPE[Qgis.DataType.Int8] = np.int8
+
+
+def band_dtype(band):
+    """Numpy data type of a GDAL raster band"""
+    return np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType))
+
+
+def block_to_array(block):
+    """Convert a QgsRasterBlock into a 2D numpy array with the native data type of the block"""
+    dtype = QGIS_TO_NUMPY_DTYPE[block.dataType()]
+    array = np.frombuffer(bytes(block.data()), dtype=dtype)
+    return array.reshape(block.height(), block.width()).copy()
+
+
+def array_to_block(array, data_type):
+    """Convert a 2D numpy array into a QgsRasterBlock of the given QGIS data type"""
+    rows, cols = array.shape
+    array = np.ascontiguousarray(array, dtype=QGIS_TO_NUMPY_DTYPE[data_type])
+    block = QgsRasterBlock(data_type, cols, rows)
+    block.setData(QByteArray(array.tobytes()))
+    return block
+
+
+# --------------------------------------------------------------------------
+# block windows utils
+
+# default memory budget (bytes) of the arrays processed at once in the global edits
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+def iter_block_windows(band, memory_budget=DEFAULT_MEMORY_BUDGET, bytes_per_pixel=None, region=None):
+    """Iterate over the band in windows aligned to its native blocks and sized to fit the memory budget
+
+    The windows are full-width strips of one or more block rows when possible, otherwise
+    chunks of one or more blocks inside a block row.
+
+    Args:
+        band: GDAL raster band
+        memory_budget (int): max bytes of the arrays processed per window
+        bytes_per_pixel (int): bytes used per pixel of the window, by default the working
+            arrays of a recode: input, output and changed mask
+        region (tuple): (xoff, yoff, cols, rows) restrict the windows to this region of the band
+
+    Yields:
+        (xoff, yoff, cols, rows) of each window
+    """
+    if bytes_per_pixel is None:
+        bytes_per_pixel = 2 * gdal.GetDataTypeSize(band.DataType) // 8 + 1
+    x_start, y_start, x_size, y_size = region or (0, 0, band.XSize, band.YSize)
+    x_end, y_end = x_start + x_size, y_start + y_size
+    block_x, block_y = band.GetBlockSize()
+    block_x, block_y = min(block_x, band.XSize), min(block_y, band.YSize)
+    max_pixels = max(memory_budget // bytes_per_pixel, block_x * block_y)
+
+    if x_size * block_y <= max_pixels:
+        win_cols = x_size
+        win_rows = block_y * (max_pixels // (x_size * block_y))
+    else:
+        win_cols = block_x * (max_pixels // (block_x * block_y))
+        win_rows = block_y
+    # the first window starts at the block boundary before the region
+    x_first = x_start if win_cols == x_size else x_start - x_start % block_x
+    y_first = y_start - y_start % block_y
+
+    for yoff in range(y_first, y_end, win_rows):
+        for xoff in range(x_first, x_end, win_cols):
+            win_x, win_y = max(xoff, x_start), max(yoff, y_start)
+            yield win_x, win_y, min(xoff + win_cols, x_end) - win_x, min(yoff + win_rows, y_end) - win_y
+
+
+def write_changed_blocks(band, array, changed, xoff, yoff):
+    """Write the array window in the band only for the native blocks that contain changed
+    pixels, consecutive changed blocks in a block row are written at once
+
+    Args:
+        band: GDAL raster band to write
+        array (np.ndarray): window values
+        changed (np.ndarray): boolean mask of the pixels changed in the window
+        xoff, yoff (int): offset of the window in the band
+    """
+    block_x, block_y = band.GetBlockSize()
+    rows, cols = array.shape
+    # block boundaries inside the window, relative to the window
+    col_edges = [0, *range(block_x - xoff % block_x, cols, block_x), cols]
+    row_edges = [0, *range(block_y - yoff % block_y, rows, block_y), rows]
+
+    for r0, r1 in itertools.pairwise(row_edges):
+        run_start = None
+        for c0, c1 in itertools.pairwise(col_edges):
+            if changed[r0:r1, c0:c1].any():
+                run_start = c0 if run_start is None else run_start
+                run_end = c1
+                continue
+            if run_start is not None:
+                band.WriteArray(array[r0:r1, run_start:run_end], xoff + run_start, yoff + r0)
+                run_start = None
+        if run_start is not None:
+            band.WriteArray(array[r0:r1, run_start:run_end], xoff + run_start, yoff + r0)
+
+
+# --------------------------------------------------------------------------
+# block cache
+
+# target size (pixels per side) of the tiles of the block cache
+BLOCK_CACHE_TILE_SIZE = 256
+
+
+def cache_tile_size(block_size, size):
+    """Size of the tiles of the block cache along one axis: a multiple of the native block size
+    close to the target tile size, or the target tile size for big blocks (e.g. strips)"""
+    if block_size > 2 * BLOCK_CACHE_TILE_SIZE:
+        return min(BLOCK_CACHE_TILE_SIZE, size)
+    return min(block_size * max(1, round(BLOCK_CACHE_TILE_SIZE / block_size)), size)
+
+
+def get_block_size(file_path, band):
+    """Native (x, y) block size of the band in the raster file, (256, 256) if it cannot be read"""
+    try:
+        dataset = gdal.Open(file_path, gdal.GA_ReadOnly)
+    except RuntimeError:  # gdal exceptions enabled
+        dataset = None
+    if dataset is None:
+        return BLOCK_CACHE_TILE_SIZE, BLOCK_CACHE_TILE_SIZE
+    return tuple(dataset.GetRasterBand(band).GetBlockSize())
+
+
+class BlockCache:
+    """LRU cache of the band values in tiles aligned to the native blocks, it serves the pixel
+    value lookups from numpy arrays. The edits must write through it (see update), or clear
+    it when the file is modified outside the cache
+
+    Args:
+        read_window (function): read_window(xoff, yoff, cols, rows) -> numpy array
+        width, height (int): size of the band
+        block_size (tuple): native (x, y) block size of the band
+        max_tiles (int): tiles kept in the cache
+    """
+
+    def __init__(self, read_window, width, height, block_size=(256, 256), max_tiles=64):
+        self.read_window = read_window
+        self.width = width
+        self.height = height
+        self.tile_cols = cache_tile_size(block_size[0], width)
+        self.tile_rows = cache_tile_size(block_size[1], height)
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+
+    def get_tile(self, tile_x, tile_y):
+        tile = self.tiles.get((tile_x, tile_y))
+        if tile is not None:
+            self.tiles.move_to_end((tile_x, tile_y))
+            return tile
+        xoff, yoff = tile_x * self.tile_cols, tile_y * self.tile_rows
+        tile = self.read_window(
+            xoff, yoff, min(self.tile_cols, self.width - xoff), min(self.tile_rows, self.height - yoff)
+        )
+        self.tiles[(tile_x, tile_y)] = tile
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def get_value(self, col, row):
+        """Value of the pixel at (col, row), None if it is outside the band"""
+        if not (0 <= col < self.width and 0 <= row < self.height):
+            return None
+        tile = self.get_tile(col // self.tile_cols, row // self.tile_rows)
+        return tile[row % self.tile_rows, col % self.tile_cols].item()
+
+    def get_values(self, cols, rows):
+        """Values of the pixels at (cols, rows) arrays, reading each tile once
+
+        Returns:
+            np.ndarray: the values, in the data type of the band
+        """
+        cols = np.asarray(cols, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        if np.any((cols < 0) | (cols >= self.width) | (rows < 0) | (rows >= self.height)):
+            raise IndexError("Pixel outside the band")
+        tiles_per_row = -(-self.width // self.tile_cols)
+        tile_keys = (rows // self.tile_rows) * tiles_per_row + cols // self.tile_cols
+        values = None
+        for tile_key in np.unique(tile_keys):
+            in_tile = tile_keys == tile_key
+            tile_y, tile_x = divmod(int(tile_key), tiles_per_row)
+            tile = self.get_tile(tile_x, tile_y)
+            if values is None:
+                values = np.empty(len(cols), dtype=tile.dtype)
+            values[in_tile] = tile[rows[in_tile] % self.tile_rows, cols[in_tile] % self.tile_cols]
+        return values if values is not None else np.empty(0)
+
+    def update(self, array, xoff, yoff):
+        """Write through the array written in the band at (xoff, yoff) to the cached tiles"""
+        rows, cols = array.shape
+        for (tile_x, tile_y), tile in self.tiles.items():
+            tile_xoff, tile_yoff = tile_x * self.tile_cols, tile_y * self.tile_rows
+            x0, x1 = max(xoff, tile_xoff), min(xoff + cols, tile_xoff + tile.shape[1])
+            y0, y1 = max(yoff, tile_yoff), min(yoff + rows, tile_yoff + tile.shape[0])
+            if x0 < x1 and y0 < y1:
+                tile[y0 - tile_yoff : y1 - tile_yoff, x0 - tile_xoff : x1 - tile_xoff] = array[
+                    y0 - yoff : y1 - yoff, x0 - xoff : x1 - xoff
+                ]
+
+    def clear(self):
+        self.tiles.clear()
+
+
+# --------------------------------------------------------------------------
+# array kernels
+
+
+def get_values_out_of_range(values, dtype):
+    """Return the values that cannot be stored in the numpy data type without changing them"""
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return [value for value in values if not np.isfinite(np.array(value, dtype=dtype))]
+    info = np.iinfo(dtype)
+    return [value for value in values if not (float(value).is_integer() and info.min <= value <= info.max)]
+
+
+def check_recode_values(old_new_value, dtype):
+    """Raise ValueError if any new value of the recode does not fit in the data type"""
+    values_out_of_range = get_values_out_of_range(sorted(set(old_new_value.values())), dtype)
+    if values_out_of_range:
+        dtype = np.dtype(dtype)
+        valid_range = "" if dtype.kind == "f" else f" ({np.iinfo(dtype).min} to {np.iinfo(dtype).max})"
+        raise ValueError(
+            f"The new value(s) {', '.join(str(v) for v in values_out_of_range)} cannot be stored "
+            f"in the data type {dtype.name}{valid_range} of the thematic raster"
+        )
+
+
+def make_recode_kernel(old_new_value, dtype):
+    """Build a recode function that maps every pixel in a single pass with the old->new values
+
+    For 8 and 16 bits integer types a dense lookup table is indexed with np.take, for wider
+    types (or floats) the values are mapped with searchsorted over the sorted old values. The
+    old values that are not integers never match the pixels of an integer band.
+
+    Args:
+        old_new_value (dict): {old_value: new_value, ...}
+        dtype: numpy data type of the arrays to recode
+
+    Returns:
+        function: recode(array) -> (new_array, changed_mask), the new array has the same dtype
+            and the input array is not modified
+
+    Raises:
+        ValueError: if a new value does not fit in the data type
+    """
+    dtype = np.dtype(dtype)
+    check_recode_values(old_new_value, dtype)
+    pairs = [(old, new) for old, new in old_new_value.items() if old != new]
+
+    if dtype.kind in "ui" and dtype.itemsize <= 2:
+        # dense lookup table indexed by the unsigned view of the values
+        index_dtype = np.dtype(f"u{dtype.itemsize}")
+        identity = np.arange(np.iinfo(index_dtype).max + 1, dtype=index_dtype).view(dtype)
+        lut = identity.copy()
+        info = np.iinfo(dtype)
+        for old_value, new_value in pairs:
+            if float(old_value).is_integer() and info.min <= old_value <= info.max:
+                lut[np.array(old_value, dtype=dtype).view(index_dtype)] = new_value
+        changed_lut = lut != identity
+
+        def recode(array):
+            index = array.view(index_dtype)
+            return np.take(lut, index), np.take(changed_lut, index)
+
+        return recode
+
+    # sorted keys mapping in the data type of the band, skipping the old values that can not be
+    # a pixel of an integer band (not integer or out of range), so they are not truncated
+    if dtype.kind in "ui":
+        info = np.iinfo(dtype)
+        pairs = [(old, new) for old, new in pairs if float(old).is_integer() and info.min <= old <= info.max]
+    keys = np.array([old for old, _ in pairs], dtype=dtype)
+    values = np.array([new for _, new in pairs], dtype=dtype)
+    order = np.argsort(keys)
+    keys, values = keys[order], values[order]
+
+    def recode(array):
+        if not keys.size:
+            return array.copy(), np.zeros(array.shape, dtype=bool)
+        position = np.searchsorted(keys, array)
+        np.minimum(position, keys.size - 1, out=position)
+        changed = keys[position] == array
+        new_array = array.copy()
+        new_array[changed] = values[position[changed]]
+        return new_array, changed
+
+    return recode
+
+
+def recode_array(array, old_new_value):
+    """Recode the array values using the old->new values dictionary
+
+    Args:
+        array (np.ndarray): input values, it is not modified
+        old_new_value (dict): {old_value: new_value, ...}
+
+    Returns:
+        (np.ndarray, np.ndarray): the recoded array (same dtype) and the boolean mask of the changed pixels
+    """
+    return make_recode_kernel(old_new_value, array.dtype)(array)
+
+
+def rasterize_geometry(wkb, geo_transform, cols, rows, all_touched=False):
+    """Rasterize a geometry over a grid and return a boolean mask (rows x cols)
+
+    Args:
+        wkb (bytes): the geometry as WKB
+        geo_transform (tuple): GDAL geotransform of the grid
+        cols, rows (int): size of the grid
+        all_touched (bool): if False use the pixel-center rule, a pixel is inside when
+            the geometry contains its center
+    """
+    ogr_ds = ogr.GetDriverByName("Memory").CreateDataSource("thrase_geometry")
+    ogr_layer = ogr_ds.CreateLayer("geometry", None, ogr.wkbUnknown)
+    ogr_feat = ogr.Feature(ogr_layer.GetLayerDefn())
+    ogr_feat.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+    ogr_layer.CreateFeature(ogr_feat)
+    ogr_feat = None
+
+    mask_ds = gdal.GetDriverByName("MEM").Create("", cols, rows, 1, gdal.GDT_Byte)
+    mask_ds.SetGeoTransform(geo_transform)
+    options = [f"ALL_TOUCHED={'TRUE' if all_touched else 'FALSE'}"]
+    if gdal.RasterizeLayer(mask_ds, [1], ogr_layer, burn_values=[1], options=options) != 0:
+        raise RuntimeError("Unable to rasterize the geometry")
+
+    return mask_ds.GetRasterBand(1).ReadAsArray().astype(bool)
+
+
+def points_to_segment_distance(px, py, ax, ay, bx, by):
+    """Vectorized euclidean distance from the points (px, py) arrays to the segment (a, b)"""
+    dx = bx - ax
+    dy = by - ay
+    seg_len2 = dx * dx + dy * dy
+    if seg_len2 == 0:
+        return np.hypot(px - ax, py - ay)
+    # projection of the points on the segment, clamped to its ends
+    t = np.clip(((px - ax) * dx + (py - ay) * dy) / seg_len2, 0, 1)
+    return np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def polyline_corridor_mask(vertices, geo_transform, cols, rows, line_buffer):
+    """Return a boolean mask (rows x cols) of the pixels of the grid whose centroid is at a
+    distance lower or equal than line_buffer (in average pixel size units) to the polyline
+
+    The candidate pixels of each segment are the pixels sampled at pixel size steps inside
+    its bounding box padded by the buffer, the distance to the polyline is computed for the
+    whole corridor of all segments at once as the minimum distance per pixel.
+
+    Args:
+        vertices (list): [(x, y), ...] vertices of the polyline in map coordinates
+        geo_transform (tuple): GDAL geotransform of the grid
+        cols, rows (int): size of the grid
+        line_buffer (float): buffer in pixels
+    """
+    x0, ps_x, _, y0, _, ps_y = geo_transform
+    ps_y = abs(ps_y)
+    max_distance = (ps_x + ps_y) / 2 * line_buffer  # average of the pixel size, when the pixel is not square
+
+    def pixel_range(x_min, x_max, y_min, y_max):
+        col_min = max(math.floor((x_min - x0) / ps_x), 0)
+        col_max = min(math.floor((x_max - x0) / ps_x), cols - 1)
+        row_min = max(math.floor((y0 - y_max) / ps_y), 0)
+        row_max = min(math.floor((y0 - y_min) / ps_y), rows - 1)
+        if col_min > col_max or row_min > row_max:
+            return None
+        return slice(row_min, row_max + 1), slice(col_min, col_max + 1)
+
+    candidates = np.zeros((rows, cols), dtype=bool)
+    min_distance = np.full((rows, cols), np.inf)
+    for (ax, ay), (bx, by) in itertools.pairwise(vertices):
+        # candidate pixels: the padded box of the segment sampled at pixel size steps
+        xs = np.arange(min(ax, bx) - ps_x * line_buffer, max(ax, bx) + ps_x * line_buffer, ps_x)
+        ys = np.arange(min(ay, by) - ps_y * line_buffer, max(ay, by) + ps_y * line_buffer, ps_y)
+        box = pixel_range(xs[0], xs[-1], ys[0], ys[-1]) if xs.size and ys.size else None
+        if box is not None:
+            candidates[box] = True
+        # distance of the segment to all pixel centroids that can be at max_distance
+        box = pixel_range(
+            min(ax, bx) - max_distance,
+            max(ax, bx) + max_distance,
+            min(ay, by) - max_distance,
+            max(ay, by) + max_distance,
+        )
+        if box is None:
+            continue
+        pc_x = x0 + (np.arange(box[1].start, box[1].stop) + 0.5) * ps_x
+        pc_y = y0 - (np.arange(box[0].start, box[0].stop) + 0.5) * ps_y
+        distance = points_to_segment_distance(pc_x[np.newaxis, :], pc_y[:, np.newaxis], ax, ay, bx, by)
+        np.minimum(min_distance[box], distance, out=min_distance[box])
+
+    return candidates & (min_distance <= max_distance)
+
+
+def array_histogram(array):
+    """Return the values in the array and their pixel counts, with a single bincount pass for
+    the 8/16-bit integer types
+
+    Returns:
+        (np.ndarray, np.ndarray): values and counts
+    """
+    if array.dtype.kind in "iu" and array.dtype.itemsize <= 2:
+        unsigned = array.view(f"u{array.dtype.itemsize}")
+        counts = np.bincount(unsigned.ravel())
+        values = np.flatnonzero(counts)
+        return values.astype(unsigned.dtype).view(array.dtype), counts[values]
+    return np.unique(array, return_counts=True)
+
+
+# --------------------------------------------------------------------------
+# cells of the grid: raster overlay and outlines
+
+
+def group_cells_by_tile(rows, cols, width, tile_size):
+    """Sort the cells by the tile of the grid that contains them
+
+    Returns:
+        (rows, cols, order, tile_keys, starts, ends): sorted cells, the sorting order, the tile
+        key (tile_row * tiles_per_row + tile_col) of each cell, and the range of each tile
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    tiles_per_row = (width + tile_size - 1) // tile_size
+    tile_keys = (rows // tile_size) * tiles_per_row + cols // tile_size
+    order = np.argsort(tile_keys, kind="stable")
+    tile_keys, rows, cols = tile_keys[order], rows[order], cols[order]
+    if not len(tile_keys):
+        return rows, cols, order, tile_keys, order, order
+    starts = np.flatnonzero(np.r_[True, tile_keys[1:] != tile_keys[:-1]])
+    ends = np.r_[starts[1:], len(tile_keys)]
+    return rows, cols, order, tile_keys, starts, ends
+
+
+def burn_cells_to_raster(
+    file_path, width, height, geo_transform, projection, rows, cols, values, data_type=gdal.GDT_UInt16, block_size=256
+):
+    """Create a sparse tiled raster aligned to the grid of the layer with the values burned in
+    the given cells, and 0 (nodata) elsewhere. Only the tiles that contain cells are written,
+    so the cost depends on the number of cells and not on the size of the raster
+
+    Args:
+        file_path (str): output raster, e.g. in /vsimem/
+        width, height (int): size of the raster in pixels
+        geo_transform (tuple): GDAL geotransform of the grid
+        projection (str): WKT of the grid
+        rows, cols (np.ndarray): grid indices of the cells
+        values (np.ndarray): values to burn in the cells, greater than 0
+        data_type (int): GDAL data type of the raster
+        block_size (int): size of the tiles of the raster
+    """
+    driver = gdal.GetDriverByName("GTiff")
+    dataset = driver.Create(
+        file_path,
+        width,
+        height,
+        1,
+        data_type,
+        [
+            "TILED=YES",
+            f"BLOCKXSIZE={block_size}",
+            f"BLOCKYSIZE={block_size}",
+            "SPARSE_OK=TRUE",
+            "COMPRESS=DEFLATE",
+        ],
+    )
+    dataset.SetGeoTransform(geo_transform)
+    dataset.SetProjection(projection)
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(0)
+
+    rows, cols, order, tile_keys, starts, ends = group_cells_by_tile(rows, cols, width, block_size)
+    values = np.asarray(values)[order]
+    if len(rows):
+        blocks_per_row = (width + block_size - 1) // block_size
+        dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(data_type))
+        for start, end in zip(starts.tolist(), ends.tolist(), strict=True):
+            tile_row, tile_col = divmod(int(tile_keys[start]), blocks_per_row)
+            yoff, xoff = tile_row * block_size, tile_col * block_size
+            tile = np.zeros((min(block_size, height - yoff), min(block_size, width - xoff)), dtype=dtype)
+            # the later cells overwrite the earlier ones
+            tile[rows[start:end] - yoff, cols[start:end] - xoff] = values[start:end]
+            band.WriteArray(tile, xoff, yoff)
+
+    band.FlushCache()
+    band = None
+    dataset = None
+
+
+def polygonize_cells(rows, cols, geo_transform, width, tile_size=1024):
+    """Dissolved outline of the cells of the grid as a (multi)polygon, polygonized by tiles
+    of the grid with cells so the masks stay small for scattered cells
+
+    Args:
+        rows, cols (np.ndarray): grid indices of the cells
+        geo_transform (tuple): GDAL geotransform of the grid
+        width (int): columns of the grid
+        tile_size (int): max size of the masks polygonized at once
+
+    Returns:
+        ogr.Geometry: the dissolved outline, None without cells
+    """
+    if not len(rows):
+        return None
+    rows, cols, _, _, starts, ends = group_cells_by_tile(rows, cols, width, tile_size)
+    x_origin, pixel_size_x, _, y_origin, _, pixel_size_y = geo_transform
+
+    mem_driver = gdal.GetDriverByName("MEM")
+    vector_driver = ogr.GetDriverByName("Memory")
+    pieces = ogr.Geometry(ogr.wkbMultiPolygon)
+    for start, end in zip(starts.tolist(), ends.tolist(), strict=True):
+        tile_rows, tile_cols = rows[start:end], cols[start:end]
+        row_min, col_min = int(tile_rows.min()), int(tile_cols.min())
+        mask = np.zeros((int(tile_rows.max()) - row_min + 1, int(tile_cols.max()) - col_min + 1), dtype=np.uint8)
+        mask[tile_rows - row_min, tile_cols - col_min] = 1
+
+        mask_dataset = mem_driver.Create("", mask.shape[1], mask.shape[0], 1, gdal.GDT_Byte)
+        mask_dataset.SetGeoTransform(
+            (x_origin + col_min * pixel_size_x, pixel_size_x, 0, y_origin + row_min * pixel_size_y, 0, pixel_size_y)
+        )
+        mask_band = mask_dataset.GetRasterBand(1)
+        mask_band.WriteArray(mask)
+
+        vector_dataset = vector_driver.CreateDataSource("")
+        layer = vector_dataset.CreateLayer("cells", geom_type=ogr.wkbPolygon)
+        layer.CreateField(ogr.FieldDefn("value", ogr.OFTInteger))
+        gdal.Polygonize(mask_band, mask_band, layer, 0, [], callback=None)
+        for feature in layer:
+            pieces.AddGeometry(feature.GetGeometryRef())
+        mask_band = mask_dataset = layer = vector_dataset = None
+
+    # dissolve the pieces that touch across the tiles
+    return pieces.UnionCascaded() if len(starts) > 1 else pieces
+
+
+# --------------------------------------------------------------------------
+# masks for global edits, picklable to be evaluated in worker processes
+
+
+class RasterClassesMask:
+    """Mask of the pixels whose value in a classes raster is one of the selected classes, the
+    classes raster is aligned to the grid of the layer to edit by a pixel offset
+
+    Args:
+        file_path (str): classes raster file
+        band (int): band of the classes raster
+        classes (list): selected classes
+        offset_x, offset_y (int): position in the classes raster of the pixel (0, 0) of the layer to edit
+        valid_region (tuple): (xoff, yoff, cols, rows) region of the layer to edit covered by the classes raster
+    """
+
+    def __init__(self, file_path, band, classes, offset_x, offset_y, valid_region):
+        self.file_path = file_path
+        self.band = band
+        self.classes = np.array(classes)
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.valid_region = valid_region
+        self.pixels_count = 0  # pixels inside the mask evaluated
+        self._dataset = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_dataset"] = None
+        return state
+
+    def __call__(self, xoff, yoff, cols, rows):
+        valid_x, valid_y, valid_cols, valid_rows = self.valid_region
+        # intersection of the window with the valid region
+        x_start, y_start = max(xoff, valid_x), max(yoff, valid_y)
+        x_end, y_end = min(xoff + cols, valid_x + valid_cols), min(yoff + rows, valid_y + valid_rows)
+        if x_start >= x_end or y_start >= y_end:
+            return None
+
+        if self._dataset is None:
+            self._dataset = gdal.Open(self.file_path, gdal.GA_ReadOnly)
+            if self._dataset is None:
+                raise RuntimeError("Unable to open the raster mask file")
+        class_array = self._dataset.GetRasterBand(self.band).ReadAsArray(
+            x_start + self.offset_x, y_start + self.offset_y, x_end - x_start, y_end - y_start
+        )
+        mask = np.zeros((rows, cols), dtype=bool)
+        mask[y_start - yoff : y_end - yoff, x_start - xoff : x_end - xoff] = np.isin(class_array, self.classes)
+        self.pixels_count += int(np.count_nonzero(mask))
+        return mask
+
+
+class VectorPolygonMask:
+    """Mask of the pixels whose center is inside the polygons of a vector layer (GDAL's
+    pixel-center rule), rasterized over the windows of the grid of the layer to edit
+
+    Args:
+        geo_transform (tuple): GDAL geotransform of the layer to edit
+        projection (str): WKT projection of the layer to edit
+        source (str): vector file that OGR can open, or None to use the geometries
+        layer_name (str): layer of the vector file, or None for the first layer
+        geometries (list): polygons as WKB, for layers that are not file-backed
+        srs_wkt (str): WKT projection of the geometries
+    """
+
+    def __init__(self, geo_transform, projection, source=None, layer_name=None, geometries=None, srs_wkt=None):
+        self.geo_transform = geo_transform
+        self.projection = projection
+        self.source = source
+        self.layer_name = layer_name
+        self.geometries = geometries
+        self.srs_wkt = srs_wkt
+        self.pixels_count = 0  # pixels inside the mask evaluated
+        self._ogr_ds = self._ogr_layer = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_ogr_ds"] = state["_ogr_layer"] = None
+        return state
+
+    def open(self):
+        """Open the vector source (or build the in-memory datasource of the geometries)"""
+        if self.source is not None:
+            self._ogr_ds = ogr.Open(self.source)
+            if self._ogr_ds is None:
+                raise RuntimeError(f'Unable to rasterize the vector mask "{self.source}"')
+            self._ogr_layer = (
+                self._ogr_ds.GetLayerByName(self.layer_name) if self.layer_name else self._ogr_ds.GetLayer(0)
+            )
+            if self._ogr_layer is None:
+                raise RuntimeError(f'Unable to rasterize the vector mask "{self.source}"')
+            return
+
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(self.srs_wkt or "")
+        self._ogr_ds = ogr.GetDriverByName("Memory").CreateDataSource("thrase_vector_mask")
+        self._ogr_layer = self._ogr_ds.CreateLayer("mask", srs, ogr.wkbMultiPolygon)
+        layer_defn = self._ogr_layer.GetLayerDefn()
+        for wkb in self.geometries or []:
+            ogr_geom = ogr.CreateGeometryFromWkb(wkb)
+            if ogr_geom is None:
+                continue
+            ogr_feat = ogr.Feature(layer_defn)
+            ogr_feat.SetGeometry(ogr_geom)
+            self._ogr_layer.CreateFeature(ogr_feat)
+            ogr_feat = None
+        if self._ogr_layer.GetFeatureCount() == 0:
+            raise RuntimeError("The selected vector mask has no polygon features")
+
+    def __call__(self, xoff, yoff, cols, rows):
+        if self._ogr_layer is None:
+            self.open()
+        x0, ps_x, _, y0, _, ps_y = self.geo_transform
+        # align the in-memory mask raster to the layer-to-edit grid at the window
+        mask_ds = gdal.GetDriverByName("MEM").Create("", cols, rows, 1, gdal.GDT_Byte)
+        mask_ds.SetGeoTransform((x0 + xoff * ps_x, ps_x, 0, y0 + yoff * ps_y, 0, ps_y))
+        mask_ds.SetProjection(self.projection)
+        if gdal.RasterizeLayer(mask_ds, [1], self._ogr_layer, burn_values=[1], options=["ALL_TOUCHED=FALSE"]) != 0:
+            raise RuntimeError("Unable to rasterize the vector mask")
+        mask = mask_ds.GetRasterBand(1).ReadAsArray().astype(bool)
+        self.pixels_count += int(np.count_nonzero(mask))
+        return mask
+
+
+# --------------------------------------------------------------------------
+# global edits
+
+
+class RecodeCanceled(Exception):
+    """The recode was canceled by its feedback, the raster file was left untouched"""
+
+
+# state of the recode in each worker process, set by the pool initializer
+_worker_state = {}
+
+
+def find_python_executable():
+    """Return the python interpreter of the installation, inside QGIS sys.executable is the
+    QGIS application, not python. None if it is not found"""
+    if os.name == "nt":
+        directories, names = (sys.exec_prefix,), ("pythonw.exe", "python.exe")
+    else:
+        directories = (os.path.join(sys.exec_prefix, "bin"), sys.exec_prefix)
+        names = (f"python{sys.version_info.major}.{sys.version_info.minor}", "python3", "python")
+    for directory in directories:
+        for name in names:
+            python_path = os.path.join(directory, name)
+            if os.path.isfile(python_path) and os.access(python_path, os.X_OK):
+                return python_path
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    return None
+
+
+def get_pool_context():
+    """Return the multiprocessing context for the worker processes, or None if the python
+    interpreter is not found (the work is done in this process). The processes are always
+    spawned: the global edits run in a thread of QGIS, where forking is unsafe"""
+    python_path = find_python_executable()
+    if python_path is None:
+        return None
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(python_path)
+    return context
+
+
+def recode_window(src_band, recode, window, mask_func=None):
+    """Read and recode a window of the band, restricted to the mask if any
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): the values, the recoded values and the changed mask of the window
+    """
+    xoff, yoff, cols, rows = window
+    data = src_band.ReadAsArray(xoff, yoff, cols, rows)
+    new_data, changed = recode(data)
+    if mask_func is not None:
+        mask = mask_func(xoff, yoff, cols, rows)
+        if mask is None:
+            changed[:] = False
+        else:
+            changed &= mask
+        np.copyto(new_data, data, where=~changed)
+    return data, new_data, changed
+
+
+def _init_recode_worker(file_path, band, old_new_value, mask_func):
+    dataset = gdal.Open(file_path, gdal.GA_ReadOnly)
+    src_band = dataset.GetRasterBand(band)
+    _worker_state.update(
+        dataset=dataset,
+        band=src_band,
+        recode=make_recode_kernel(old_new_value, band_dtype(src_band)),
+        mask_func=mask_func,
+    )
+
+
+def _recode_window_in_worker(args):
+    window, return_all = args
+    mask_func = _worker_state["mask_func"]
+    mask_pixels_before = mask_func.pixels_count if mask_func is not None else 0
+    data, new_data, changed = recode_window(_worker_state["band"], _worker_state["recode"], window, mask_func)
+    mask_pixels = mask_func.pixels_count - mask_pixels_before if mask_func is not None else 0
+    if not return_all and not changed.any():
+        return window, mask_pixels, None
+    return window, mask_pixels, (data, new_data, changed)
+
+
+def recode_band_by_windows(
+    src_band,
+    dst_band,
+    old_new_value,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    record=False,
+    write_all=False,
+    region=None,
+    mask_func=None,
+    workers=1,
+    feedback=None,
+    change_set=None,
+    before_write=None,
+):
+    """Recode the band window by window with the old->new values, writing in the destination
+    band only the native blocks with changes, peak memory is bounded by the memory budget
+    (plus the changes recorded, if enabled)
+
+    With more than one worker the windows are recoded in a process pool and the results are
+    written in the windows order by this process, the result is the same as the serial recode.
+
+    When the recode is canceled (or fails) editing the source band in place, the blocks
+    already written are restored with their original values before raising.
+
+    Args:
+        src_band: GDAL band to read
+        dst_band: GDAL band to write, it can be the source band opened in update mode or the
+            band of a copy of the source raster
+        old_new_value (dict): {old_value: new_value, ...}
+        memory_budget (int): max bytes of the arrays processed at once
+        record (bool): return the position and values of all pixels changed
+        write_all (bool): write also the windows without changes, for an empty destination band
+        region (tuple): (xoff, yoff, cols, rows) restrict the recode to this region of the band
+        mask_func (function): mask_func(xoff, yoff, cols, rows) -> boolean array of the pixels
+            of the window where the recode is applied, or None if there is nothing to recode,
+            it must be picklable to use workers (see RasterClassesMask and VectorPolygonMask)
+        workers (int): number of worker processes
+        feedback (QgsFeedback, QgsTask): receives the progress per window, and it is checked
+            for cancellation before writing each window
+        change_set (ChangeSet): keeps the old values of the pixels changed in each window
+            written, to roll back the edit
+        before_write (function): before_write(src_band, xoff, yoff, changed) called before
+            writing a window with changes, e.g. to save the native blocks in a snapshot
+
+    Returns:
+        (int, dict, tuple): total of pixels changed, the pixels changed per recode
+            {(old_value, new_value): count, ...} and, if record and there are changes,
+            the arrays (rows, cols, old_values, new_values) of the pixels changed, otherwise None
+
+    Raises:
+        RecodeCanceled: if the feedback was canceled
+    """
+    edited_pixels_count = 0
+    windows_done = 0
+    value_changes = {}
+    changes = []
+    recode = make_recode_kernel(old_new_value, band_dtype(src_band))
+    bytes_per_pixel = 2 * gdal.GetDataTypeSize(src_band.DataType) // 8 + (2 if mask_func else 1)
+    # windows in flight: the window being written plus two windows per worker
+    in_flight = 1 if workers <= 1 else 2 * workers + 1
+    windows = list(iter_block_windows(src_band, memory_budget // in_flight, bytes_per_pixel, region))
+    # original values of the pixels written in place, to restore them if the recode does not finish
+    undo = [] if dst_band is src_band and feedback is not None and change_set is None else None
+
+    def write_window(window, window_data):
+        nonlocal edited_pixels_count, windows_done
+        if feedback is not None:
+            if feedback.isCanceled():
+                raise RecodeCanceled("The edit was canceled")
+            feedback.setProgress(100 * windows_done / len(windows))
+        windows_done += 1
+        xoff, yoff, _, _ = window
+        if window_data is None:
+            return
+        data, new_data, changed = window_data
+        count = int(np.count_nonzero(changed))
+        if count:
+            old_values, counts = array_histogram(data[changed])
+            new_values, _ = recode(old_values)
+            for old_value, new_value, value_count in zip(
+                old_values.tolist(), new_values.tolist(), counts.tolist(), strict=True
+            ):
+                value_changes[(old_value, new_value)] = value_changes.get((old_value, new_value), 0) + value_count
+        if undo is not None and count:
+            undo.append((window, np.packbits(changed), data[changed]))
+        if change_set is not None and count:
+            change_set.add(window, changed, data[changed])
+        if before_write is not None and count:
+            before_write(src_band, xoff, yoff, changed)
+        if write_all:
+            dst_band.WriteArray(new_data, xoff, yoff)
+        elif count:
+            write_changed_blocks(dst_band, new_data, changed, xoff, yoff)
+        edited_pixels_count += count
+        if record and count:
+            row_indices, col_indices = np.nonzero(changed)
+            changes.append(
+                (
+                    row_indices + yoff,
+                    col_indices + xoff,
+                    data[row_indices, col_indices],
+                    new_data[row_indices, col_indices],
+                )
+            )
+
+    pool_context = get_pool_context() if workers > 1 and len(windows) > 1 else None
+    try:
+        if pool_context is None:
+            for window in windows:
+                write_window(window, recode_window(src_band, recode, window, mask_func))
+        else:
+            file_path = src_band.GetDataset().GetDescription()
+            with pool_context.Pool(
+                min(workers, len(windows)),
+                initializer=_init_recode_worker,
+                initargs=(file_path, src_band.GetBand(), old_new_value, mask_func),
+            ) as pool:
+                # ordered writer, with a bounded number of windows submitted ahead
+                pending = deque()
+                windows_to_submit = iter(windows)
+                for window in itertools.islice(windows_to_submit, in_flight - 1):
+                    pending.append(pool.apply_async(_recode_window_in_worker, ((window, write_all),)))
+                while pending:
+                    window, mask_pixels, window_data = pending.popleft().get()
+                    for next_window in itertools.islice(windows_to_submit, 1):
+                        pending.append(pool.apply_async(_recode_window_in_worker, ((next_window, write_all),)))
+                    if mask_func is not None:
+                        mask_func.pixels_count += mask_pixels
+                    write_window(window, window_data)
+    except BaseException:
+        if undo:
+            restore_windows(dst_band, undo)
+        elif change_set is not None and dst_band is src_band:
+            rollback_band(dst_band, change_set)
+        raise
+
+    if feedback is not None:
+        feedback.setProgress(100)
+
+    if changes:
+        changes = tuple(np.concatenate(column) for column in zip(*changes, strict=True))
+    return edited_pixels_count, value_changes, changes or None
+
+
+def restore_windows(band, undo):
+    """Write back the original values of the pixels changed in the band, undo is the list of
+    (window, packed changed mask, old values) of the windows written"""
+    for (xoff, yoff, cols, rows), packed_changed, old_values in reversed(undo):
+        changed = np.unpackbits(packed_changed, count=cols * rows).reshape(rows, cols).view(bool)
+        data = band.ReadAsArray(xoff, yoff, cols, rows)
+        data[changed] = old_values
+        write_changed_blocks(band, data, changed, xoff, yoff)
+    band.FlushCache()
+
+
+class ChangeSet:
+    """Sparse change set of a global edit in a file of compressed chunks: for each window
+    written, the packed mask of the pixels changed and their old values. The edit is rolled
+    back streaming the chunks, without a copy of the raster"""
+
+    # window (xoff, yoff, cols, rows), pixels changed and size of the compressed chunk
+    CHUNK_HEADER = struct.Struct("<iiiiqq")
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.dtype = None
+        self.offsets = []
+        self.pixels_count = 0
+        # the changes were recorded in the registry, and so its rollback
+        self.recorded = False
+
+    def __len__(self):
+        return self.pixels_count
+
+    def add(self, window, changed, old_values):
+        if self.dtype is None:
+            self.dtype = old_values.dtype
+        chunk = zlib.compress(np.packbits(changed).tobytes() + old_values.astype(self.dtype).tobytes(), 1)
+        with open(self.file_path, "ab") as change_set_file:
+            self.offsets.append(change_set_file.tell())
+            change_set_file.write(self.CHUNK_HEADER.pack(*window, len(old_values), len(chunk)) + chunk)
+        self.pixels_count += len(old_values)
+
+    def chunks(self):
+        """Yield the (window, changed mask, old values) of the windows, the last written first"""
+        with open(self.file_path, "rb") as change_set_file:
+            for offset in reversed(self.offsets):
+                change_set_file.seek(offset)
+                xoff, yoff, cols, rows, count, size = self.CHUNK_HEADER.unpack(
+                    change_set_file.read(self.CHUNK_HEADER.size)
+                )
+                chunk = zlib.decompress(change_set_file.read(size))
+                mask_size = (cols * rows + 7) // 8
+                changed = np.unpackbits(np.frombuffer(chunk, dtype=np.uint8, count=mask_size), count=cols * rows)
+                old_values = np.frombuffer(chunk, dtype=self.dtype, count=count, offset=mask_size)
+                yield (xoff, yoff, cols, rows), changed.reshape(rows, cols).view(bool), old_values
+
+    def remove(self):
+        if os.path.isfile(self.file_path):
+            os.remove(self.file_path)
+        self.offsets = []
+        self.pixels_count = 0
+
+
+def rollback_band(band, change_set, record=False, feedback=None, before_write=None):
+    """Write back the old values of the change set in the band, window by window and only the
+    native blocks changed. It is not cancellable, the feedback only receives the progress, and
+    before_write is called before writing each window (see recode_band_by_windows)
+
+    Returns:
+        (int, dict, tuple): see recode_band_by_windows, for the pixels restored
+    """
+    restored_pixels_count = 0
+    value_changes = {}
+    changes = []
+    for idx, (window, changed, old_values) in enumerate(change_set.chunks()):
+        if feedback is not None:
+            feedback.setProgress(100 * idx / len(change_set.offsets))
+        xoff, yoff, cols, rows = window
+        data = band.ReadAsArray(xoff, yoff, cols, rows)
+        current_values = data[changed]
+        data[changed] = old_values
+        if before_write is not None:
+            before_write(band, xoff, yoff, changed)
+        write_changed_blocks(band, data, changed, xoff, yoff)
+
+        restored = current_values != old_values
+        restored_pixels_count += int(np.count_nonzero(restored))
+        # in the data type of the band, the values of float rasters are not truncated
+        value_pairs, counts = np.unique(
+            np.stack((current_values[restored], old_values[restored])), axis=1, return_counts=True
+        )
+        for (current_value, old_value), count in zip(value_pairs.T.tolist(), counts.tolist(), strict=True):
+            value_changes[(current_value, old_value)] = value_changes.get((current_value, old_value), 0) + count
+        if record and restored.any():
+            row_indices, col_indices = np.nonzero(changed)
+            changes.append(
+                (
+                    row_indices[restored] + yoff,
+                    col_indices[restored] + xoff,
+                    current_values[restored],
+                    old_values[restored],
+                )
+            )
+    band.FlushCache()
+    if feedback is not None:
+        feedback.setProgress(100)
+
+    if changes:
+        changes = tuple(np.concatenate(column) for column in zip(*changes, strict=True))
+    return restored_pixels_count, value_changes, changes or None
+
+
+def rollback_raster_file(file_path, band, change_set, record=False, feedback=None, before_write=None):
+    """Roll back a global edit of the raster file in place with its change set
+
+    Returns:
+        (int, dict, tuple): see rollback_band
+    """
+    ds = open_raster_in_update_mode(file_path)
+    if ds is None:
+        raise RuntimeError(f"Unable to open the raster {file_path} in update mode")
+    try:
+        result = rollback_band(ds.GetRasterBand(band), change_set, record, feedback, before_write)
+        ds.FlushCache()
+    finally:
+        del ds
+    _histogram_cache.pop((os.path.abspath(file_path), band), None)
+    return result
+
+
+def copy_band_by_windows(src_band, dst_band, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Copy the band values window by window into the destination band"""
+    for xoff, yoff, cols, rows in iter_block_windows(src_band, memory_budget):
+        dst_band.WriteArray(src_band.ReadAsArray(xoff, yoff, cols, rows), xoff, yoff)
+
+
+def open_raster_in_update_mode(file_path):
+    """Open the raster in update mode, return None if the driver (or the file) does not support it"""
+    try:
+        return gdal.Open(file_path, gdal.GA_Update)
+    except RuntimeError:  # gdal exceptions enabled
+        return None
+
+
+def recode_raster_file(file_path, band, old_new_value, memory_budget=DEFAULT_MEMORY_BUDGET, record=False, **kwargs):
+    """Recode a band of the raster file with the old->new values by block windows
+
+    The file is updated in place, writing only the blocks with changes, when its driver
+    supports the update mode (e.g. GTiff). Otherwise the raster is copied into a temporary
+    file, edited, and moved over the original file.
+
+    Args:
+        file_path (str): raster file to edit
+        band (int): band to edit
+        old_new_value (dict): {old_value: new_value, ...}
+        memory_budget (int): max bytes of the arrays processed per window
+        record (bool): return the position and values of all pixels changed
+        **kwargs: region, mask_func, workers, feedback, change_set and before_write, see recode_band_by_windows
+
+    Returns:
+        (int, list, tuple): see recode_band_by_windows
+
+    Raises:
+        ValueError: if a new value does not fit in the data type of the band, the file is not modified
+        RecodeCanceled: if the feedback was canceled, the file is not modified
+    """
+    # in place
+    ds = open_raster_in_update_mode(file_path)
+    if ds is not None:
+        try:
+            edit_band = ds.GetRasterBand(band)
+            check_recode_values(old_new_value, band_dtype(edit_band))
+            result = recode_band_by_windows(edit_band, edit_band, old_new_value, memory_budget, record, **kwargs)
+            ds.FlushCache()
+        finally:
+            del ds
+        _histogram_cache.pop((os.path.abspath(file_path), band), None)
+        return result
+
+    # copy and move, for read-only drivers. The change set is not kept, its rollback needs the
+    # update mode
+    kwargs.pop("change_set", None)
+    ds_in = gdal.Open(file_path, gdal.GA_ReadOnly)
+    if ds_in is None:
+        raise RuntimeError(f"Unable to open raster {file_path}")
+    num_bands = ds_in.RasterCount
+    src_band = ds_in.GetRasterBand(band)
+    check_recode_values(old_new_value, band_dtype(src_band))
+
+    fn, ext = os.path.splitext(file_path)
+    fn_out = fn + "_tmp" + ext
+    driver_name = ds_in.GetDriver().ShortName
+    driver = gdal.GetDriverByName(driver_name)
+    if driver is None:
+        raise RuntimeError(f"GDAL driver '{driver_name}' is not available")
+
+    ds_out = None
+    create_copy_used = False
+    if driver.GetMetadataItem("DCAP_CREATECOPY") == "YES":
+        ds_out = driver.CreateCopy(fn_out, ds_in)
+        if ds_out is not None:
+            create_copy_used = True
+
+    if ds_out is None:
+        ds_out = driver.Create(fn_out, ds_in.RasterXSize, ds_in.RasterYSize, num_bands, src_band.DataType)
+        if ds_out is None:
+            raise RuntimeError(f"Failed to create output raster {fn_out}")
+
+    result = None
+    src_band_i = dst_band_i = None
+    try:
+        for band_index in range(1, num_bands + 1):
+            src_band_i = ds_in.GetRasterBand(band_index)
+            dst_band_i = ds_out.GetRasterBand(band_index)
+            if band_index == band:
+                result = recode_band_by_windows(
+                    src_band_i,
+                    dst_band_i,
+                    old_new_value,
+                    memory_budget,
+                    record,
+                    write_all=not create_copy_used,
+                    **kwargs,
+                )
+            elif not create_copy_used:
+                copy_band_by_windows(src_band_i, dst_band_i, memory_budget)
+            copy_band_metadata(src_band_i, dst_band_i)
+    except BaseException:
+        # canceled or failed, the original file is untouched
+        del src_band_i, dst_band_i, ds_out
+        if os.path.exists(fn_out):
+            os.remove(fn_out)
+        raise
+    del src_band_i, dst_band_i
+
+    ds_out.SetGeoTransform(ds_in.GetGeoTransform())
+    ds_out.SetProjection(ds_in.GetProjection())
+    copy_dataset_metadata(ds_in, ds_out)
+
+    ds_out.FlushCache()
+    del ds_out, driver, src_band, ds_in
+    move(fn_out, file_path)
+    _histogram_cache.pop((os.path.abspath(file_path), band), None)
+
+    return result
+
+
+# --------------------------------------------------------------------------
+# class histogram
+
+# histograms by (file path, band) -> (file signature, {value: count}), see get_band_histogram
+_histogram_cache = {}
+
+
+def sum_histograms(histograms):
+    """Sum the (values, counts) histograms into a dict {value: count}"""
+    total = {}
+    for values, counts in histograms:
+        for value, count in zip(values.tolist(), counts.tolist(), strict=True):
+            total[value] = total.get(value, 0) + count
+    return total
+
+
+def _init_histogram_worker(file_path, band):
+    dataset = gdal.Open(file_path, gdal.GA_ReadOnly)
+    _worker_state.update(dataset=dataset, band=dataset.GetRasterBand(band))
+
+
+def _histogram_window_in_worker(window):
+    return array_histogram(_worker_state["band"].ReadAsArray(*window))
+
+
+def compute_band_histogram(file_path, band, memory_budget=DEFAULT_MEMORY_BUDGET, workers=1):
+    """Count the pixels of each value in the band, reading it by block windows (in parallel
+    by the number of workers)
+
+    Returns:
+        dict: {value: pixel count}
+    """
+    dataset = gdal.Open(file_path, gdal.GA_ReadOnly)
+    if dataset is None:
+        raise RuntimeError(f"Unable to open raster {file_path}")
+    src_band = dataset.GetRasterBand(band)
+    in_flight = 1 if workers <= 1 else 2 * workers
+    windows = list(iter_block_windows(src_band, memory_budget // in_flight, band_dtype(src_band).itemsize))
+
+    pool_context = get_pool_context() if workers > 1 and len(windows) > 1 else None
+    if pool_context is None:
+        window_histograms = (array_histogram(src_band.ReadAsArray(*window)) for window in windows)
+        histogram = sum_histograms(window_histograms)
+    else:
+        with pool_context.Pool(
+            min(workers, len(windows)), initializer=_init_histogram_worker, initargs=(file_path, band)
+        ) as pool:
+            histogram = sum_histograms(pool.imap_unordered(_histogram_window_in_worker, windows))
+    del src_band, dataset
+    return histogram
+
+
+def get_file_signature(file_path):
+    """Return the modification time and size of the file, to know if it was modified"""
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_band_histogram(file_path, band, memory_budget=DEFAULT_MEMORY_BUDGET, workers=1):
+    """Return the pixel count of each value in the band, cached per file and band, it is
+    computed again only if the file was modified
+
+    Returns:
+        dict: {value: pixel count}
+    """
+    signature = get_file_signature(file_path)
+    histogram = cached_band_histogram(file_path, band)
+    if histogram is not None:
+        return histogram
+    histogram = compute_band_histogram(file_path, band, memory_budget, workers)
+    _histogram_cache[(os.path.abspath(file_path), band)] = (signature, histogram)
+    return histogram
+
+
+def cached_band_histogram(file_path, band):
+    """Return the cached pixel count of each value in the band, or None if it was not computed
+    or the file was modified since"""
+    cached = _histogram_cache.get((os.path.abspath(file_path), band))
+    if cached is not None and cached[0] == get_file_signature(file_path):
+        return cached[1]
+    return None
+
+
+def forget_band_histogram(file_path, band):
+    """Drop the cached histogram of the band, e.g. when the file was edited while it was read"""
+    _histogram_cache.pop((os.path.abspath(file_path), band), None)
+
+
+def set_band_histogram(file_path, band, histogram, signature):
+    """Set the cached histogram of the band for the file in the signature (e.g. restored from
+    a saved session), it is ignored if the file was modified since"""
+    if not os.path.isfile(file_path) or tuple(signature) != get_file_signature(file_path):
+        return False
+    _histogram_cache[(os.path.abspath(file_path), band)] = (tuple(signature), dict(histogram))
+    return True
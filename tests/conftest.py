@@ -92,6 +92,9 @@ class DummyDialog:
         self.NavigationBlockWidgetControls = _EnableDisable()
         self.currentTileKeepVisible = _EnableDisable()
 
+    def update_pixel_counts(self):
+        pass
+
 
 @pytest.fixture
 def plugin(pytestconfig, qgis_iface, qgis_parent, qgis_new_project):
@@ -0,0 +1,65 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from datetime import datetime
+
+from ThRasE.core.edit_journal import EditJournal, encode_entry, read_journal
+
+
+def test_entries_are_replayed_up_to_a_torn_record(tmp_path):
+    journal = EditJournal(EditJournal.journal_path(str(tmp_path / "layer.tif")))
+    journal.append([1, 2], [3, 4], [5, 5], [6, 7], "a", datetime(2024, 5, 1, 10), "polygon")
+    journal.append([8], [9], [1], [2], "b", datetime(2024, 5, 1, 11), "pixel")
+    journal.close()
+    # the last record written when QGIS crashed
+    with open(journal.file_path, "ab") as journal_file:
+        journal_file.write(encode_entry([0], [0], [1], [2], "c", datetime.now(), "pixel")[:-4])
+
+    entries = read_journal(journal.file_path)
+    assert [entry.group_id for entry in entries] == ["a", "b"]
+    assert entries[0].rows.tolist() == [1, 2] and entries[0].new_values.tolist() == [6, 7]
+    assert entries[0].edit_date == datetime(2024, 5, 1, 10) and entries[0].tool == "polygon"
+
+
+def test_pixels_of_one_group_are_merged_and_compacted(tmp_path):
+    journal = EditJournal(str(tmp_path / "layer_thrase_journal.bin"))
+    for idx in range(100):
+        journal.append([idx], [idx], [0], [1], "undo", datetime.now(), "undo")
+    entries = journal.read()
+    assert sum(len(entry.rows) for entry in entries) == 100 and len(entries) < 100
+
+    journal.compact()
+    assert not journal.has_entries()
+    journal.close()
+
+
+def test_write_errors_are_kept_without_blocking(tmp_path):
+    # the journal can not be written in a directory that does not exist
+    journal = EditJournal(str(tmp_path / "missing" / "layer_thrase_journal.bin"))
+    journal.append([1], [2], [3], [4], "a", datetime.now(), "pixel")
+    journal.flush()
+    assert isinstance(journal.take_error(), OSError)
+    assert journal.take_error() is None
+
+    # the writer thread is still alive after the error
+    journal.append([1], [2], [3], [4], "b", datetime.now(), "pixel")
+    journal.compact()
+    assert isinstance(journal.take_error(), OSError)
+    journal.close()
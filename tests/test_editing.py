@@ -23,9 +23,63 @@ import pytest
 from osgeo import gdal
 from qgis.PyQt.QtCore import Qt
 
-from ThRasE.core.editing import LayerToEdit
+from ThRasE.core.editing import EditDiff, EditLog, LayerToEdit, Pixel, PixelGrid, PixelLog
 from ThRasE.gui.apply_from_classes_or_mask import ApplyFromClassesOrMask
+from ThRasE.gui.recode_pixel_table import RecodePixelTableModel
 from ThRasE.utils.qgis_utils import load_layer
+from ThRasE.utils.raster_utils import compute_band_histogram
+
+
+def test_pixels_are_identified_by_grid_indices():
+    grid = PixelGrid(500.0, 1000.0, 30.0, 30.0)
+    pixel = Pixel.from_xy(grid, 500.0 + 30 * 7 + 1e-9, 1000.0 - 30 * 3 - 29.9)
+    assert (pixel.row, pixel.col) == (3, 7)
+    # the same pixel from another point inside it
+    assert pixel == Pixel.from_xy(grid, 500.0 + 30 * 7 + 15, 1000.0 - 30 * 3 - 15)
+    assert len({pixel, Pixel(3, 7, grid), Pixel(7, 3, grid)}) == 2
+    assert (pixel.x(), pixel.y()) == (500.0 + 30 * 7.5, 1000.0 - 30 * 3.5)
+    assert Pixel.from_xy(grid, pixel.x(), pixel.y()) == pixel
+    assert not hasattr(pixel, "__dict__")
+
+
+def test_pixel_log_keeps_an_unknown_old_value():
+    pixel = Pixel(2, 3, PixelGrid(0, 10, 1, 1))
+    assert PixelLog(pixel, None, 4, "a").old_value is None
+    assert PixelLog(pixel, 3, 4, "a").old_value == 3
+
+
+def test_edit_diff_round_trip():
+    rows, cols = np.array([9, 0, 4]), np.array([1, 7, 3])
+    diff = EditDiff(rows, cols, np.array([1, 2, 3], dtype=np.uint8), np.array([4, 5, 6], dtype=np.uint8), width=10)
+    assert len(diff) == 3 and diff.nbytes < 3 * 10
+    # the cells are sorted by the cell index
+    assert [array.tolist() for array in diff.cells()] == [[0, 4, 9], [7, 3, 1], [2, 3, 1], [5, 6, 4]]
+
+
+def test_edit_logs_evict_the_oldest_entries(monkeypatch):
+    pixel_log, polygon_log = EditLog("pixel"), EditLog("polygon")
+    monkeypatch.setattr(EditLog, "instances", {pixel_log, polygon_log})
+    diffs = [EditDiff(np.arange(50), np.arange(50), np.zeros(50), np.ones(50), width=100) for _ in range(3)]
+    # room for two of the diffs
+    monkeypatch.setattr(EditLog, "memory_budget", 2 * diffs[0].nbytes)
+    pixel_log.add((None, diffs[0]))
+    polygon_log.add((None, diffs[1]))
+    pixel_log.add((None, diffs[2]))
+    assert pixel_log.undos == [(None, diffs[2])] and polygon_log.undos == [(None, diffs[1])]
+    # the undone entries are redone with the same diff
+    assert polygon_log.undo() == (None, diffs[1]) and polygon_log.redo() == (None, diffs[1])
+
+    # the redo entries are evicted before the undo entries
+    assert polygon_log.undo() == (None, diffs[1])
+    diff = EditDiff(np.arange(50), np.arange(50), np.zeros(50), np.ones(50), width=100)
+    pixel_log.add((None, diff))
+    assert polygon_log.redos == [] and pixel_log.undos == [(None, diffs[2]), (None, diff)]
+
+    # an entry bigger than the budget is kept, to undo the last edit
+    big_diff = EditDiff(np.arange(500), np.arange(500), np.zeros(500), np.arange(500), width=1000)
+    assert big_diff.nbytes > EditLog.memory_budget
+    polygon_log.add((None, big_diff))
+    assert polygon_log.undos == [(None, big_diff)] and pixel_log.undos == []
 
 
 @pytest.mark.usefixtures("plugin", "thrase_dialog")
@@ -132,6 +186,134 @@ class TestEditingTools:
         # Finally, compare the two rasters by reading band arrays with GDAL
         _assert_rasters_equal(saved_test_data, layer_data_to_edit, band=1)
 
+    def test_polygon_edit_undo_and_redo(self, tmp_path, load_yaml_mapping):
+        src = pytest.tests_data_dir / "test_data.tif"
+        _, mapping = load_yaml_mapping(pytest.tests_data_dir / "test_data_thrase.yaml")
+        vfeat = next(load_layer(str(pytest.tests_data_dir / "polygon.gpkg"), name="polygon").getFeatures())
+
+        test_data_to_edit_path = tmp_path / "test_data_edited.tif"
+        test_data_to_edit_path.write_bytes(src.read_bytes())
+        layer_data_to_edit = load_layer(str(test_data_to_edit_path), name="test_data_edited")
+        lte_to_test = LayerToEdit(layer_data_to_edit, band=1)
+        lte_to_test.setup_pixel_table()
+        lte_to_test.old_new_value = mapping
+        LayerToEdit.current = lte_to_test
+
+        edit_diff = LayerToEdit.current.edit_from_polygon_picker(vfeat)
+        assert edit_diff
+        # the undo and the redo write the diff back, without reading the pixels edited one by one
+        lte_to_test.data_provider.setEditable(True)
+        assert lte_to_test.apply_diff(edit_diff, undo=True) == len(edit_diff)
+        lte_to_test.data_provider.setEditable(False)
+        _assert_rasters_equal(load_layer(str(src), name="test_data"), layer_data_to_edit, band=1)
+        lte_to_test.data_provider.setEditable(True)
+        assert lte_to_test.apply_diff(edit_diff, undo=False) == len(edit_diff)
+        lte_to_test.data_provider.setEditable(False)
+        saved_test_data = load_layer(str(pytest.tests_data_dir / "test_data_polygon.tif"), name="test_data_polygon")
+        _assert_rasters_equal(saved_test_data, layer_data_to_edit, band=1)
+
+    def test_restoring_a_snapshot_can_be_reverted(self, tmp_path, load_yaml_mapping):
+        _, mapping = load_yaml_mapping(pytest.tests_data_dir / "test_data_thrase.yaml")
+        vpolygon = load_layer(str(pytest.tests_data_dir / "polygon.gpkg"), name="polygon")
+        vfeat = next(vpolygon.getFeatures())
+
+        test_data_to_edit_path = tmp_path / "test_data_snapshot.tif"
+        test_data_to_edit_path.write_bytes((pytest.tests_data_dir / "test_data.tif").read_bytes())
+        layer_data_to_edit = load_layer(str(test_data_to_edit_path), name="test_data_snapshot")
+
+        lte_to_test = LayerToEdit(layer_data_to_edit, band=1)
+        lte_to_test.setup_pixel_table()
+        lte_to_test.old_new_value = mapping
+        LayerToEdit.current = lte_to_test
+
+        snapshot = lte_to_test.snapshots.take("original")
+        assert lte_to_test.edit_from_polygon_picker(vfeat)
+        edited = lte_to_test.read_window(0, 0, lte_to_test.width, lte_to_test.height)
+
+        assert lte_to_test.restore_snapshot(snapshot) > 0
+        src = load_layer(str(pytest.tests_data_dir / "test_data.tif"), name="test_data")
+        _assert_rasters_equal(src, layer_data_to_edit, band=1)
+
+        # the edit made after the snapshot is back restoring the snapshot taken before restoring
+        before_restoring = lte_to_test.snapshots.snapshots[-1]
+        assert before_restoring.name == "Before restoring original"
+        assert lte_to_test.restore_snapshot(before_restoring) > 0
+        assert np.array_equal(lte_to_test.read_window(0, 0, lte_to_test.width, lte_to_test.height), edited)
+
+    def test_pixel_counts_are_loaded_by_a_task(self, tmp_path):
+        test_data_to_edit_path = tmp_path / "test_data_counted.tif"
+        test_data_to_edit_path.write_bytes((pytest.tests_data_dir / "test_data.tif").read_bytes())
+        lte_to_test = LayerToEdit(load_layer(str(test_data_to_edit_path), name="test_data_counted"), band=1)
+        LayerToEdit.current = lte_to_test
+        loaded = []
+
+        pixel_counts = lte_to_test.load_pixel_counts(lambda: loaded.append(True), background=False)
+        assert pixel_counts == compute_band_histogram(str(test_data_to_edit_path), 1)
+        assert loaded == [True]
+        # from the cache of the file, without a new task
+        lte_to_test.histogram = None
+        assert lte_to_test.load_pixel_counts(lambda: loaded.append(True)) == lte_to_test.histogram
+        assert lte_to_test.histogram_task is None
+
+    def test_live_histogram_follows_the_edits(self, tmp_path, load_yaml_mapping):
+        _, mapping = load_yaml_mapping(pytest.tests_data_dir / "test_data_thrase.yaml")
+        vpolygon = load_layer(str(pytest.tests_data_dir / "polygon.gpkg"), name="polygon")
+        vfeat = next(vpolygon.getFeatures())
+
+        test_data_to_edit_path = tmp_path / "test_data_edited.tif"
+        test_data_to_edit_path.write_bytes((pytest.tests_data_dir / "test_data.tif").read_bytes())
+        layer_data_to_edit = load_layer(str(test_data_to_edit_path), name="test_data_edited")
+
+        lte_to_test = LayerToEdit(layer_data_to_edit, band=1)
+        lte_to_test.setup_pixel_table()
+        lte_to_test.old_new_value = mapping
+        LayerToEdit.current = lte_to_test
+        lte_to_test.get_pixel_counts()
+
+        # the live histogram is updated from the edits, without reading the raster again
+        assert LayerToEdit.current.edit_from_polygon_picker(vfeat)
+        assert lte_to_test.histogram == compute_band_histogram(str(test_data_to_edit_path), 1)
+        LayerToEdit.current.edit_to_entire_thematic_raster()
+        assert lte_to_test.histogram == compute_band_histogram(str(test_data_to_edit_path), 1)
+
+    def test_hover_highlight_updates_only_the_changed_rows(self, thrase_dialog):
+        from qgis.PyQt.QtWidgets import QTableView
+
+        layer_data = load_layer(str(pytest.tests_data_dir / "test_data.tif"), name="test_data")
+        lte_to_test = LayerToEdit(layer_data, band=1)
+        lte_to_test.setup_pixel_table()
+        table_model = RecodePixelTableModel()
+        table_model.set_pixels(lte_to_test.pixels)
+        thrase_dialog.recode_pixel_table_model = table_model
+        thrase_dialog.recodePixelTable = QTableView()
+        thrase_dialog.recodePixelTable.setModel(table_model)
+        lte_to_test.index_pixel_rows()
+
+        changed_rows = []
+        table_model.dataChanged.connect(
+            lambda top_left, bottom_right, *_: changed_rows.extend(range(top_left.row(), bottom_right.row() + 1))
+        )
+
+        def highlighted_rows():
+            return [
+                row_idx
+                for row_idx in range(table_model.rowCount())
+                if table_model.data(table_model.index(row_idx, 2), Qt.ItemDataRole.BackgroundRole) is not None
+            ]
+
+        first, last = lte_to_test.pixels[0]["value"], lte_to_test.pixels[-1]["value"]
+        lte_to_test.highlight_value_in_recode_pixel_table(first)
+        assert highlighted_rows() == [0]
+        changed_rows.clear()
+        lte_to_test.highlight_value_in_recode_pixel_table(last)
+        assert highlighted_rows() == [table_model.rowCount() - 1]
+        assert sorted(changed_rows) == [0, table_model.rowCount() - 1]
+        changed_rows.clear()
+        lte_to_test.highlight_value_in_recode_pixel_table(last)
+        assert changed_rows == []
+        lte_to_test.highlight_value_in_recode_pixel_table(None)
+        assert highlighted_rows() == []
+
     def test_freehand_edit(self, tmp_path, load_yaml_mapping):
         # original source tif
         src = pytest.tests_data_dir / "test_data.tif"
@@ -0,0 +1,132 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+from ThRasE.core.editing import PixelGrid
+from ThRasE.core.pixel_log_store import PixelLogStore
+
+
+def _logged(store):
+    return {
+        (int(store.rows[slot]), int(store.cols[slot])): (int(store.old_values[slot]), int(store.new_values[slot]))
+        for slot in store.live_slots()
+    }
+
+
+def test_pixels_are_logged_once_and_removed_when_restored():
+    store = PixelLogStore(width=10)
+    store.add(1, 2, 3, 4, "a")
+    store.add(1, 2, 4, 5, "b")
+    assert _logged(store) == {(1, 2): (3, 5)}
+    assert store.group_id(store.lookup_one(1, 2)) == "b"
+    store.add(1, 2, 5, 3, "c")
+    assert len(store) == 0
+    assert store.lookup_one(1, 2) == -1
+
+
+def test_bulk_insert_from_nonzero():
+    store = PixelLogStore(width=100)
+    store.recent_limit = 8
+    changed = np.zeros((50, 100), dtype=bool)
+    changed[10:20, 30:60] = True
+    rows, cols = np.nonzero(changed)
+    store.add_many(rows, cols, np.full(len(rows), 1), np.full(len(rows), 2), "first")
+    assert len(store) == 300
+    # edit again half of them: back to the original value or to another class
+    store.add_many(rows[:100], cols[:100], np.full(100, 2), np.full(100, 1), "second")
+    store.add_many(rows[100:150], cols[100:150], np.full(50, 2), np.full(50, 7), "third")
+    assert len(store) == 200
+    assert (store.lookup(rows[:100], cols[:100]) == -1).all()
+    assert _logged(store)[int(rows[120]), int(cols[120])] == (1, 7)
+
+    members = store.group_members()
+    assert {group_id: len(slots) for group_id, slots in members.items()} == {"first": 150, "third": 50}
+
+
+def test_serialize_and_restore_round_trip():
+    grid = PixelGrid(0.0, 100.0, 10.0, 10.0)
+    store = PixelLogStore(width=10)
+    store.add_many([0, 1], [0, 1], [1, 1], [2, 3], "a", datetime(2024, 1, 1, 10))
+    store.add(5, 5, 4, 6, "b", datetime(2024, 1, 2, 10))
+    records = store.serialize(grid)
+    assert [(r["x"], r["y"], r["group_id"]) for r in records] == [
+        (5.0, 95.0, "a"),
+        (15.0, 85.0, "a"),
+        (55.0, 45.0, "b"),
+    ]
+
+    restored = PixelLogStore(width=10)
+    positions = [grid.position(r["x"], r["y"]) for r in records]
+    restored.restore(
+        [row for _, row in positions],
+        [col for col, _ in positions],
+        [r["old_value"] for r in records],
+        [r["new_value"] for r in records],
+        [datetime.fromisoformat(r["edit_date"]) for r in records],
+        [r["group_id"] for r in records],
+    )
+    assert _logged(restored) == _logged(store)
+    assert restored.serialize(grid) == records
+
+
+def test_group_members_are_updated_incrementally():
+    store = PixelLogStore(width=10)
+    assert store.take_dirty_groups() is None
+    store.add_many([0, 0, 0], [0, 1, 2], [1, 1, 1], [2, 2, 2], "a")
+    store.add_many([1, 1], [0, 1], [1, 1], [3, 3], "b")
+    assert store.take_dirty_groups() == {"a", "b"}
+    assert store.take_dirty_groups() == set()
+
+    # a pixel of "a" edited again in "c", and one pixel of "b" back to its original value
+    store.add(0, 1, 2, 4, "c")
+    store.add(1, 0, 3, 1, "d")
+    assert store.take_dirty_groups() == {"a", "b", "c"}
+    assert [(int(store.rows[slot]), int(store.cols[slot])) for slot in store.members("a")] == [(0, 0), (0, 2)]
+    assert [(int(store.rows[slot]), int(store.cols[slot])) for slot in store.members("b")] == [(1, 1)]
+    assert len(store.members("c")) == 1
+    assert len(store.members("d")) == 0
+    assert {group_id: slots.tolist() for group_id, slots in store.group_members().items()} == {
+        group_id: store.members(group_id).tolist() for group_id in ("a", "b", "c")
+    }
+
+
+def test_save_and_lazy_load_round_trip(tmp_path):
+    store = PixelLogStore(width=100)
+    store.add_many(np.array([1, 2]), np.array([3, 4]), np.array([1, 1]), np.array([2, 2]), "a", datetime(2024, 1, 1))
+    store.add(7, 7, 5, 6, "b", datetime(2024, 1, 2))
+    file_path = str(tmp_path / "session_pixel_logs.npz")
+    store.save(file_path)
+
+    restored = PixelLogStore(width=100)
+    restored.load(file_path, lazy=True, count=len(store))
+    # nothing is read until the store is used
+    assert restored.pending_file == file_path and len(restored) == 3
+    assert restored.take_dirty_groups() is None and restored.pending_file is None
+    assert _logged(restored) == _logged(store)
+    assert {group_id: len(slots) for group_id, slots in restored.group_members().items()} == {"a": 2, "b": 1}
+    assert restored.edit_date(restored.lookup_one(7, 7)) == datetime(2024, 1, 2)
+
+    # an edit over the pixel logs not loaded yet is merged with them
+    restored.load(file_path, lazy=True, count=len(store))
+    restored.add(7, 7, 6, 5, "c")
+    assert len(restored) == 2
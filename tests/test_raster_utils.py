@@ -0,0 +1,350 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import numpy as np
+import pytest
+from osgeo import gdal, ogr
+from qgis.core import QgsGeometry, QgsPointXY
+
+from ThRasE.utils.raster_utils import (
+    BlockCache,
+    ChangeSet,
+    RecodeCanceled,
+    array_histogram,
+    burn_cells_to_raster,
+    check_recode_values,
+    compute_band_histogram,
+    get_band_histogram,
+    iter_block_windows,
+    polygonize_cells,
+    polyline_corridor_mask,
+    rasterize_geometry,
+    recode_array,
+    recode_raster_file,
+    rollback_raster_file,
+)
+
+
+class TestRecodeKernel:
+    @pytest.mark.parametrize("dtype", [np.uint8, np.int8, np.uint16, np.int16, np.int32, np.uint32])
+    def test_recode_matches_per_class_loop(self, dtype):
+        rng = np.random.default_rng(0)
+        values = np.arange(0, 120, dtype=dtype)
+        array = rng.choice(values, size=(64, 80)).astype(dtype)
+        # swapped classes must not cascade, identity and absent values must not change anything
+        old_new_value = {1: 2, 2: 1, 5: 5, 7: 110, 119: 0, 500: 3}
+
+        expected = array.copy()
+        for old_value, new_value in old_new_value.items():
+            expected[array == old_value] = new_value
+
+        new_array, changed = recode_array(array, old_new_value)
+        assert new_array.dtype == array.dtype
+        np.testing.assert_array_equal(new_array, expected)
+        np.testing.assert_array_equal(changed, expected != array)
+
+    @pytest.mark.parametrize("dtype", [np.int8, np.int32, np.uint32])
+    def test_non_integer_old_values_do_not_match_integer_bands(self, dtype):
+        array = np.array([[1, 2], [3, 2]], dtype=dtype)
+        new_array, changed = recode_array(array, {2.5: 9, 3: 4, -1: 5})
+        np.testing.assert_array_equal(new_array, np.array([[1, 2], [4, 2]], dtype=dtype))
+        np.testing.assert_array_equal(changed, new_array != array)
+
+    @pytest.mark.parametrize("dtype", [np.float32, np.float64])
+    def test_recode_float_band(self, dtype):
+        array = np.array([[0.1, 2.0], [2.5, 2.0]], dtype=dtype)
+        # the old values as read from the band, e.g. 0.1 in float32 is not 0.1 in float64
+        old_new_value = {float(array[0, 0]): 1.5, 2.5: 9.25, 2: 2}
+        new_array, changed = recode_array(array, old_new_value)
+        assert new_array.dtype == array.dtype
+        np.testing.assert_array_equal(new_array, np.array([[1.5, 2.0], [9.25, 2.0]], dtype=dtype))
+        np.testing.assert_array_equal(changed, [[True, False], [True, False]])
+
+    def test_recode_values_must_fit_the_dtype(self):
+        check_recode_values({1: 255, 2: 0}, np.uint8)
+        check_recode_values({1: 256, 2: -1}, np.int16)
+        with pytest.raises(ValueError, match="256"):
+            check_recode_values({1: 256}, np.uint8)
+        with pytest.raises(ValueError, match="-1"):
+            recode_array(np.zeros((2, 2), dtype=np.uint16), {0: -1})
+
+
+class TestHistogram:
+    @pytest.mark.parametrize("dtype", [np.uint8, np.int8, np.uint16, np.int16, np.int32, np.float32])
+    def test_histogram_matches_unique(self, dtype):
+        array = np.random.default_rng(0).integers(-100, 100, size=(40, 50)).astype(dtype)
+        values, counts = array_histogram(array)
+        expected_values, expected_counts = np.unique(array, return_counts=True)
+        assert np.array_equal(values, expected_values)
+        assert np.array_equal(counts, expected_counts)
+
+
+class TestBlockWindows:
+    @pytest.mark.parametrize(
+        "memory_budget",
+        [
+            64 * 64 * 3,  # one native block
+            64 * 64 * 3 * 2,  # chunks of blocks inside a block row
+            200 * 64 * 3,  # full-width strips of one block row
+            200 * 150 * 3,  # the whole band
+        ],
+    )
+    def test_windows_are_aligned_and_cover_the_band_once(self, tmp_path, memory_budget):
+        # 200x150 pixels in 64x64 blocks, with partial blocks at the right and bottom edges
+        dataset = gdal.GetDriverByName("GTiff").Create(
+            str(tmp_path / "blocks.tif"), 200, 150, 1, gdal.GDT_Byte, ["TILED=YES", "BLOCKXSIZE=64", "BLOCKYSIZE=64"]
+        )
+        band = dataset.GetRasterBand(1)
+        coverage = np.zeros((150, 200), dtype=np.uint8)
+        for xoff, yoff, cols, rows in iter_block_windows(band, memory_budget):
+            assert xoff % 64 == 0 and yoff % 64 == 0
+            assert (xoff + cols) % 64 == 0 or xoff + cols == 200
+            assert (yoff + rows) % 64 == 0 or yoff + rows == 150
+            # input, output and changed mask of the window
+            assert cols * rows * 3 <= memory_budget
+            coverage[yoff : yoff + rows, xoff : xoff + cols] += 1
+        assert np.all(coverage == 1)
+
+
+class TestBlockCache:
+    @pytest.mark.parametrize("block_size", [(300, 1), (64, 64), (17, 9)])
+    def test_lookups_and_write_through(self, block_size):
+        array = np.random.default_rng(0).integers(0, 255, size=(200, 300), dtype=np.uint8)
+        reads = []
+
+        def read_window(xoff, yoff, cols, rows):
+            reads.append((xoff, yoff, cols, rows))
+            return array[yoff : yoff + rows, xoff : xoff + cols].copy()
+
+        cache = BlockCache(read_window, 300, 200, block_size, max_tiles=4)
+        cols = np.arange(0, 300, 7)
+        rows = np.arange(0, 200, 200 / len(cols)).astype(int)
+        assert np.array_equal(cache.get_values(cols, rows), array[rows, cols])
+        assert cache.get_value(299, 199) == array[199, 299]
+        assert cache.get_value(300, 0) is None
+
+        # the edits write through the cached tiles, without reading them again
+        cache.get_value(10, 10)
+        reads.clear()
+        edited = np.full((20, 30), 7, dtype=np.uint8)
+        array[5:25, 0:30] = edited
+        cache.update(edited, 0, 5)
+        assert cache.get_value(10, 10) == 7
+        assert not reads
+
+
+class TestRasterizeGeometry:
+    # 6x6 grid of 1x1 pixels with the origin at the bottom left
+    geo_transform = (0, 1, 0, 6, 0, -1)
+
+    def test_pixel_center_and_all_touched(self):
+        wkb = bytes(ogr.CreateGeometryFromWkt("POLYGON ((0.6 0.6, 4.4 0.6, 4.4 4.4, 0.6 4.4, 0.6 0.6))").ExportToWkb())
+        expected = np.zeros((6, 6), dtype=bool)
+        # pixel centers from x 1.5 to 3.5 and y 1.5 to 3.5
+        expected[2:5, 1:4] = True
+        np.testing.assert_array_equal(rasterize_geometry(wkb, self.geo_transform, 6, 6), expected)
+
+        expected = np.zeros((6, 6), dtype=bool)
+        # pixels from x 0 to 5 and y 0 to 5
+        expected[1:6, 0:5] = True
+        np.testing.assert_array_equal(rasterize_geometry(wkb, self.geo_transform, 6, 6, all_touched=True), expected)
+
+    def test_polygon_with_a_hole(self):
+        wkb = bytes(
+            ogr.CreateGeometryFromWkt(
+                "POLYGON ((0 0, 6 0, 6 6, 0 6, 0 0), (2.2 2.2, 3.8 2.2, 3.8 3.8, 2.2 3.8, 2.2 2.2))"
+            ).ExportToWkb()
+        )
+        expected = np.ones((6, 6), dtype=bool)
+        # the pixels with the center in the hole
+        expected[2:4, 2:4] = False
+        np.testing.assert_array_equal(rasterize_geometry(wkb, self.geo_transform, 6, 6), expected)
+        # all the pixels of the hole touch the polygon
+        assert rasterize_geometry(wkb, self.geo_transform, 6, 6, all_touched=True).all()
+
+
+class TestPolylineCorridor:
+    def test_corridor_follows_geometry_distance(self):
+        # 40x30 grid of 10x10 map units starting at (1000, 5000)
+        geo_transform = (1000.0, 10.0, 0, 5000.0, 0, -10.0)
+        cols, rows = 40, 30
+        vertices = [(1012.0, 4985.0), (1180.0, 4870.0), (1330.0, 4900.0), (1345.0, 4740.0)]
+        line_buffer = 1.5
+
+        mask = polyline_corridor_mask(vertices, geo_transform, cols, rows, line_buffer)
+
+        line = QgsGeometry.fromPolylineXY([QgsPointXY(x, y) for x, y in vertices])
+        distance = np.zeros((rows, cols))
+        for row in range(rows):
+            for col in range(cols):
+                centroid = QgsGeometry.fromPointXY(QgsPointXY(1000.0 + (col + 0.5) * 10, 5000.0 - (row + 0.5) * 10))
+                distance[row, col] = line.distance(centroid)
+
+        # all pixels edited are inside the buffer and the core of the corridor is always edited
+        assert not (mask & (distance > 10 * line_buffer)).any()
+        assert mask[distance <= 10 * (line_buffer - 1)].all()
+
+    def test_corridor_outside_grid(self):
+        geo_transform = (0.0, 1.0, 0, 10.0, 0, -1.0)
+        mask = polyline_corridor_mask([(50.0, 50.0), (60.0, 60.0)], geo_transform, 10, 10, 2)
+        assert not mask.any()
+
+
+class TestBurnCells:
+    def test_only_the_tiles_with_cells_are_written(self):
+        file_path = "/vsimem/test_burn_cells.tif"
+        rows, cols = np.array([3, 3, 600]), np.array([5, 5, 299])
+        burn_cells_to_raster(file_path, 300, 700, (0.0, 1.0, 0, 700.0, 0, -1.0), "", rows, cols, np.array([1, 2, 3]))
+
+        dataset = gdal.Open(file_path)
+        band = dataset.GetRasterBand(1)
+        array = band.ReadAsArray()
+        assert band.GetNoDataValue() == 0
+        # the later cells overwrite the earlier ones
+        assert array[3, 5] == 2 and array[600, 299] == 3 and np.count_nonzero(array) == 2
+        # tiles without cells stay sparse
+        assert band.GetMetadataItem("BLOCK_OFFSET_0_1", "TIFF") in (None, "", "0")
+        del band, dataset
+        gdal.Unlink(file_path)
+
+    def test_outline_is_dissolved_across_the_tiles(self):
+        # L shape of 19 cells over several tiles of 4x4, and one cell apart
+        rows = np.array([*range(10), *[9] * 9, 20])
+        cols = np.array([*[0] * 10, *range(1, 10), 20])
+        outline = polygonize_cells(rows, cols, (0.0, 1.0, 0, 30.0, 0, -1.0), 30, tile_size=4)
+
+        assert outline.GetArea() == 20
+        assert ogr.ForceToMultiPolygon(outline.Clone()).GetGeometryCount() == 2
+        assert outline.GetEnvelope() == (0.0, 21.0, 9.0, 30.0)
+        assert polygonize_cells(np.array([], int), np.array([], int), (0.0, 1.0, 0, 30.0, 0, -1.0), 30) is None
+
+
+class TestRecodeRasterFile:
+    class CancelAfter:
+        """Feedback canceled after a number of windows written"""
+
+        def __init__(self, windows):
+            self.windows = windows
+            self.checks = 0
+
+        def isCanceled(self):
+            self.checks += 1
+            return self.checks > self.windows
+
+        def setProgress(self, progress):
+            pass
+
+    @staticmethod
+    def create_raster(file_path, array, data_type=gdal.GDT_Byte):
+        driver = gdal.GetDriverByName("GTiff")
+        dataset = driver.Create(
+            str(file_path),
+            array.shape[1],
+            array.shape[0],
+            1,
+            data_type,
+            ["TILED=YES", "BLOCKXSIZE=64", "BLOCKYSIZE=64"],
+        )
+        dataset.SetGeoTransform((0, 1, 0, array.shape[0], 0, -1))
+        dataset.GetRasterBand(1).WriteArray(array)
+        dataset.FlushCache()
+        del dataset
+
+    def test_cancel_leaves_the_file_untouched(self, tmp_path):
+        array = np.random.default_rng(0).integers(0, 4, size=(256, 256), dtype=np.uint8)
+        file_path = tmp_path / "thematic.tif"
+        self.create_raster(file_path, array)
+
+        # windows of one native block (16 blocks of 64x64)
+        with pytest.raises(RecodeCanceled):
+            recode_raster_file(
+                str(file_path), 1, {1: 2, 2: 1}, memory_budget=64 * 64 * 3, workers=1, feedback=self.CancelAfter(5)
+            )
+
+        dataset = gdal.Open(str(file_path))
+        assert np.array_equal(dataset.GetRasterBand(1).ReadAsArray(), array)
+
+    def test_rollback_restores_the_pixels_changed(self, tmp_path):
+        array = np.random.default_rng(0).integers(0, 4, size=(256, 256), dtype=np.uint8)
+        file_path = tmp_path / "thematic.tif"
+        self.create_raster(file_path, array)
+
+        change_set = ChangeSet(str(tmp_path / "change_set.bin"))
+        count, _, _ = recode_raster_file(
+            str(file_path), 1, {1: 2}, memory_budget=64 * 64 * 3, workers=1, change_set=change_set
+        )
+        assert len(change_set) == count == np.count_nonzero(array == 1)
+        # the change set is much smaller than the band
+        assert (tmp_path / "change_set.bin").stat().st_size < array.nbytes // 2
+
+        restored, value_changes, changes = rollback_raster_file(str(file_path), 1, change_set, record=True)
+        assert restored == count and value_changes == {(2, 1): count}
+        assert np.array_equal(array[changes[0], changes[1]], changes[3])
+        dataset = gdal.Open(str(file_path))
+        assert np.array_equal(dataset.GetRasterBand(1).ReadAsArray(), array)
+
+    def test_rollback_keeps_the_float_values(self, tmp_path):
+        array = np.random.default_rng(0).choice(np.array([0.5, 1.25, 3.0], dtype=np.float32), size=(128, 128))
+        file_path = tmp_path / "thematic_float.tif"
+        self.create_raster(file_path, array, gdal.GDT_Float32)
+
+        change_set = ChangeSet(str(tmp_path / "change_set.bin"))
+        count, _, _ = recode_raster_file(str(file_path), 1, {1.25: 2.5}, workers=1, change_set=change_set)
+        restored, value_changes, changes = rollback_raster_file(str(file_path), 1, change_set, record=True)
+        assert restored == count and value_changes == {(2.5, 1.25): count}
+        assert changes[3].dtype == np.float32 and np.all(changes[3] == 1.25)
+        dataset = gdal.Open(str(file_path))
+        assert np.array_equal(dataset.GetRasterBand(1).ReadAsArray(), array)
+
+    def test_workers_give_the_same_result_as_one_worker(self, tmp_path):
+        array = np.random.default_rng(0).integers(0, 4, size=(256, 256), dtype=np.uint8)
+        results = []
+        for workers in (1, 2):
+            file_path = tmp_path / f"thematic_{workers}.tif"
+            self.create_raster(file_path, array)
+            values, counts = np.unique(array, return_counts=True)
+            histogram = compute_band_histogram(str(file_path), 1, memory_budget=64 * 64, workers=workers)
+            assert histogram == dict(zip(values.tolist(), counts.tolist(), strict=True))
+            count, value_changes, changes = recode_raster_file(
+                str(file_path), 1, {1: 2, 3: 0}, memory_budget=64 * 64 * 3, record=True, workers=workers
+            )
+            dataset = gdal.Open(str(file_path))
+            results.append((count, value_changes, changes, dataset.GetRasterBand(1).ReadAsArray()))
+            del dataset
+
+        (count, value_changes, changes, edited), (count_2, value_changes_2, changes_2, edited_2) = results
+        assert count == count_2 == np.count_nonzero((array == 1) | (array == 3))
+        assert value_changes == value_changes_2
+        assert all(np.array_equal(column, column_2) for column, column_2 in zip(changes, changes_2, strict=True))
+        assert np.array_equal(edited, edited_2)
+
+    def test_histogram_is_cached_until_the_file_changes(self, tmp_path):
+        array = np.random.default_rng(0).integers(0, 4, size=(256, 256), dtype=np.uint8)
+        file_path = tmp_path / "thematic.tif"
+        self.create_raster(file_path, array)
+
+        values, counts = np.unique(array, return_counts=True)
+        histogram = get_band_histogram(str(file_path), 1, memory_budget=64 * 64)
+        assert histogram == dict(zip(values.tolist(), counts.tolist(), strict=True))
+        assert get_band_histogram(str(file_path), 1) is histogram
+
+        recode_raster_file(str(file_path), 1, {1: 2}, workers=1)
+        histogram = get_band_histogram(str(file_path), 1)
+        assert histogram[2] == int(counts[1] + counts[2]) and 1 not in histogram
@@ -0,0 +1,112 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import pytest
+from qgis.PyQt.QtCore import Qt
+
+from ThRasE.gui.recode_pixel_table import NEW_VALUE, PIXELS, SHOW_HIDE, RecodePixelTableModel, parse_new_value
+
+
+def _pixels(count):
+    return [
+        {"value": value, "color": {"R": 0, "G": 0, "B": 0, "A": 255}, "new_value": None, "s/h": True, "label": ""}
+        for value in range(count)
+    ]
+
+
+@pytest.fixture
+def table_model(qgis_app):
+    table_model = RecodePixelTableModel()
+    table_model.set_pixels(_pixels(2000), {value: value * 10 for value in range(2000)})
+    changed = []
+    table_model.dataChanged.connect(
+        lambda top_left, bottom_right, *_: changed.append(
+            (top_left.row(), bottom_right.row(), top_left.column(), bottom_right.column())
+        )
+    )
+    table_model.changed = changed
+    return table_model
+
+
+def test_parse_new_value():
+    assert parse_new_value("", 3) is None
+    assert parse_new_value(" 7 ", 3) == 7
+    assert parse_new_value("3", 3) is None
+    with pytest.raises(ValueError):
+        parse_new_value("2.5", 3)
+    with pytest.raises(ValueError):
+        parse_new_value("abc", 3)
+
+
+def test_edit_refreshes_only_the_edited_row(table_model):
+    edited = []
+    table_model.pixelsEdited.connect(lambda: edited.append(True))
+
+    assert table_model.setData(table_model.index(1500, NEW_VALUE), "9")
+    assert table_model.pixels[1500]["new_value"] == 9
+    assert table_model.data(table_model.index(1500, NEW_VALUE)) == "9"
+    assert table_model.changed == [(1500, 1500, 0, PIXELS)]
+    # invalid values are not set
+    assert not table_model.setData(table_model.index(1500, NEW_VALUE), "x")
+    assert table_model.pixels[1500]["new_value"] == 9
+
+    assert table_model.setData(table_model.index(3, SHOW_HIDE), Qt.CheckState.Unchecked, Qt.ItemDataRole.CheckStateRole)
+    assert table_model.pixels[3]["s/h"] is False
+    assert edited == [True, True]
+
+
+def test_pixel_counts_refresh_only_the_changed_rows(table_model):
+    pixel_counts = dict(table_model.pixel_counts)
+    pixel_counts.update({10: 0, 11: 0, 500: 1})
+    table_model.set_pixel_counts(pixel_counts)
+    assert table_model.changed == [(10, 11, PIXELS, PIXELS), (500, 500, PIXELS, PIXELS)]
+    assert table_model.data(table_model.index(500, PIXELS)) == "1"
+
+
+def test_pixel_counts_updated_in_place_refresh_the_row(qgis_app):
+    table_model = RecodePixelTableModel()
+    # the live histogram of the layer, updated in place by the edits
+    histogram = {0: 5, 1: 7}
+    table_model.set_pixels(_pixels(3), histogram)
+    changed = []
+    table_model.dataChanged.connect(
+        lambda top_left, bottom_right, *_: changed.append((top_left.row(), bottom_right.row()))
+    )
+
+    histogram[1] -= 2
+    histogram[2] = 2
+    table_model.set_pixel_counts(histogram)
+    assert changed == [(1, 2)]
+    assert table_model.data(table_model.index(1, PIXELS)) == "5"
+    assert table_model.data(table_model.index(2, PIXELS)) == "2"
+
+
+def test_pixel_counts_read_in_background_refresh_all_rows(qgis_app):
+    table_model = RecodePixelTableModel()
+    table_model.set_pixels(_pixels(3))
+    assert table_model.data(table_model.index(0, PIXELS)) == ""
+    changed = []
+    table_model.dataChanged.connect(
+        lambda top_left, bottom_right, *_: changed.append((top_left.row(), bottom_right.row()))
+    )
+
+    table_model.set_pixel_counts({1: 4})
+    assert changed == [(0, 2)]
+    assert table_model.data(table_model.index(0, PIXELS)) == "0"
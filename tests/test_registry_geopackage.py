@@ -0,0 +1,71 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from datetime import datetime
+
+import numpy as np
+from osgeo import osr
+
+from ThRasE.core.editing import PixelGrid
+from ThRasE.core.pixel_log_store import PixelLogStore
+from ThRasE.core.registry_geopackage import RegistryGeoPackage
+
+
+def _sidecar(tmp_path):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32618)
+    grid = PixelGrid(1000.0, 2000.0, 10.0, 10.0)
+    return RegistryGeoPackage(RegistryGeoPackage.sidecar_path(str(tmp_path / "thematic.tif")), grid, srs.ExportToWkt())
+
+
+def test_sidecar_is_synced_by_the_groups_changed(tmp_path):
+    store = PixelLogStore(width=100)
+    sidecar = _sidecar(tmp_path)
+    assert sidecar.file_path.endswith("thematic_thrase_registry.gpkg")
+
+    store.add_many(np.array([0, 0, 1]), np.array([0, 1, 0]), np.full(3, 1), np.full(3, 2), "a", datetime(2024, 1, 1))
+    store.add_many(np.array([50]), np.array([50]), np.full(1, 3), np.full(1, 4), "b", datetime(2024, 1, 2))
+    store.take_dirty_groups()
+    sidecar.sync(store)
+
+    # the pixel (0, 1) goes back to its original value and (1, 0) moves to the group "c"
+    store.add(0, 1, 2, 1, "c", datetime(2024, 1, 3))
+    store.add(1, 0, 2, 5, "c", datetime(2024, 1, 3))
+    sidecar.sync(store, store.take_dirty_groups())
+
+    rows, cols, old_values, new_values, edit_times, group_ids = sidecar.read_columns()
+    logged = {
+        (row, col): (old, new, group)
+        for row, col, old, new, group in zip(
+            rows.tolist(), cols.tolist(), old_values.tolist(), new_values.tolist(), group_ids, strict=True
+        )
+    }
+    assert logged == {(0, 0): (1, 2, "a"), (1, 0): (1, 5, "c"), (50, 50): (3, 4, "b")}
+    assert np.all(np.diff(edit_times) >= 0)
+
+    # only the pixels inside the extent, with the spatial index
+    rows, cols, *_ = sidecar.read_columns(extent=(1000.0, 1980.0, 1020.0, 2000.0))
+    assert sorted(zip(rows.tolist(), cols.tolist(), strict=True)) == [(0, 0), (1, 0)]
+
+    # the restored store matches the saved one
+    restored = PixelLogStore(width=100)
+    restored.restore(*sidecar.read_columns())
+    assert len(restored) == len(store) == 3
+    sidecar.close()
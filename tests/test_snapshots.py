@@ -0,0 +1,83 @@
+"""
+/***************************************************************************
+ ThRasE
+
+ A powerful and fast thematic raster editor Qgis plugin
+                              -------------------
+        copyright            : (C) 2019-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import numpy as np
+
+from ThRasE.core.snapshots import BLOCK_HEADER, RasterSnapshots
+
+
+def test_snapshots_are_copy_on_write_by_blocks(tmp_path):
+    raster = np.arange(10 * 7, dtype=np.uint8).reshape(10, 7)
+    original = raster.copy()
+
+    def read_window(xoff, yoff, cols, rows):
+        return raster[yoff : yoff + rows, xoff : xoff + cols].copy()
+
+    def write(xoff, yoff, values):
+        rows, cols = values.shape
+        snapshots.preserve(read_window, xoff, yoff, cols, rows)
+        raster[yoff : yoff + rows, xoff : xoff + cols] = values
+
+    snapshots = RasterSnapshots(str(tmp_path / "layer.tif"), 1, 7, 10, (4, 4), np.uint8)
+    first = snapshots.take("first")
+    assert first.size() == 0
+
+    write(5, 8, np.full((2, 2), 200, dtype=np.uint8))
+    write(6, 9, np.full((1, 1), 201, dtype=np.uint8))
+    # only the edge block written was saved, once
+    assert list(first.offsets) == [(1, 2)]
+
+    second = snapshots.take()
+    write(0, 0, np.full((1, 1), 99, dtype=np.uint8))
+
+    rows, cols, old_values, new_values = snapshots.diff(first, read_window)
+    assert len(rows) == 5 and (old_values == original[rows, cols]).all() and (new_values == raster[rows, cols]).all()
+
+    # the blocks of the second snapshot are kept in the first one after deleting it
+    snapshots.remove(second)
+    reloaded = RasterSnapshots(str(tmp_path / "layer.tif"), 1, 7, 10, (4, 4), np.uint8)
+    assert [snapshot.name for snapshot in reloaded.snapshots] == ["first"]
+    assert set(reloaded.snapshots[0].offsets) == {(0, 0), (1, 2)}
+
+    for (xoff, yoff, _, _), values, _, _ in reloaded.compare(reloaded.snapshots[0], read_window):
+        raster[yoff : yoff + values.shape[0], xoff : xoff + values.shape[1]] = values
+    assert (raster == original).all()
+    assert not len(reloaded.diff(reloaded.snapshots[0], read_window)[0])
+
+
+def test_torn_records_are_dropped(tmp_path):
+    raster = np.arange(8 * 8, dtype=np.uint8).reshape(8, 8)
+
+    def read_window(xoff, yoff, cols, rows):
+        return raster[yoff : yoff + rows, xoff : xoff + cols].copy()
+
+    snapshots = RasterSnapshots(str(tmp_path / "layer.tif"), 1, 8, 8, (4, 4), np.uint8)
+    snapshot = snapshots.take()
+    snapshots.preserve(read_window, 0, 0, 1, 1)
+    # the last record written when QGIS crashed, its size fits in the file after a new record
+    with open(snapshot.file_path, "ab") as snapshot_file:
+        snapshot_file.write(BLOCK_HEADER.pack(1, 0, 10))
+
+    reloaded = RasterSnapshots(str(tmp_path / "layer.tif"), 1, 8, 8, (4, 4), np.uint8)
+    reloaded.preserve(read_window, 4, 4, 1, 1)
+    reloaded = RasterSnapshots(str(tmp_path / "layer.tif"), 1, 8, 8, (4, 4), np.uint8)
+    snapshot = reloaded.snapshots[0]
+    assert set(snapshot.offsets) == {(0, 0), (1, 1)}
+    assert np.array_equal(snapshot.read((1, 1), (4, 4), np.uint8), raster[4:8, 4:8])
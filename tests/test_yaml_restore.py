@@ -259,24 +259,9 @@ def test_restore_recode_table_rebuilds_old_new_value(monkeypatch):
         old_new_value={1: 99, 2: 88},
     )
     LayerToEdit.current = restored
-    class _Item:
-        def __init__(self, text, checked=True):
-            self._text = text
-            self._checked = checked
-
-        def text(self):
-            return self._text
-
-        def checkState(self):
-            return 2 if self._checked else 0
-
-    def set_table():
-        dialog.recodePixelTable = SimpleNamespace(
-            item=lambda row, column: _Item("5" if row == 0 and column == 3 else "", column != 1 or row == 0)
-        )
-
     dialog = SimpleNamespace(
-        set_recode_pixel_table=set_table,
+        set_recode_pixel_table=lambda: None,
+        recode_pixel_table_model=SimpleNamespace(pixel_counts={}, refresh_rows=lambda _rows: None),
         update_recode_pixel_table=lambda: main_dialog.ThRasEDialog.update_recode_pixel_table.__wrapped__(dialog),
         NavigationBlockWidget=SimpleNamespace(setEnabled=lambda _value: None),
         QGBox_GlobalEditTools=SimpleNamespace(setEnabled=lambda _value: None),